@@ -22,7 +22,7 @@ let parse_input ~sample_sheet ~species_tree_file ~alignments_dir ~seq2sp_dir ~fa
       |> seq ~sep:"\n"
       )
       in
-  workflow ~np:1 ~descr:"Parse input" ~version:13 ~mem:(memory * 1024) [
+  workflow ~np:1 ~descr:"Parse input" ~version:15 ~mem:(memory * 1024) [
     mkdir_p dest;
     cmd "ParseInput.py"  [ dep sample_sheet ;
                            dep species_tree_file;
@@ -36,11 +36,12 @@ let parse_input ~sample_sheet ~species_tree_file ~alignments_dir ~seq2sp_dir ~fa
 let ref_transcriptomes species : (configuration_dir, fasta) selector =
   selector ["R_Sp_transcriptomes" ;  species ^ "_transcriptome.fa" ]
 
-let ref_seq_fam_links species : (configuration_dir, tabular) selector =
-  selector ["R_Sp_Seq_Fam_links";  species ^ "_Fam_Seq.tsv"  ]
+let seq_fam_link_store : (configuration_dir, link_store) selector =
+  selector ["R_Sp_Seq_Fam_links";  "links.store"  ]
 
-let ref_fams species family =
-  selector ["R_Sp_Gene_Families"; species ^ "." ^ family ^ ".fa"]
+(* The families of a species are the members <family>.fa of a single bundle *)
+let ref_fams_bundle species =
+  selector ["R_Sp_Gene_Families"; species ^ ".bundle"]
 
 let ali_species2seq_links family =
   selector ["Alignments_Species2Sequences" ; "alignments." ^  family ^ ".sp2seq.txt" ]
@@ -133,6 +134,15 @@ let concat ?(descr="") = function
       cmd "cat" ~stdout:dest [ list dep ~sep:" " fXs ]
     ]
 
+(* Concatenation of bundle members (<bundle>::<member>), the missing ones are skipped *)
+let bundle_cat ?(descr="") members : fasta workflow =
+  workflow ~descr:("BundleCat.py" ^ descr) [
+    cmd "BundleCat.py" [
+      opt "-o" ident dest ;
+      seq ~sep:" " members ;
+    ]
+  ]
+
 let build_biopythonindex ?(descr="") (fasta:fasta workflow)  : index workflow =
   workflow ~version:1 ~descr:("build_biopythonindex_fasta.py" ^ descr) [
     cmd "build_biopythonindex_fasta.py" [ ident dest; dep fasta ]
@@ -188,66 +198,61 @@ let blast_dbs_of_norm_fasta norm_fasta =
 let seq_dispatcher
     ?s2s_tab_by_family
     ~ref_db
-    ~query
-    ~query_species
-    ~query_id
+    ~(samples : (rna_sample * fasta workflow) list)
     ~ref_transcriptome
+    ~ref_species
     ~threads
-    ~seq2fam : fasta workflow =
-  workflow ~np:threads ~version:9 ~descr:("SeqDispatcher.py:" ^ query_id ^ "_" ^ query_species ^ " ") [
+    ~seq2fam : [`seq_dispatcher] directory workflow =
+  let ids = String.concat ~sep:"_" (List.map samples ~f:(fun (s, _) -> s.id ^ "_" ^ s.species)) in
+  let comma_list f = seq ~sep:"," (List.map samples ~f) in
+  workflow ~np:threads ~version:15 ~descr:("SeqDispatcher.py:" ^ ids ^ " ") [
     mkdir_p tmp;
-    cmd "SeqDispatcher.py"  [
+    (* Run by the dispatch server listening on $CAARS_DISPATCHD if any *)
+    cmd "DispatchClient.py"  [
+      string "SeqDispatcher.py" ;
       option (flag string "--sp2seq_tab_out_by_family" ) s2s_tab_by_family;
+      string "--bundle" ;
+      opt "--fasta-width" int 0 ;
       opt "-d" ident (seq ~sep:"," (List.map ref_db ~f:(fun blast_db -> seq [dep blast_db ; string "/db"]) ));
       opt "-tmp" ident tmp ;
-      opt "-log" seq [ dest ; string ("/SeqDispatcher." ^ query_id ^ "." ^ query_species ^ ".log" )] ;
-      opt "-q" dep query ;
-      opt "-qs" string query_species ;
-      opt "-qid" string query_id ;
+      opt "-log" seq [ dest ; string ("/SeqDispatcher." ^ ids ^ ".log" )] ;
+      opt "-q" ident (comma_list (fun (_, query) -> dep query)) ;
+      opt "-qs" ident (comma_list (fun (s, _) -> string s.species)) ;
+      opt "-qid" ident (comma_list (fun (s, _) -> string s.id)) ;
       opt "-threads" ident np ;
       opt "-t" dep ref_transcriptome ;
       opt "-t2f" dep seq2fam;
-      opt "-out" seq [ dest ; string ("/Trinity." ^ query_id ^ "." ^ query_species )] ;
+      opt "-tsp" string (String.concat ~sep:"," ref_species) ;
+      (* One output directory by sample *)
+      opt "-out" ident (comma_list (fun (s, _) -> seq [ dest ; string ("/" ^ s.id ^ "/Trinity." ^ s.id ^ "." ^ s.species )])) ;
     ]
   ]
 
-let trinity_annotated_fams_of_trinity_assemblies configuration_dir ref_blast_dbs threads=
-  List.map ~f:(fun (s,trinity_assembly) ->
+(* Samples sharing their reference species are dispatched together *)
+let trinity_annotated_fams_of_trinity_assemblies configuration_dir ref_blast_dbs threads trinity_assemblies =
+  let ref_species_key (s, _) = String.concat ~sep:"," s.ref_species in
+  List.sort ~cmp:(fun a b -> compare (ref_species_key a) (ref_species_key b)) trinity_assemblies
+  |> List.group ~break:(fun a b -> not (String.equal (ref_species_key a) (ref_species_key b)))
+  |> List.concat_map ~f:(fun samples ->
+      let (s, _) = List.hd_exn samples in
       let ref_db = List.map s.ref_species ~f:(fun r -> List.Assoc.find_exn ref_blast_dbs r) in
-      let query = trinity_assembly in
-      let query_species= s.species in
-      let query_id = s.id in
       let descr_ref = ":" ^(String.concat ~sep:"_" s.ref_species) in
       let ref_transcriptome = concat ~descr:(descr_ref ^ ".ref_transcriptome") (List.map s.ref_species ~f:(fun r -> (configuration_dir / ref_transcriptomes r))) in
-      let seq2fam = concat ~descr:(descr_ref ^ ".seq2fam") (List.map s.ref_species ~f:(fun r -> (configuration_dir / ref_seq_fam_links r))) in
+      let seq2fam = configuration_dir / seq_fam_link_store in
       let r =
         seq_dispatcher
           ~s2s_tab_by_family:true
-          ~query
-          ~query_species
-          ~query_id
+          ~samples
           ~ref_transcriptome
+          ~ref_species:s.ref_species
           ~seq2fam
           ~ref_db
-          ~threads
+          ~threads:(threads * List.length samples)
       in
-      (s, r)
+      List.map samples ~f:(fun (s, _) -> (s, r / selector [ s.id ]))
     )
 
 
-let concat_without_error ?(descr="") l : fasta workflow =
-   let script = [%bistro{|
-        touch tmp
-        cat tmp {{ seq ~sep:"" l }} > tmp1
-        mv tmp1 {{ ident dest }}
-        |}]
-    in
-    workflow ~descr:("concat_without_error" ^ descr) [
-       mkdir_p tmp;
-       cd tmp;
-       cmd "sh" [ file_dump script];
-    ]
-
 let build_target_query ref_species family configuration trinity_annotated_fams =
     let seq_dispatcher_results_dirs =
         List.filter_map configuration.apytram_samples ~f:(fun s ->
@@ -258,13 +263,12 @@ let build_target_query ref_species family configuration trinity_annotated_fams =
             )
     in
     let get_trinity_annotated_fam_list =
-    List.concat (List.map seq_dispatcher_results_dirs ~f:(fun (s,dir) ->
-        [dep dir ; string ("/Trinity." ^ s.id ^ "." ^ s.species ^ "." ^ family ^ ".fa ")]
+    List.map seq_dispatcher_results_dirs ~f:(fun (s,dir) ->
+        seq [dep dir ; string ("/Trinity." ^ s.id ^ "." ^ s.species ^ ".bundle::" ^ family ^ ".fa")]
       )
-    )
     in
     let descr = ":" ^ family ^ ".seqdispatcher" in
-    concat_without_error ~descr get_trinity_annotated_fam_list
+    bundle_cat ~descr get_trinity_annotated_fam_list
 
 
 let apytram_orfs_ref_fams_of_apytram_annotated_ref_fams apytram_annotated_ref_fams memory =
@@ -280,41 +284,61 @@ let apytram_orfs_ref_fams_of_apytram_annotated_ref_fams apytram_annotated_ref_fa
 
 let checkfamily
   ?(descr="")
+  ?(threads=1)
   ~ref_db
-  ~(input:fasta workflow)
-  ~family
+  ~(inputs:(rna_sample * string * fasta workflow) list)
   ~ref_transcriptome
+  ~ref_species
   ~seq2fam
   ~evalue
-  : fasta workflow =
+  : [`checkfamily] directory workflow =
   let tmp_checkfamily = dest // "tmp" in
-  let dest_checkfamily = dest // "sequences.fa" in
-  workflow ~version:8 ~descr:("CheckFamily.py" ^ descr) [
+  (* One output fasta by sample and family *)
+  let manifest = Bistro.Template.(
+      List.map inputs ~f:(fun (s, f, input) ->
+          seq ~sep:"\t" [ dep input ; string f ; seq [ dest ; string ("/" ^ s.id ^ "/" ^ f ^ ".fa") ] ]
+        )
+      |> seq ~sep:"\n"
+    )
+  in
+  workflow ~np:threads ~version:13 ~descr:("CheckFamily.py" ^ descr) [
     mkdir_p tmp_checkfamily;
     cd tmp_checkfamily;
-    cmd "CheckFamily.py"  [
+    (* Run by the dispatch server listening on $CAARS_DISPATCHD if any *)
+    cmd "DispatchClient.py"  [
+      string "CheckFamily.py" ;
       opt "-tmp" ident tmp_checkfamily ;
-      opt "-i" dep input ;
+      opt "-m" file_dump manifest ;
       opt "-t" dep ref_transcriptome ;
-      opt "-f" string family;
       opt "-t2f" dep seq2fam;
-      opt "-o" ident dest_checkfamily;
+      opt "-tsp" string (String.concat ~sep:"," ref_species) ;
       (*opt "-d" ident (seq ~sep:"," (List.map ref_db ~f:(fun blast_db -> seq [dep blast_db ; string "/db"]) ));*)
       opt "-d" ident (seq ~sep:"," (List.map ref_db ~f:(fun blast_db -> seq [dep blast_db ; string "/db"]) ));
       opt "-e" float evalue; 
+      opt "-threads" ident np ;
+      opt "-log" seq [ dest ; string "/CheckFamily.log" ] ;
     ]
   ]
-  / selector [ "sequences.fa" ]
-
-let apytram_checked_families_of_orfs_ref_fams apytram_orfs_ref_fams configuration_dir ref_blast_dbs =
-  List.map apytram_orfs_ref_fams ~f:(fun (s, f, apytram_orfs_fasta) ->
-    let input = apytram_orfs_fasta in
-    let descr_ref = ":" ^(String.concat ~sep:"_" s.ref_species) in
-    let ref_transcriptome = concat ~descr:(descr_ref ^  ".ref_transcriptome") (List.map s.ref_species ~f:(fun r -> (configuration_dir / ref_transcriptomes r))) in
-    let seq2fam = concat ~descr:(descr_ref ^ ".seq2fam") (List.map s.ref_species ~f:(fun r -> (configuration_dir / ref_seq_fam_links r))) in
-    let ref_db = List.map s.ref_species ~f:(fun r -> List.Assoc.find_exn ref_blast_dbs r) in
-    let checked_families_fasta = checkfamily ~descr:(":"^s.id^"."^f) ~input ~family:f ~ref_transcriptome ~seq2fam ~ref_db ~evalue:1e-40 in
-    (s, f, checked_families_fasta)
+
+(* The families of all samples sharing their reference species are checked together *)
+let apytram_checked_families_of_orfs_ref_fams apytram_orfs_ref_fams configuration_dir ref_blast_dbs threads =
+  let ref_species_key (s, _, _) = String.concat ~sep:"," s.ref_species in
+  let checked_families_by_ref_species =
+    List.sort ~cmp:(fun a b -> compare (ref_species_key a) (ref_species_key b)) apytram_orfs_ref_fams
+    |> List.group ~break:(fun a b -> not (String.equal (ref_species_key a) (ref_species_key b)))
+    |> List.map ~f:(fun inputs ->
+        let (s, _, _) = List.hd_exn inputs in
+        let descr_ref = ":" ^(String.concat ~sep:"_" s.ref_species) in
+        let ref_transcriptome = concat ~descr:(descr_ref ^  ".ref_transcriptome") (List.map s.ref_species ~f:(fun r -> (configuration_dir / ref_transcriptomes r))) in
+        let seq2fam = configuration_dir / seq_fam_link_store in
+        let ref_db = List.map s.ref_species ~f:(fun r -> List.Assoc.find_exn ref_blast_dbs r) in
+        let checked_families = checkfamily ~descr:descr_ref ~threads ~inputs ~ref_transcriptome ~ref_species:s.ref_species ~seq2fam ~ref_db ~evalue:1e-40 in
+        (ref_species_key (List.hd_exn inputs), checked_families)
+      )
+  in
+  List.map apytram_orfs_ref_fams ~f:(fun ((s, f, _) as input) ->
+    let checked_families = List.Assoc.find_exn checked_families_by_ref_species (ref_species_key input) in
+    (s, f, checked_families / selector [ s.id ; f ^ ".fa" ])
     )
 
 let parse_apytram_results apytram_annotated_ref_fams =
@@ -345,7 +369,7 @@ let seq_integrator
 
   let get_trinity_file_list extension dirs =
     List.map  dirs ~f:(fun (s,dir) ->
-        [ dep dir ; string ("/Trinity." ^ s.id ^ "." ^ s.species ^ "." ^ family ^ "." ^ extension) ; string ","]
+        [ dep dir ; string ("/Trinity." ^ s.id ^ "." ^ s.species ^ ".bundle::" ^ family ^ "." ^ extension) ; string ","]
       )
     |> List.concat
   in
@@ -365,7 +389,7 @@ let seq_integrator
 
   let tmp_merge = dest // "tmp" in
 
-  workflow ~version:11 ~descr:("SeqIntegrator.py:" ^ family) [
+  workflow ~version:12 ~descr:("SeqIntegrator.py:" ^ family) [
     mkdir_p tmp_merge ;
     cmd "SeqIntegrator.py"  [
       opt "-tmp" ident tmp_merge;
@@ -752,7 +776,7 @@ let build_app configuration =
     List.concat
     (List.map pairs ~f:(fun (ref_species, fam) ->
     let descr = ":" ^ fam ^ "." ^ (String.concat ~sep:"_" ref_species) in
-    let guide_query = concat ~descr (List.map ref_species ~f:(fun sp -> configuration_dir / ref_fams sp fam)) in
+    let guide_query = bundle_cat ~descr (List.map ref_species ~f:(fun sp -> seq [dep (configuration_dir / ref_fams_bundle sp) ; string ("::" ^ fam ^ ".fa")])) in
     let target_query = build_target_query ref_species fam configuration trinity_annotated_fams in
     let query = concat ~descr:(descr ^ ".+seqdispatcher") [guide_query; target_query] in
     let compressed_reads_dbs = List.filter_map reads_blast_dbs ~f:(fun (s, db) -> if s.ref_species = ref_species then Some db else None) in
@@ -771,7 +795,7 @@ let build_app configuration =
 
   let apytram_orfs_ref_fams = apytram_orfs_ref_fams_of_apytram_annotated_ref_fams apytram_annotated_ref_fams_by_fam divided_thread_memory in
 
-  let apytram_checked_families =  apytram_checked_families_of_orfs_ref_fams apytram_orfs_ref_fams configuration_dir ref_blast_dbs in
+  let apytram_checked_families =  apytram_checked_families_of_orfs_ref_fams apytram_orfs_ref_fams configuration_dir ref_blast_dbs configuration.threads in
 
   let apytram_results_dir = parse_apytram_results apytram_checked_families in
 
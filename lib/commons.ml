@@ -122,6 +122,7 @@ type configuration_dir = [ `configuration ]
 type sp2seq_link
 type tabular
 type index
+type link_store
 type cdhit
 type blast_db = [`blast_db] directory
 
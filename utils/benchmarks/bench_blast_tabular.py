@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# coding: utf-8
+
+# File: bench_blast_tabular.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+
+"""Compare the tabular blast readers on a synthetic outfmt 6 file.
+
+Usage: bench_blast_tabular.py [number of hits] [number of queries]"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import pandas
+
+import BlastPlus
+
+FieldNames = ["qid", "tid", "id", "alilen", "mis", "gap", "qstart", "qend", "tstart", "tend", "evalue", "score"]
+
+
+def write_hits(Filename, NbHits, NbQueries):
+    random.seed(0)
+    with open(Filename, "w") as Out:
+        for i in range(NbHits):
+            (qstart, qend) = sorted(random.sample(range(1, 3000), 2))
+            (tstart, tend) = random.sample(range(1, 3000), 2)
+            Out.write("TRINITY_DN%s_c0_g1_i1\tRef_%s\t%.2f\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%.2e\t%.1f\n" %(
+                      random.randint(1, NbQueries), random.randint(1, NbQueries // 10 + 1),
+                      random.uniform(70, 100), qend - qstart + 1, random.randint(0, 50), random.randint(0, 5),
+                      qstart, qend, tstart, tend, random.uniform(0, 1e-5), random.uniform(40, 2000)))
+
+
+def current_reader(Filename):
+    return pandas.read_csv(Filename, sep=None, engine='python', header=None, names=FieldNames)
+
+
+def typed_reader(Filename):
+    return BlastPlus.read_tabular(Filename, Names=FieldNames)
+
+
+def chunked_reader(Filename):
+    return sum(len(Chunk) for Chunk in BlastPlus.iter_tabular(Filename, ChunkSize=100000, Names=FieldNames))
+
+
+def bench(Name, Function, Filename):
+    Start = time.time()
+    Result = Function(Filename)
+    Elapsed = time.time() - Start
+    if isinstance(Result, pandas.DataFrame):
+        Memory = "%.1f MB" %(Result.memory_usage(deep=True).sum() / 1e6)
+    else:
+        Memory = "-"
+    print("%-16s %8.2f s %12s" %(Name, Elapsed, Memory))
+
+
+if __name__ == "__main__":
+    NbHits = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    NbQueries = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    (Fd, Filename) = tempfile.mkstemp(suffix=".blast.tsv")
+    os.close(Fd)
+    try:
+        write_hits(Filename, NbHits, NbQueries)
+        print("%s hits, %s queries, %.1f MB" %(NbHits, NbQueries, os.path.getsize(Filename) / 1e6))
+        bench("current", current_reader, Filename)
+        bench("typed", typed_reader, Filename)
+        bench("typed chunked", chunked_reader, Filename)
+    finally:
+        os.remove(Filename)
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding: utf-8
+
+# File: BundleCat.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Concatenate files and members of bundles (<bundle>::<member>) written by
+SeqDispatcher.py --bundle and ParseInput.py. Missing files and members are
+skipped.
+
+    BundleCat.py [-o OUTPUT] PATH [PATH ...]
+    BundleCat.py --list BUNDLE
+"""
+
+import sys
+import argparse
+
+import FamilyBundle
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+parser.add_argument('paths', nargs='*',
+                    help="Files or bundle members (<bundle>::<member>)")
+parser.add_argument('-o', '--output', type=str, default="",
+                    help="Output file. (default=: standard output)")
+parser.add_argument('--list', action='store_true', default=False,
+                    help="List the members and their size of each bundle instead.")
+
+args = parser.parse_args()
+
+if args.output:
+    Output = open(args.output, "wb")
+else:
+    Output = sys.stdout
+
+if args.list:
+    for Filename in args.paths:
+        Bundle = FamilyBundle.FamilyBundle(Filename)
+        for Name in Bundle.names():
+            Output.write("%s\t%s\n" %(FamilyBundle.member_path(Filename, Name), Bundle.size(Name)))
+        Bundle.close()
+else:
+    FamilyBundle.concatenate(args.paths, Output)
+
+if args.output:
+    Output.close()
@@ -35,34 +35,45 @@
 
 import os
 import sys
+import copy
 import time
+import itertools
+import collections
 import tempfile
 import shutil
 import logging
 import argparse
-import subprocess
 
 import pandas
 
+import BlastCache
 import BlastPlus
+import CompressedIO
+import DispatchService
+import FamilySketch
+import FastaIO
+import Runner
 
 start_time = time.time()
 
 ### Option defining
 parser = argparse.ArgumentParser(prog="CheckFamily.py",
                                  description='''
-    Check all sequences of a fasta file are associated with a unique family, else remove them.''')
+    Check all sequences of a fasta file are associated with a unique family, else remove them.
+    Several fasta files can be checked together with a manifest, their sequences are blasted together.''')
 parser.add_argument('--version', action='version', version='%(prog)s 1.0')
 
 
 ##############
 requiredOptions = parser.add_argument_group('Required arguments')
 requiredOptions.add_argument('-i', '--input', type=str,
-                             help='fasta file name.', required=True)
+                             help='fasta file name.', required=False)
+requiredOptions.add_argument('-m', '--manifest', type=str,
+                             help='Manifest file name, instead of -i, -f and -o. A tabular file, each line correspond to a fasta file name, its expected family and its output name.', required=False)
 requiredOptions.add_argument('-t', '--ref_transcriptome', type=str,
                              help='Target fasta file name', required=True)
 requiredOptions.add_argument('-f', '--family', type=str,
-                             help='family name', required=True)
+                             help='family name', required=False)
 requiredOptions.add_argument('-d', '--database', type=str,
                              help='''Database prefix name of the ref transcriptome fasta file.
                               If a database with the same name already exists,
@@ -70,17 +81,39 @@ requiredOptions.add_argument('-d', '--database', type=str,
                               (default=: The database will be build in the temporary directory and will be remove at the end.)''',
                               required=False)
 requiredOptions.add_argument('-t2f', '--ref_transcriptome2family', type=str,
-                             help='Link file name. A tabular file, each line correspond to a sequence name and its family. ', required=True)
+                             help='Link file name. A tabular file, each line correspond to a sequence name and its family, or a link store written by ParseInput. ', required=True)
 requiredOptions.add_argument('-o', '--output', type=str, default="./output.fa",
-                   help="Output name (default= ./output.fa)")
+                   help="Output name, compressed if it ends with .gz or .zst (default= ./output.fa)")
 ##############
 
 
 ##############
 Options = parser.add_argument_group('Options')
+Options.add_argument('-tsp', '--ref_transcriptome_species', type=str, default="",
+                     help="Comma separated species of the ref transcriptome. With a link store as -t2f, the target names are read from the store instead of the ref transcriptome. (default=: read the ref transcriptome)")
 Options.add_argument('-e', '--evalue', type=float,
                      help="Evalue threshold of the blastn of the queries on the database of the ref transcriptome. (default= 1e-3)",
                      default=1e-3)
+Options.add_argument('--blast-db-registry', type=str, default=os.environ.get("CAARS_BLAST_DB_REGISTRY", ""),
+                     help="Directory of blast databases shared between runs, the database of the ref transcriptome is built there once if the databases given with -d are incorrect. (default=: $CAARS_BLAST_DB_REGISTRY, or a database built in the temporary directory)")
+Options.add_argument('--blast-cache', type=str, default=os.environ.get("CAARS_BLAST_CACHE", ""),
+                     help="Directory of an on-disk cache of the blast hits of each query sequence, shared between runs. (default=: $CAARS_BLAST_CACHE, or no cache)")
+Options.add_argument('--blast-cache-size', type=int, default=1024,
+                     help="Maximal size of the blast cache in MB, the least recently used hits are evicted beyond. (default= 1024)")
+Options.add_argument('--blast-tiers', type=str, default=os.environ.get("CAARS_BLAST_TIERS", ""),
+                     help="Comma separated blast tasks tried in turn, e.g. megablast,blastn: only the queries without hit, or whose best hits are in several families or below --tier-identity, are blasted again with the next task. (default=: $CAARS_BLAST_TIERS, or blastn only)")
+Options.add_argument('--tier-identity', type=float, default=95,
+                     help="Minimal identity (%%) of the best hits of a query to keep the hits of a tier which is not the last one. (default= 95)")
+Options.add_argument('--sketch-families', type=int, default=int(os.environ.get("CAARS_SKETCH_FAMILIES", 0)),
+                     help="Blast each fasta file only on the targets of its expected family and of the N families whose MinHash sketches contain most of its k-mers, 0 to blast on all the targets. The blast cache is not used then. (default=: $CAARS_SKETCH_FAMILIES, or 0)")
+Options.add_argument('--sketch-dir', type=str, default=os.environ.get("CAARS_FAMILY_SKETCHES", ""),
+                     help="Directory of the family sketches of the ref transcriptomes, the sketches are built once and reused by the next runs. (default=: $CAARS_FAMILY_SKETCHES, or sketches built in the temporary directory)")
+Options.add_argument('--sketch-k', type=int, default=21,
+                     help="k-mer size of the family sketches. (default= 21)")
+Options.add_argument('--sketch-scale', type=int, default=20,
+                     help="One k-mer hash out of SCALE is kept in the family sketches. (default= 20)")
+Options.add_argument('--sketch-validate', type=float, default=0,
+                     help="Fraction of the fasta files also blasted on all the targets to report the accuracy of the sketches, their output is the one of the full search. (default= 0)")
 Options.add_argument('-tmp', type=str,
                      help="Directory to stock all intermediary files for the job. (default=: a directory in /tmp which will be removed at the end)",
                      default="")
@@ -91,6 +124,9 @@ Options.add_argument('-log', type=str, default="checkfamily.log",
 
 ##############
 MiscellaneousOptions = parser.add_argument_group('Miscellaneous options')
+MiscellaneousOptions.add_argument('-threads', type=int,
+                                  help="Number of available threads. (default= 1)",
+                                  default=1)
 MiscellaneousOptions.add_argument('--debug', action='store_true', default=False,
                    help="debug mode, default False")
 ##############
@@ -99,13 +135,14 @@ MiscellaneousOptions.add_argument('--debug', action='store_true', default=False,
 args = parser.parse_args()
 
 ### Read arguments
-FastaFile = args.input
-OutputFasta = args.output
 TargetFile = args.ref_transcriptome
-ExpectedFamily = args.family
 Target2FamilyFilename = args.ref_transcriptome2family
+TargetSpecies = [Species for Species in args.ref_transcriptome_species.split(",") if Species]
 
 Evalue = args.evalue
+Threads = args.threads
+# The external commands share the thread budget
+Runner.set_threads(Threads)
 
 ### Set up the log directory
 if args.log:
@@ -115,6 +152,8 @@ if args.log:
 
 ### Set up the logger
 LogFile = args.log
+# The resources used by the external tools are recorded next to the log
+Runner.set_accounting(LogFile)
 # create logger
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
@@ -160,23 +199,40 @@ def end(exit_code):
             shutil.rmtree(TmpDirName)
     sys.exit(exit_code)
 
-### Set up the output directory
-if args.output and os.path.dirname(args.output):
-    OutDirName = os.path.dirname(args.output)
-    OutName = args.output
-    if os.path.isdir(OutDirName):
-        logger.info("The output directory %s exists", os.path.dirname(args.output))
-    elif OutDirName: # if OutDirName is not a empty string we create the directory
-        logger.info("The output directory %s does not exist, it will be created", os.path.dirname(args.output))
-        os.makedirs(os.path.dirname(args.output))
+### Read the fasta files to check
+# Entries: [(fasta file, expected family, output fasta)]
+if args.manifest:
+    if not os.path.isfile(args.manifest):
+        logger.error(args.manifest + " (-m) is not a file.")
+        end(1)
+    Entries = []
+    with open(args.manifest, "r") as Manifest:
+        for Line in Manifest:
+            if Line.strip():
+                Entries.append(tuple(Line.rstrip("\n").split("\t")[:3]))
+elif args.input and args.family:
+    Entries = [(args.input, args.family, args.output)]
 else:
-    logger.error("The output prefix must be defined")
+    logger.error("A manifest (-m) or an input file (-i) and its family (-f) must be given")
     end(1)
 
+### Set up the output directories
+for (FastaFile, ExpectedFamily, OutputFasta) in Entries:
+    OutDirName = os.path.dirname(OutputFasta)
+    if not OutDirName:
+        logger.error("The output prefix must be defined")
+        end(1)
+    if os.path.isdir(OutDirName):
+        logger.debug("The output directory %s exists", OutDirName)
+    else:
+        logger.debug("The output directory %s does not exist, it will be created", OutDirName)
+        os.makedirs(OutDirName)
+
 ### Check that input files exist
-if not os.path.isfile(args.input):
-    logger.error(args.input + " (-q) is not a file.")
-    end(1)
+for (FastaFile, ExpectedFamily, OutputFasta) in Entries:
+    if not os.path.isfile(FastaFile):
+        logger.error(FastaFile + " (-i) is not a file.")
+        end(1)
 
 
 if not os.path.isfile(args.ref_transcriptome):
@@ -187,46 +243,21 @@ if not os.path.isfile(args.ref_transcriptome2family):
     logger.error(args.ref_transcriptome2family + " (-t2f) is not a file.")
     end(1)
 
-### Parse input fasta files
-## Get query names
-logger.info("Get query names")
-BashProcess = subprocess.Popen(["grep", "-e", "^>", args.input],
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-OutBashProcess = BashProcess.communicate()
-if not OutBashProcess[1]:
-    QueryNames = OutBashProcess[0].strip().replace(">", "").split("\n")
-    logger.debug("query: %s", "\n".join(QueryNames))
-else:
-    logger.error(OutBashProcess[1])
-    end(1)
-
-## Get ref_transcriptome sequence names
+### BLAST needs plain fasta files
+# All fasta files are blasted together, the name of each query is prefixed by the index of its entry
+logger.info("Write the %s fasta files to check in a single query file", len(Entries))
+FastaFile = "%s/Queries.fa" %TmpDirName
+with FastaIO.FastaWriter(FastaFile, Width=0) as Writer:
+    for (Entry, (EntryFastaFile, ExpectedFamily, OutputFasta)) in enumerate(Entries):
+        for (Header, Sequence) in FastaIO.iter_fasta(EntryFastaFile, Threads=Threads):
+            Writer.write("%s_%s" %(Entry, Header), Sequence)
+TargetFile = CompressedIO.decompress_to_plain(TargetFile, TmpDirName, Threads=Threads)
+
+## Get ref_transcriptome sequence names and parse the ref_transcriptome2family
 logger.info("Get ref_transcriptome names")
-BashProcess = subprocess.Popen(["grep", "-e", "^>",
-                                 args.ref_transcriptome],
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-OutBashProcess = BashProcess.communicate()
-if not  OutBashProcess[1]:
-    TargetNames = OutBashProcess[0].strip().replace(">", "").split("\n")
-else:
-    logger.error(OutBashProcess[1])
-    end(1)
-
-### Parse the ref_transcriptome2family, create dictionnaries target2family and family2target
-Target2FamilyTable = pandas.read_csv(Target2FamilyFilename,
-                                      sep=None, engine='python',
-                                      header=None,
-                                      names=["Target", "Family"])
-
-# Check if there are no missing data
-MissingTargets = [target for target in TargetNames if not target in Target2FamilyTable.Target.values]
+(TargetNames, Target2FamilyTable, MissingTargets) = DispatchService.reference_targets(args.ref_transcriptome, Target2FamilyFilename, TargetSpecies)
 if MissingTargets:
     logger.warning("These targets are not present in the target2family link file, they will be added:\n\t- %s", "\n\t- ".join(MissingTargets))
-    MissingData = pandas.DataFrame({"Target" : MissingTargets,
-                                     "Family": MissingTargets})
-    Target2FamilyTable = pandas.concat([Target2FamilyTable, MissingData], ignore_index=True)
 
 
 if len(Target2FamilyTable['Target']) != len(Target2FamilyTable['Target'].unique()):
@@ -238,15 +269,13 @@ logger.info("Check that there is a target database, otherwise build it")
 
 Databases = []
 
-if not args.database:
-    Databases.append("%s/Target_DB" %TmpDirName)
-else:
+if args.database:
     Databases.extend(args.database.split(","))
 
-Not_correct_database = False
+Not_correct_database = not Databases
 for DatabaseName in Databases:
-    CheckDatabase_BlastdbcmdProcess = BlastPlus.Blastdbcmd(DatabaseName, "", "")
-    if not CheckDatabase_BlastdbcmdProcess.is_database():
+    # The database files are checked, blastdbcmd is not launched
+    if not BlastPlus.is_database(DatabaseName):
         logger.info("Database %s does not exist", DatabaseName)
         Not_correct_database = True
 
@@ -256,27 +285,32 @@ if Not_correct_database:
        logger.error("The fasta file (-t) does not exist.")
        end(1)
 
-    if len(Databases) > 1:
-        DatabaseName = "%s/Target_DB" %TmpDirName
-        Databases = [DatabaseName]
-        logger.info("Databases given in input are incorrect, a new database will be built in %s from %s", DatabaseName, TargetFile)
-
-    if os.path.isdir(os.path.dirname(DatabaseName)):
-        logger.info("Database directory exists")
+    if len(Databases) == 1 and not args.blast_db_registry:
+        DatabaseName = Databases[0]
+        if os.path.isdir(os.path.dirname(DatabaseName)) or not os.path.dirname(DatabaseName):
+            logger.info("Database directory exists")
+        else:
+            logger.info("Database directory does not exist, we create it")
+            os.makedirs(os.path.dirname(DatabaseName))
+        # database building
+        logger.info(DatabaseName + " database building")
+        MakeblastdbProcess = BlastPlus.Makeblastdb(TargetFile, DatabaseName)
+        (out, err) = MakeblastdbProcess.launch()
+        if err:
+            end(1)
+        BlastPlus.write_manifest(DatabaseName, Source=os.path.abspath(TargetFile))
     else:
-        logger.info("Database directory does not exist, we create it")
-        os.makedirs(os.path.dirname(DatabaseName))
-    # database building
-    logger.info(DatabaseName + " database building")
-    MakeblastdbProcess = BlastPlus.Makeblastdb(TargetFile, DatabaseName)
-    (out, err) = MakeblastdbProcess.launch()
-    if err:
-        end(1)
+        if Databases:
+            logger.info("Databases given in input are incorrect, the database of %s will be taken from the registry", TargetFile)
+        Registry = BlastPlus.DatabaseRegistry(args.blast_db_registry or "%s/Target_DB" %TmpDirName)
+        DatabaseName = Registry.database(TargetFile, Source=args.ref_transcriptome)
+        if not DatabaseName:
+            end(1)
+        Databases = [DatabaseName]
 
 
 for DatabaseName in Databases:
-    CheckDatabase_BlastdbcmdProcess = BlastPlus.Blastdbcmd(DatabaseName, "", "")
-    if not CheckDatabase_BlastdbcmdProcess.is_database():
+    if not BlastPlus.is_database(DatabaseName):
         logger.error("Problem in the database building")
         logger.info("Database %s does not exist", DatabaseName)
         end(1)
@@ -286,75 +320,155 @@ for DatabaseName in Databases:
 ### Blast the query fasta on the target database
 logger.info("Blast the query fasta on the target database")
 start_blast_time = time.time()
-BlastOutputFile = "%s/Queries_Targets.blast" %(TmpDirName)
 BlastnProcess = BlastPlus.Blast("blastn", FastaFile, db_list=Databases)
 BlastnProcess.Evalue = Evalue
 BlastnProcess.Task = "blastn"
+# The queries resolved by a faster task are not blasted by the next ones
+BlastTiers = [Task for Task in args.blast_tiers.split(",") if Task] or [BlastnProcess.Task]
 BlastnProcess.max_target_seqs = 100
 BlastnProcess.max_hsps_per_subject = 1
-BlastnProcess.OutFormat = "6"
+BlastnProcess.Threads = Threads
+BlastnProcess.Shards = Threads
+if args.blast_cache:
+    BlastnProcess.Cache = BlastCache.BlastCache(args.blast_cache, MaxSize=args.blast_cache_size << 20)
 BlastnProcess.Strand = "plus"
 
 # Write an empty output file to be sure
-OutputFile = open(OutputFasta, "w")
-OutputFile.write("")
-OutputFile.close()
+for (EntryFastaFile, ExpectedFamily, OutputFasta) in Entries:
+    OutputFile = CompressedIO.open_file(OutputFasta, "w")
+    OutputFile.write("")
+    OutputFile.close()
 
-# Write blast ouptut in BlastOutputFile if the file does not exist
 logger.debug("%s : %s", FastaFile, os.stat(FastaFile).st_size)
 
 if os.stat(FastaFile).st_size == 0:
     logger.info("Empty query file")
     end(0)
+
+### Parse blast results
+# Fields: query id, subject id, % identity, alignment length, mismatches, gap opens, q. start, q. end, s. start, s. end, evalue, bit score
+FieldNames = ["qid", "tid", "id", "alilen", "mis", "gap", "qstart", "qend", "tstart", "tend", "evalue", "score"]
+Target2Family = dict(zip(Target2FamilyTable.Target, Target2FamilyTable.Family))
+Resolved = BlastPlus.family_resolver(Target2Family, args.tier_identity)
+BlastRows = []
+if not args.sketch_families:
+    for (Query, Rows) in BlastnProcess.iter_tiered_hits(BlastTiers, Resolved):
+        BlastRows.extend(Rows)
+    if BlastnProcess.Cache is not None:
+        BlastnProcess.Cache.log_stats()
+        BlastnProcess.Cache.close()
+    if BlastnProcess.Err:
+        end(1)
 else:
-    (out, err) = BlastnProcess.launch(BlastOutputFile)
-    if err:
+    ## Blast each entry only on the targets of the families closest to its sequences
+    logger.info("Blast each entry on the targets of its %s closest families", args.sketch_families)
+    if BlastnProcess.Cache is not None:
+        BlastnProcess.Cache.close()
+        BlastnProcess.Cache = None
+    # The sketches are named after the given ref transcriptome, not after its plain temporary copy
+    Sketches = FamilySketch.get_sketches(args.sketch_dir or "%s/Sketches" %TmpDirName, args.ref_transcriptome, Target2FamilyFilename,
+                                         Target2Family, K=args.sketch_k, Scale=args.sketch_scale, Threads=Threads)
+    Family2Targets = {}
+    for (Target, Family) in Target2Family.items():
+        Family2Targets.setdefault(str(Family), []).append(Target)
+    EntryDirName = "%s/Entries" %TmpDirName
+    if not os.path.isdir(EntryDirName):
+        os.makedirs(EntryDirName)
+    # The validated entries are blasted on all the targets, to compare with their closest families only
+    Validated = set()
+    if args.sketch_validate > 0:
+        Validated = set(range(0, len(Entries), max(1, int(round(1 / args.sketch_validate)))))
+    Ranks = {"closest": 0, "among": 0, "added": 0}
+    EntryBlasts = []
+    for (Entry, Records) in itertools.groupby(FastaIO.iter_fasta(FastaFile), key=lambda Record: int(Record[0].split("_", 1)[0])):
+        Records = list(Records)
+        (Families, Rank) = Sketches.closest([Sequence for (_, Sequence) in Records], args.sketch_families, Entries[Entry][1])
+        if Rank == 1:
+            Ranks["closest"] += 1
+        elif Rank and Rank <= args.sketch_families:
+            Ranks["among"] += 1
+        else:
+            Ranks["added"] += 1
+        EntryBlast = copy.copy(BlastnProcess)
+        EntryBlast.QueryFile = "%s/%s.fa" %(EntryDirName, Entry)
+        FastaIO.write_fasta(EntryBlast.QueryFile, Records, Width=0)
+        EntryBlast.Threads = 1
+        EntryBlast.Shards = 1
+        if not Entry in Validated:
+            EntryBlast.SeqIdList = "%s/%s.seqids" %(EntryDirName, Entry)
+            with open(EntryBlast.SeqIdList, "w") as SeqIdList:
+                for Family in Families:
+                    SeqIdList.write("".join("%s\n" %Target for Target in Family2Targets.get(Family, [])))
+        EntryBlasts.append((Entry, EntryBlast, set(Families)))
+    logger.info("Sketches: the expected family is the closest one of %s entries, among the %s closest ones of %s entries and added to %s entries",
+                Ranks["closest"], args.sketch_families, Ranks["among"], Ranks["added"])
+
+    def entry_hits(EntryBlast):
+        return list(EntryBlast.iter_tiered_hits(BlastTiers, Resolved))
+
+    def best_families(Rows):
+        BestScore = max([Row[-1] for Row in Rows] or [0])
+        return set(str(Target2Family.get(Row[1])) for Row in Rows if Row[-1] == BestScore)
+
+    Errs = []
+    Validation = {"entries": 0, "queries": 0, "same": 0}
+    def collect(Entry, EntryBlast, Families, Future):
+        if Entry in Validated:
+            Validation["entries"] += 1
+        for (Query, Rows) in Future.result():
+            BlastRows.extend(Rows)
+            if Entry in Validated:
+                Validation["queries"] += 1
+                Closest = [Row for Row in Rows if str(Target2Family.get(Row[1])) in Families]
+                if best_families(Closest) == best_families(Rows):
+                    Validation["same"] += 1
+        if EntryBlast.Err:
+            Errs.append(EntryBlast.Err)
+
+    # At most Threads single threaded blasts run at the same time
+    Pending = collections.deque()
+    for (Entry, EntryBlast, Families) in EntryBlasts:
+        if len(Pending) >= Threads:
+            collect(*Pending.popleft())
+        Pending.append((Entry, EntryBlast, Families, Runner.get_runner().call(entry_hits, EntryBlast)))
+    while Pending:
+        collect(*Pending.popleft())
+    if Errs:
         end(1)
+    if Validation["entries"]:
+        logger.info("Sketch accuracy: %s of the %s queries of %s entries blasted on all the targets get the same best families with their %s closest families",
+                    Validation["same"], Validation["queries"], Validation["entries"], args.sketch_families)
 
-if not os.stat(BlastOutputFile).st_size:
+if not BlastRows:
     logger.info("Blast found no hit")
     end(0)
 
 logger.debug("blast --- %s seconds ---", str(time.time() - start_blast_time))
+BlastTable = pandas.DataFrame(BlastRows, columns=FieldNames)
 
-### Parse blast results
-# Fields: query id, subject id, % identity, alignment length, mismatches, gap opens, q. start, q. end, s. start, s. end, evalue, bit score
-FieldNames = ["qid", "tid", "id", "alilen", "mis", "gap", "qstart", "qend", "tstart", "tend", "evalue", "score"]
-BlastTable = pandas.read_csv(BlastOutputFile, sep=None, engine='python', header=None, names=FieldNames)
-
-# Get Family for each Target:
+# Get Family and Entry for each hit:
 BlastTableWithFamilies = pandas.merge(BlastTable, Target2FamilyTable, how='left', left_on=['tid'], right_on=['Target'])
+BlastTableWithFamilies["entry"] = BlastTableWithFamilies.qid.map(lambda qid: int(qid.split("_", 1)[0])).astype(int)
 
-### First: Find the best hit for each Query sequences and check family
+### First: Find the best hits of each Query sequence and check their family
 logger.info("First Step")
-RetainedQuery = []
-DiscardedQuery = []
-for Query in QueryNames:
-    Query = Query.split()[0]
-    logger.debug("Query: %s", Query)
-    TmpTable = BlastTableWithFamilies[BlastTableWithFamilies.qid == Query]
-    if len(TmpTable.index):
-        TmpBestScore = max(TmpTable.score)
-
-        BestTargetTable = TmpTable[TmpTable.score == TmpBestScore]
-        BestTargetTable.is_copy = False
-
-        logger.debug(BestTargetTable)
-        TmpFamily = BestTargetTable["Family"].unique()
-        Family = TmpFamily[0]
-        logger.debug("Family: %s", " ".join(TmpFamily))
-        if len(TmpFamily) > 1:
-            logger.info("More than one family can be attributed to %s:\n\t- %s\nIt will be discarded.", Query, "\n\t- ".join(TmpFamily))
-            DiscardedQuery.append(Query + "\t" + ",".join(TmpFamily))
-        elif Family != ExpectedFamily:
-            logger.info("Observed family (%s) is different of the expected family (%s). %s will be discarded.", Family, ExpectedFamily, Query)
-            DiscardedQuery.append(Query + "\t" + Family)
-        else:
-            RetainedQuery.append(Query)
-    logger.debug("end: %s", Query)
-
+BestScores = BlastTableWithFamilies.groupby("qid").score.transform("max")
+BestHits = BlastTableWithFamilies[BlastTableWithFamilies.score == BestScores]
+QueryFamilies = BestHits.drop_duplicates(["qid", "Family"])
+QueryFamilies = QueryFamilies.assign(Expected=QueryFamilies.entry.map(dict((Entry, ExpectedFamily) for (Entry, (_, ExpectedFamily, _)) in enumerate(Entries))),
+                                     Ambiguous=QueryFamilies.qid.duplicated(keep=False))
 
-DiscardedFilename = "%s/%s_discarded_sequences_names.txt" %(TmpDirName, Family)
+DiscardedQuery = []
+for (Query, Families) in QueryFamilies[QueryFamilies.Ambiguous].groupby("qid", observed=True).Family:
+    logger.info("More than one family can be attributed to %s:\n\t- %s\nIt will be discarded.", Query.split("_", 1)[1], "\n\t- ".join(Families.astype(str)))
+    DiscardedQuery.append(Query + "\t" + ",".join(Families.astype(str)))
+Unexpected = QueryFamilies[~QueryFamilies.Ambiguous & (QueryFamilies.Family != QueryFamilies.Expected)]
+for (Query, Family, ExpectedFamily) in zip(Unexpected.qid, Unexpected.Family, Unexpected.Expected):
+    logger.info("Observed family (%s) is different of the expected family (%s). %s will be discarded.", Family, ExpectedFamily, Query.split("_", 1)[1])
+    DiscardedQuery.append(Query + "\t" + str(Family))
+RetainedQuery = set(QueryFamilies.qid[~QueryFamilies.Ambiguous & (QueryFamilies.Family == QueryFamilies.Expected)])
+
+DiscardedFilename = "%s/discarded_sequences_names.txt" %(TmpDirName)
 TmpFile = open(DiscardedFilename, "w")
 TmpFile.write("\n".join(DiscardedQuery))
 TmpFile.close()
@@ -362,46 +476,25 @@ TmpFile.close()
 if not RetainedQuery:
     end(0)
 
-### Second : Build a query database
-# Build a query database
-logger.info("Build a query database")
-QueryDatabaseName = "%s/Query_DB" %TmpDirName
-if not os.path.isfile(FastaFile):
-    logger.error("The query fasta file (-i) does not exist.")
-    end(1)
-# database building
-logger.info(QueryDatabaseName + " database building")
-MakeblastdbProcess = BlastPlus.Makeblastdb(FastaFile, QueryDatabaseName)
-ExitCode = MakeblastdbProcess.launch()
-
-CheckDatabase_BlastdbcmdProcess = BlastPlus.Blastdbcmd(QueryDatabaseName, "", "")
-if not CheckDatabase_BlastdbcmdProcess.is_database():
-    logger.error("Problem in the database building")
-    logger.info("Database %s does not exist", QueryDatabaseName)
-    end(1)
-else:
-    logger.info("Database %s exists", QueryDatabaseName)
-
-## Third step: write a fasta which contained all retained sequences
+### Second: write for each entry a fasta which contained all its retained sequences
 logger.info("Write output files")
-
-#Get retained sequences names
-start_blastdbcmd_time = time.time()
-TmpFilename = "%s/%s_sequences_names.txt" %(TmpDirName, Family)
-TmpFile = open(TmpFilename, "w")
-TmpFile.write("\n".join(RetainedQuery))
-TmpFile.close()
-
-#Get retained sequences
-BlastdbcmdProcess = BlastPlus.Blastdbcmd(QueryDatabaseName, TmpFilename, "")
-BlastdbcmdProcess.OutputFile = OutputFasta
-
-(out, err) = BlastdbcmdProcess.launch()
-
-if err:
-    end(1)
-logger.debug("blastdbcmd --- %s seconds ---", time.time() - start_blastdbcmd_time)
+# The retained sequences are read in a single pass over the query file, the sequences of an entry are contiguous
+start_extraction_time = time.time()
+Writer = None
+WriterEntry = None
+for (Header, Sequence) in FastaIO.iter_fasta(FastaFile):
+    Query = FastaIO.fasta_id(Header)
+    if Query in RetainedQuery:
+        RetainedQuery.discard(Query)
+        (Entry, Header) = Header.split("_", 1)
+        if Entry != WriterEntry:
+            if Writer is not None:
+                Writer.close()
+            Writer = FastaIO.FastaWriter(Entries[int(Entry)][2])
+            WriterEntry = Entry
+        Writer.write(Header, Sequence)
+if Writer is not None:
+    Writer.close()
+logger.debug("extraction --- %s seconds ---", time.time() - start_extraction_time)
 
 logger.info("--- %s seconds ---", str(time.time() - start_time))
-
-end(0)
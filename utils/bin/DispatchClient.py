@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# coding: utf-8
+
+# File: DispatchClient.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Run SeqDispatcher.py or CheckFamily.py in the DispatchServer.py listening on
+$CAARS_DISPATCHD, or as a normal program if no server listens on it.
+
+    DispatchClient.py SeqDispatcher.py [SeqDispatcher.py arguments]
+"""
+
+import os
+import sys
+
+import DispatchService
+
+if len(sys.argv) < 2 or not sys.argv[1] in DispatchService.Scripts:
+    sys.stderr.write("Usage: %s {%s} [arguments]\n" %(os.path.basename(sys.argv[0]),
+                                                      ",".join(DispatchService.Scripts)))
+    sys.exit(2)
+
+Script = sys.argv[1]
+Argv = sys.argv[2:]
+
+SocketName = os.environ.get("CAARS_DISPATCHD", "")
+if SocketName:
+    try:
+        Response = DispatchService.send_request(SocketName, Script, Argv)
+    except IOError as e:
+        # The job may have run in part, it is not run again
+        sys.stderr.write("%s\n" %e)
+        sys.exit(1)
+    if Response is not None:
+        sys.stdout.write(Response["stdout"].encode("utf-8"))
+        sys.stderr.write(Response["stderr"].encode("utf-8"))
+        sys.exit(Response["returncode"])
+
+ScriptFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), Script)
+os.execv(sys.executable, [sys.executable, ScriptFile] + Argv)
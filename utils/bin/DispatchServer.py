@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# coding: utf-8
+
+# File: DispatchServer.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import os
+import sys
+import signal
+import logging
+import argparse
+
+# Loaded once, the jobs do not pay for these imports anymore
+import numpy
+import pandas
+
+import BlastCache
+import BlastPlus
+import DispatchService
+import FastaIO
+import Minimizer
+import Runner
+
+
+### Option defining
+parser = argparse.ArgumentParser(prog="DispatchServer.py",
+                                 description='''
+    Serve SeqDispatcher.py and CheckFamily.py jobs on a Unix socket. The
+    server preloads the reference transcriptomes, their families and their
+    minimizer indexes given with --preload and runs each job in a forked
+    child, the jobs are sent by DispatchClient.py.''')
+parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+
+##############
+Options = parser.add_argument_group('Options')
+Options.add_argument('-s', '--socket', type=str, default=os.environ.get("CAARS_DISPATCHD", ""),
+                     help="Unix socket to listen on (default=: $CAARS_DISPATCHD)")
+Options.add_argument('-j', '--jobs', type=int, default=1,
+                     help="Number of jobs run at the same time (default=: 1)")
+Options.add_argument('-p', '--preload', type=str, action='append', default=[],
+                     help="Arguments of a job (e.g. \"SeqDispatcher.py -t ref.fa -t2f links.store -tsp Sp1,Sp2\") whose reference data are loaded before accepting jobs, and shared by the jobs using them. Can be given several times. (default=: the jobs load their reference data)")
+Options.add_argument('-log', type=str, default="dispatch_server.log",
+                     help="a log file to report avancement (default=: dispatch_server.log)")
+##############
+
+##############
+MiscellaneousOptions = parser.add_argument_group('Miscellaneous options')
+MiscellaneousOptions.add_argument('--debug', action='store_true', default=False,
+                   help="debug mode, default False")
+##############
+
+### Option parsing
+args = parser.parse_args()
+
+### Set up the logger
+LogFile = args.log
+# create logger
+logger = logging.getLogger("main")
+logger.setLevel(logging.INFO)
+# create file handler which logs even debug messages
+fh = logging.FileHandler(LogFile)
+# create console handler with a higher log level
+ch = logging.StreamHandler()
+if args.debug:
+    logger.setLevel(logging.DEBUG)
+    ch.setLevel(logging.DEBUG)
+    fh.setLevel(logging.DEBUG)
+else:
+    ch.setLevel(logging.WARNING)
+    fh.setLevel(logging.INFO)
+
+# create formatter and add it to the handlers
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+fh.setFormatter(formatter)
+ch.setFormatter(formatter)
+# add the handlers to the logger
+logger.addHandler(fh)
+logger.addHandler(ch)
+
+logger.info(" ".join(sys.argv))
+
+if not args.socket:
+    logger.error("No socket given (-s or $CAARS_DISPATCHD)")
+    sys.exit(1)
+
+### Load the reference data before accepting jobs
+for Preload in args.preload:
+    Argv = Preload.split()
+    if not Argv or not Argv[0] in DispatchService.Scripts:
+        logger.error("--preload must start with one of %s: %s", ",".join(DispatchService.Scripts), Preload)
+        sys.exit(1)
+    logger.info("Preload the reference data of %s", Preload)
+    if not DispatchService.warm({"script": Argv[0], "argv": Argv[1:],
+                                 "cwd": os.getcwd(), "env": dict(os.environ)}):
+        logger.error("The ref transcriptome (-t) or the link file (-t2f) of %s is not a file", Preload)
+        sys.exit(1)
+
+Server = DispatchService.DispatchServer(args.socket, os.path.dirname(os.path.abspath(__file__)),
+                                        MaxJobs=max(1, args.jobs))
+try:
+    Server.bind()
+except (ValueError, OSError) as e:
+    logger.error(str(e))
+    sys.exit(1)
+
+def stop(Signal, Frame):
+    sys.exit(0)
+
+# The socket is removed when the server is stopped
+signal.signal(signal.SIGTERM, stop)
+
+try:
+    Server.serve_forever()
+except KeyboardInterrupt:
+    logger.info("Stop listening on %s", args.socket)
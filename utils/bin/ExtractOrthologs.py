@@ -35,10 +35,12 @@
 
 import sys
 import os
-import glob
 import logging
 import re
 
+import CompressedIO
+import LinkStore
+
 
 ### Set up the logger
 # create logger with 'spam_application'
@@ -56,6 +58,9 @@ logger.addHandler(ch)
 
 logger.debug(" ".join(sys.argv))
 
+# Optional --compress=gzip|zstd to write compressed tables
+Compression = CompressedIO.pop_compress_option(sys.argv)
+
 if not len(sys.argv) in [3,4,5]:
     logger.error("3 or 4 or 5 arguments are required")
     sys.exit(1)
@@ -98,26 +103,17 @@ def read_rewrite_seq2species_file(Seq2Sp_dict, RefinedSpecies, File, String_Seq2
     fam = os.path.basename(File).split('.')[0]
 
     if os.path.isfile(File):
-        f = open(File, "r")
-        for line in f:
-            line = line.replace("\n", "")
-            if line.replace(":","") == line:
-                logger.debug("Line (%s) has a problem", line)
-            else:
-                (sp, seq) = line.split(":")
-                String_Seq2Sp.append("%s%s%s" %(seq, sep, sp))
-                if sp in RefinedSpecies:
-                    Seq2Sp_dict[seq] = (sp, fam)
-        f.close()
-    
+        for (sp, seq) in LinkStore.iter_sp2seq(File):
+            String_Seq2Sp.append("%s%s%s" %(seq, sep, sp))
+            if sp in RefinedSpecies:
+                Seq2Sp_dict[seq] = (sp, fam)
 
     return (Seq2Sp_dict,String_Seq2Sp)
 
-String_Seq2Sp = []
-SeqSpLink_File = "%s/all_fam.seq2sp.tsv" %(out_dir)
-with open(SeqSpLink_File, "w") as f_rewrite:
-    for f in glob.glob("%s/*sp2seq.txt" %sp2seq_dir):
-        (Seq2Sp_dict,String_Seq2Sp)  = read_rewrite_seq2species_file(Seq2Sp_dict, RefinedSpecies, f, String_Seq2Sp, sep="\t")
+SeqSpLink_File = CompressedIO.compressed_name("%s/all_fam.seq2sp.tsv" %(out_dir), Compression)
+with CompressedIO.open_file(SeqSpLink_File, "w") as f_rewrite:
+    for f in CompressedIO.glob_files("%s/*sp2seq.txt" %sp2seq_dir):
+        (Seq2Sp_dict,String_Seq2Sp)  = read_rewrite_seq2species_file(Seq2Sp_dict, RefinedSpecies, f, [], sep="\t")
         f_rewrite.write("\n".join(String_Seq2Sp) + "\n")
 
 
@@ -131,7 +127,7 @@ def read_ortho_file(OrthoFile):
     OrthoDict = {}
     Seqs = []
     if os.path.isfile(OrthoFile):
-        f = open(OrthoFile, "r")
+        f = CompressedIO.open_file(OrthoFile, "r")
         for line in f:
             if re.match('[\s\n]', line):
                 pass
@@ -215,9 +211,9 @@ def write_orthologs_groups(OrthoDefDict, String=[]):
 
 
 
-Orthologs_File = "%s/all_fam.orthologs.tsv" %(out_dir)
-with open(Orthologs_File, "w") as o_write:
-    for f in glob.glob("%s/*orthologs.txt" %ortho_dir):
+Orthologs_File = CompressedIO.compressed_name("%s/all_fam.orthologs.tsv" %(out_dir), Compression)
+with CompressedIO.open_file(Orthologs_File, "w") as o_write:
+    for f in CompressedIO.glob_files("%s/*orthologs.txt" %ortho_dir):
         Fam = os.path.basename(f).split('.')[0]
         (OrthoDict, Seqs) = read_ortho_file(f)
         OrthoDefDict = define_orthologs_groups(OrthoDict, Seqs, Seq2Sp_dict)
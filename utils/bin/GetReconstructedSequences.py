@@ -37,8 +37,10 @@ import sys
 import os
 import glob
 import logging
-import re
 
+import CompressedIO
+import LinkStore
+import FastaIO
 
 ### Set up the logger
 # create logger with 'spam_application'
@@ -56,6 +58,9 @@ logger.addHandler(ch)
 
 logger.debug(" ".join(sys.argv))
 
+# Optional --compress=gzip|zstd to write compressed outputs
+Compression = CompressedIO.pop_compress_option(sys.argv)
+
 if len(sys.argv) != 5:
     logger.error("4 arguments are required")
     sys.exit(1)
@@ -97,72 +102,45 @@ def read_rewrite_seq2species_file(Seq2Sp_dict, RefinedSpecies, File):
     fam = os.path.basename(File).split('.')[0]
 
     if os.path.isfile(File):
-        f = open(File, "r")
-        for line in f:
-            line = line.replace("\n", "")
-            if line.replace(":","") == line:
-                logger.debug("Line (%s) has a problem", line)
-            else:
-                (sp, seq) = line.split(":")
-                if sp in RefinedSpecies:
-                    Seq2Sp_dict[seq] = (sp, fam)
-        f.close()
-    
+        for (sp, seq) in LinkStore.iter_sp2seq(File):
+            if sp in RefinedSpecies:
+                Seq2Sp_dict[seq] = (sp, fam)
 
     return (Seq2Sp_dict)
 
-for f in glob.glob("%s/*sp2seq.txt" %sp2seq_dir):
+for f in CompressedIO.glob_files("%s/*sp2seq.txt" %sp2seq_dir):
     Seq2Sp_dict  = read_rewrite_seq2species_file(Seq2Sp_dict, RefinedSpecies, f)
 
 
 ### Read all alignment in alignment_dir
 def read_ali_file(FastaFile, Seq2Sp_dict, AliDict):
     logger.debug("Read %s", FastaFile)
-    name = ""
     if os.path.isfile(FastaFile):
-        f = open(FastaFile, "r")
-        for line in f:
-            if re.match('[\s\n]', line):
-                pass
-            elif re.match('>', line):
-                name = line[1:-1]
-                if not Seq2Sp_dict.has_key(name):
-                    name = ""
-                else:
-                    SP = Seq2Sp_dict[name]
-                    AliDict.setdefault(SP, {})
-                    AliDict[SP].setdefault(name, [])
-            elif name:
+        for (name, seq) in FastaIO.iter_fasta(FastaFile):
+            if name in Seq2Sp_dict:
                 SP = Seq2Sp_dict[name]
-                AliDict[SP][name].append(line)
-            else:
-                pass
-        f.close()
+                AliDict.setdefault(SP, {})
+                AliDict[SP][name] = seq
     return AliDict
 
 
 def write_seq(AliDict):
     for (SP, Fam) in AliDict.keys():
-        Fasta_File = "%s/assemblies/CAARS_sequences.%s.fa" %(out_dir,SP)
-        string = []
-        for (name, seq) in AliDict[(SP, Fam)].items():
-            seq = "".join(seq).replace("-", "").replace("\n", "")
-            string.extend([">", name,"\t", Fam, "\n",
-                           '\n'.join(seq[i:i+60] for i in range(0, len(seq), 60)),"\n"])
-    
-        f = open(Fasta_File, "a")
-        f.write("".join(string) + "\n")
-        f.close()
+        Fasta_File = CompressedIO.compressed_name("%s/assemblies/CAARS_sequences.%s.fa" %(out_dir,SP), Compression)
+        FastaIO.write_fasta(Fasta_File,
+                            (("%s\t%s" %(name, Fam), seq.replace("-", ""))
+                             for (name, seq) in AliDict[(SP, Fam)].items()),
+                            Append=True)
         
 def write_validated_sp2seq(Seq2Sp_dict):
-    SeqSpLink_File = "%s/assemblies/CAARS_sequences.seq2sp2fam.txt" %(out_dir)
+    SeqSpLink_File = CompressedIO.compressed_name("%s/assemblies/CAARS_sequences.seq2sp2fam.txt" %(out_dir), Compression)
     String = []
     sep = "\t"
     for seq in Seq2Sp_dict.keys():
         (sp, fam) = Seq2Sp_dict[seq]
         String.append("%s%s%s%s%s\n" %(seq, sep, sp, sep, fam))
 
-    f = open(SeqSpLink_File, "w")
+    f = CompressedIO.open_file(SeqSpLink_File, "w")
     f.write("".join(String) + "\n")
     f.close()
 
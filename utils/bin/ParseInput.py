@@ -41,10 +41,14 @@ import sys
 import os
 import glob
 import logging
-import re
 
 import ete2
 
+import CompressedIO
+import FamilyBundle
+import FastaIO
+import LinkStore
+
 ### Set up the logger
 # create logger with 'spam_application'
 logger = logging.getLogger('ParseInput')
@@ -116,7 +120,7 @@ RnaSp = []
 error_nb = 0
 
 logger.info("Parse the sample sheet")
-with open(config_file, "r") as f:
+with CompressedIO.open_file(config_file, "r") as f:
     HeaderConf = f.readline()
     for line in f:
         line_list = line.split("\t")
@@ -165,7 +169,7 @@ Seq2Sp_dict = {}
 
 def read_seq2species_file(Seq2Sp_dict, File):
     if os.path.isfile(File):
-        f = open(File, "r")
+        f = CompressedIO.open_file(File, "r")
         for line in f:
             (seq, sp) = line.split("\t")
             if not Seq2Sp_dict.has_key(seq):
@@ -177,7 +181,7 @@ def read_seq2species_file(Seq2Sp_dict, File):
     return Seq2Sp_dict
 
 logger.info("Parse each Sequence-Species link file")
-for f in glob.glob("%s/*.tsv" %seq2sp_dir):
+for f in CompressedIO.glob_files("%s/*.tsv" %seq2sp_dir):
     Seq2Sp_dict = read_seq2species_file(Seq2Sp_dict, f)
 
 if len(set(Seq2Sp_dict.values())) == len(set(Seq2Sp_dict.values()).intersection(set(All_Species))):
@@ -191,21 +195,13 @@ else:
 
 def read_ali_file(FastaFile):
     AliDict = {}
-    name = 0
     err = 1
     if os.path.isfile(FastaFile):
-        err = 0
-        f = open(FastaFile, "r")
-        for line in f:
-            if re.match('[\s\n]', line):
-                pass
-            elif re.match('>', line):
-                name = line[1:-1]
-            else:
-                AliDict.setdefault(name, []).append(line.replace("\n", ""))
-        f.close()
-    if AliDict.has_key(0):
-        err = 1
+        try:
+            AliDict = FastaIO.load_fasta(FastaFile, strict=True)
+            err = 0
+        except ValueError:
+            AliDict = {}
     return AliDict, err
 
 
@@ -244,15 +240,9 @@ def write_seq_ref_Trinity(Ref_dic_trinity, AliDict_i, Family):
     for sp in Ref_dic_trinity.keys():
         #Transcriptome:
         Transcriptome_File = "%s/%s_transcriptome.fa" %(TranscriptomeDirPath, sp)
-        string = []
-        for name in Ref_dic_trinity[sp]:
-            seq = ''.join(AliDict_i[name]).replace("-", "")
-            string.extend([">", name, "\n",
-                           '\n'.join(seq[i:i+60] for i in range(0, len(seq), 60)),"\n"])
-
-        f = open(Transcriptome_File, "a")
-        f.write("".join(string))
-        f.close()
+        FastaIO.write_fasta(Transcriptome_File,
+                            ((name, AliDict_i[name].replace("-", "")) for name in Ref_dic_trinity[sp]),
+                            Append=True)
 
         #Tab Seq 2 Fam:
         FamSeqLink_File = "%s/%s_Fam_Seq.tsv" %(SeqFamLinkDirPath, sp)
@@ -264,21 +254,19 @@ def write_seq_ref_Trinity(Ref_dic_trinity, AliDict_i, Family):
         f.write("".join(string))
         f.close()
 
+# The gene families of each species are the members <family>.fa of a single bundle
+ApytramBundles = {}
+
 def write_seq_ref_apytram(Ref_dic_trinity, AliDict_i, Family):
     for sp in Ref_dic_apytram.keys():
         #gene family:
-        GeneFamily_File = "%s/%s.%s.fa" %(ApytramGeneFamDirPath, sp, Family)
-        string = []
-        for name in Ref_dic_trinity[sp]:
-            seq = ''.join(AliDict_i[name]).replace("-", "")
-            string.extend([">", name, "\n",
-                           '\n'.join(seq[i:i+60] for i in range(0, len(seq), 60)),"\n"])
-
-        f = open(GeneFamily_File, "w")
-        f.write("".join(string))
-        f.close()
+        if not sp in ApytramBundles:
+            ApytramBundles[sp] = FamilyBundle.BundleWriter("%s/%s.bundle" %(ApytramGeneFamDirPath, sp))
+        ApytramBundles[sp].write("%s.fa" %Family,
+                                 FastaIO.fasta_string((name, AliDict_i[name].replace("-", "")) for name in Ref_dic_trinity[sp]))
 
 SeenSeq2SpDict = {}
+SeqSpFamLinks = []
 CountDict2 = {}
 Nb_Family = 0
 
@@ -310,7 +298,7 @@ for f in glob.glob("%s/*" %ali_dir):
         FamToDiscard_list.append((Family, Reason))
         continue
         #sys.exit(1)
-    if not os.path.isfile("%s/%s.%s" %(ali_dir, Family, "fa")):
+    if not CompressedIO.glob_files("%s/%s.%s" %(ali_dir, Family, "fa")):
         Reason = "%s is not a fasta file with Family.fa as filename.(Detected file: %s/%s.%s)" %(f, ali_dir, Family, "fa")
         logger.error("[%s] -->\t%s",Family,Reason)
         FamToDiscard_list.append((Family, Reason))
@@ -381,9 +369,13 @@ for f in glob.glob("%s/*" %ali_dir):
     if SupSpecies:
         continue
     write_validated_sp2seq(SeenSeq2SpDict_i, Family)
+    SeqSpFamLinks.extend([(seq, sp, Family) for (seq, sp) in SeenSeq2SpDict_i.items()])
     write_seq_ref_Trinity(Ref_dic_trinity, AliDict_i, Family)
     write_seq_ref_apytram(Ref_dic_apytram, AliDict_i, Family)
 
+for Bundle in ApytramBundles.values():
+    Bundle.close()
+
 if FamToDiscard_list:
     logger.error("Correct or remove families with errors (See above)")
     #sys.stderr.write("\n".join(["%s\t%s" %(f,r) for (f,r) in FamToDiscard_list]))
@@ -403,4 +395,7 @@ for sp in RefSpTrinity + RefSpApytram:
         logger.error("No sequence for  %s", sp)
         sys.exit(1)
 
+# Binary Sequence-Species-Family links, read by SeqDispatcher and CheckFamily (-t2f)
+LinkStore.write_link_store("%s/links.store" %SeqFamLinkDirPath, SeqSpFamLinks)
+
 sys.exit(0)
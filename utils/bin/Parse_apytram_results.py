@@ -37,9 +37,10 @@
 import sys
 import os
 import logging
-import re
 import string
 
+import FastaIO
+
 ### Set up the logger
 # create logger with 'spam_application'
 logger = logging.getLogger('parse_apytram_input')
@@ -95,34 +96,27 @@ def read_fasta_from_apytram(FastaPath2Sp_dic,
     """Read a list of fasta and write a new fasta file
     with unique sequence names
     Build also a Sp2Seq lin file"""
-    String_list = []
+    Record_list = []
     SeqName_list = []
     Sp2Seq_list = []
     for (InFastaFileName, SpeciesId) in FastaPath2Sp_dic.items():
-        InFile = open(InFastaFileName, "r")
         Species = SeqId_dic[SpeciesId]["Species"]
-        for line in InFile:
-            if re.match(">", line):
-                # This is a new sequence
-                SeqName = "%s%s%s" \
-                        %(SeqId_dic[SpeciesId]["SeqPrefix"],
-                        string.zfill(SeqId_dic[SpeciesId]["SeqNb"],
-                        SeqId_dic[SpeciesId]["NbFigures"]
-                        ),
-                        "_%s" %(Family))
-                SeqId_dic[SpeciesId]["SeqNb"] += 1
-                SeqName_list.append(SeqName)
-                Sp2Seq_list.append("%s:%s" %(Species, SeqName))
-                String_list.append(">%s\n" %(SeqName))
-            else:
-                String_list.append(line)
-        InFile.close()
+        for (_, Sequence) in FastaIO.iter_fasta(InFastaFileName):
+            # This is a new sequence
+            SeqName = "%s%s%s" \
+                    %(SeqId_dic[SpeciesId]["SeqPrefix"],
+                    string.zfill(SeqId_dic[SpeciesId]["SeqNb"],
+                    SeqId_dic[SpeciesId]["NbFigures"]
+                    ),
+                    "_%s" %(Family))
+            SeqId_dic[SpeciesId]["SeqNb"] += 1
+            SeqName_list.append(SeqName)
+            Sp2Seq_list.append("%s:%s" %(Species, SeqName))
+            Record_list.append((SeqName, Sequence))
 
     if SeqName_list:
         # Write all sequences in the output fasta file
-        OutFile = open(OutFastaFileName, "w")
-        OutFile.write("".join(String_list))
-        OutFile.close()
+        FastaIO.write_fasta(OutFastaFileName, Record_list)
 
         #Build and write the Sp2SeqFile
         Sp2SeqFile = open(Sp2SeqFileName, "w")
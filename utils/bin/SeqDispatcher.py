@@ -41,12 +41,18 @@ import tempfile
 import shutil
 import logging
 import argparse
-import subprocess
-import re
 
 import pandas
 
+import BlastCache
 import BlastPlus
+import CompressedIO
+import DispatchService
+import FamilyBundle
+import FastaIO
+import Minimizer
+import QueryCollapse
+import Runner
 
 
 
@@ -56,18 +62,20 @@ start_time = time.time()
 parser = argparse.ArgumentParser(prog="SeqDispatcher.py",
                                  description='''
     Attribute a family to a list of sequences according to a given target
-    sequences list wich have an asocciated family. ''')
+    sequences list wich have an asocciated family.
+    Several samples sharing the same targets can be given as comma separated
+    lists of queries, species, ids and output prefixes, they are blasted together.''')
 parser.add_argument('--version', action='version', version='%(prog)s 1.0')
 
 
 ##############
 requiredOptions = parser.add_argument_group('Required arguments')
 requiredOptions.add_argument('-q', '--query', type=str,
-                             help='Query fasta file name.', required=True)
+                             help='Query fasta file name (comma separated for several samples).', required=True)
 requiredOptions.add_argument('-qs', '--query_species', type=str,
-                             help='query species', required=True)
+                             help='query species (comma separated for several samples)', required=True)
 requiredOptions.add_argument('-qid', '--query_id', type=str,
-                             help='query unique id', required=True)
+                             help='query unique id (comma separated for several samples)', required=True)
 requiredOptions.add_argument('-t', '--ref_transcriptome', type=str,
                              help='Target fasta file name', required=True)
 requiredOptions.add_argument('-d', '--database', type=str,
@@ -77,9 +85,9 @@ requiredOptions.add_argument('-d', '--database', type=str,
                               (default=: The database will be build in the temporary directory and will be remove at the end.)''',
                               required=False)
 requiredOptions.add_argument('-t2f', '--ref_transcriptome2family', type=str,
-                             help='Link file name. A tabular file, each line correspond to a sequence name and its family. ', required=True)
+                             help='Link file name. A tabular file, each line correspond to a sequence name and its family, or a link store written by ParseInput. ', required=True)
 requiredOptions.add_argument('-out', '--output_prefix', type=str, default="./output",
-                   help="Output prefix (default= ./output)")
+                   help="Output prefix (comma separated for several samples) (default= ./output)")
 
 requiredOptions.add_argument('--sp2seq_tab_out_by_family', action='store_true', default=False,
                    help="Return one file by family  (Seq:species)")
@@ -91,10 +99,42 @@ requiredOptions.add_argument('--tab_out_one_file', action='store_true', default=
 
 ##############
 Options = parser.add_argument_group('Options')
+Options.add_argument('-tsp', '--ref_transcriptome_species', type=str, default="",
+                     help="Comma separated species of the ref transcriptome. With a link store as -t2f, the target names are read from the store instead of the ref transcriptome. (default=: read the ref transcriptome)")
 Options.add_argument('-e', '--evalue', type=float,
                      help="Evalue threshold of the blastn of the queries on the database of the ref transcriptome. (default= 1e-6)",
                      default=1e-6)
 
+Options.add_argument('--fasta-width', type=int, default=60,
+                     help="Line width of the output fasta files, 0 to write each sequence on a single line. (default= 60)")
+
+Options.add_argument('--compress', type=str, choices=["gzip", "zstd"], default="",
+                     help="Compress the output files. (default=: not compressed)")
+Options.add_argument('--bundle', action='store_true', default=False,
+                     help="Write the files of the families of each sample as the members <family>.fa and <family>.sp2seq.txt of a single bundle <output prefix>.bundle, instead of two files by family. The members are not compressed. (default= False)")
+
+Options.add_argument('--blast-db-registry', type=str, default=os.environ.get("CAARS_BLAST_DB_REGISTRY", ""),
+                     help="Directory of blast databases shared between runs, the database of the ref transcriptome is built there once if the databases given with -d are incorrect. (default=: $CAARS_BLAST_DB_REGISTRY, or a database built in the temporary directory)")
+Options.add_argument('--blast-cache', type=str, default=os.environ.get("CAARS_BLAST_CACHE", ""),
+                     help="Directory of an on-disk cache of the blast hits of each query sequence, shared between runs. (default=: $CAARS_BLAST_CACHE, or no cache)")
+Options.add_argument('--blast-cache-size', type=int, default=1024,
+                     help="Maximal size of the blast cache in MB, the least recently used hits are evicted beyond. (default= 1024)")
+Options.add_argument('--blast-tiers', type=str, default=os.environ.get("CAARS_BLAST_TIERS", ""),
+                     help="Comma separated blast tasks tried in turn, e.g. megablast,dc-megablast: only the queries without hit, or whose best hits are in several families or below --tier-identity, are blasted again with the next task. (default=: $CAARS_BLAST_TIERS, or dc-megablast only)")
+Options.add_argument('--tier-identity', type=float, default=95,
+                     help="Minimal identity (%%) of the best hits of a query to keep the hits of a tier which is not the last one. (default= 95)")
+Options.add_argument('--prefilter', action='store_true', default=False,
+                     help="Route the queries with a minimizer index of the ref transcriptome before blasting them: the queries sharing no minimizer with the targets are discarded, the queries sharing mostly minimizers of a single family are assigned to it and only the others are blasted. (default= False)")
+Options.add_argument('--prefilter-index', type=str, default=os.environ.get("CAARS_PREFILTER_INDEX", ""),
+                     help="Directory of the minimizer indexes of the ref transcriptomes, an index is built once and reused by the next runs. It enables --prefilter. (default=: $CAARS_PREFILTER_INDEX, or an index built in the temporary directory)")
+Options.add_argument('--prefilter-k', type=int, default=15,
+                     help="k-mer size of the minimizers. (default= 15)")
+Options.add_argument('--prefilter-w', type=int, default=10,
+                     help="Number of consecutive k-mers of a minimizer window. (default= 10)")
+Options.add_argument('--prefilter-density', type=float, default=0.5,
+                     help="Minimal fraction of the query minimizers shared with a single family to assign it without blast. (default= 0.5)")
+Options.add_argument('--collapse-contained', action='store_true', default=bool(os.environ.get("CAARS_COLLAPSE_CONTAINED", "")),
+                     help="Blast only the longest isoforms of each Trinity gene: an isoform contained in another one gets its family and orientation. The queries with the same sequence are always blasted once. (default=: False, True if $CAARS_COLLAPSE_CONTAINED is set)")
 Options.add_argument('-tmp', type=str,
                      help="Directory to stock all intermediary files for the job. (default=: a directory in /tmp which will be removed at the end)",
                      default="")
@@ -116,14 +156,18 @@ MiscellaneousOptions.add_argument('--debug', action='store_true', default=False,
 args = parser.parse_args()
 
 ### Read arguments
-QueryFile = args.query
-SpeciesQuery = args.query_species
-SpeciesID = args.query_id
+QueryFiles = args.query.split(",")
+SpeciesQueries = args.query_species.split(",")
+SpeciesIDs = args.query_id.split(",")
+OutPrefixNames = args.output_prefix.split(",")
 TargetFile = args.ref_transcriptome
 Target2FamilyFilename = args.ref_transcriptome2family
+TargetSpecies = [Species for Species in args.ref_transcriptome_species.split(",") if Species]
 
 Evalue = args.evalue
 Threads = args.threads
+# The external commands share the thread budget
+Runner.set_threads(Threads)
 
 ### Set up the log directory
 if args.log:
@@ -133,6 +177,8 @@ if args.log:
 
 ### Set up the logger
 LogFile = args.log
+# The resources used by the external tools are recorded next to the log
+Runner.set_accounting(LogFile)
 # create logger
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
@@ -179,22 +225,26 @@ def end(exit_code):
     sys.exit(exit_code)
 
 ### Set up the output directory
-if args.output_prefix and os.path.dirname(args.output_prefix):
-    OutDirName = os.path.dirname(args.output_prefix)
-    OutPrefixName = args.output_prefix
-    if os.path.isdir(OutDirName):
-        logger.info("The output directory %s exists", os.path.dirname(args.output_prefix))
-    elif OutDirName: # if OutDirName is not a empty string we create the directory
-        logger.info("The output directory %s does not exist, it will be created", os.path.dirname(args.output_prefix))
-        os.makedirs(os.path.dirname(args.output_prefix))
-else:
-    logger.error("The output prefix must be defined")
+if not len(QueryFiles) == len(SpeciesQueries) == len(SpeciesIDs) == len(OutPrefixNames):
+    logger.error("-q, -qs, -qid and -out must have the same number of comma separated values")
     end(1)
 
+for OutPrefixName in OutPrefixNames:
+    OutDirName = os.path.dirname(OutPrefixName)
+    if not OutDirName:
+        logger.error("The output prefix must be defined")
+        end(1)
+    if os.path.isdir(OutDirName):
+        logger.info("The output directory %s exists", OutDirName)
+    else:
+        logger.info("The output directory %s does not exist, it will be created", OutDirName)
+        os.makedirs(OutDirName)
+
 ### Check that input files exist
-if not os.path.isfile(args.query):
-    logger.error(args.query + " (-q) is not a file.")
-    end(1)
+for QueryFile in QueryFiles:
+    if not os.path.isfile(QueryFile):
+        logger.error(QueryFile + " (-q) is not a file.")
+        end(1)
 
 if not os.path.isfile(args.ref_transcriptome):
     logger.error(args.ref_transcriptome + " (-t) is not a file.")
@@ -204,51 +254,60 @@ if not os.path.isfile(args.ref_transcriptome2family):
     logger.error(args.ref_transcriptome2family + " (-t2f) is not a file.")
     end(1)
 
-### Parse input fasta files
-## Get query names
-logger.info("Get query names")
-BashProcess = subprocess.Popen(["grep", "-e", "^>", args.query],
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-OutBashProcess = BashProcess.communicate()
-if not  OutBashProcess[1]:
-    QueryNames = OutBashProcess[0].strip().replace(">", "").split("\n")
-else:
-    logger.error(OutBashProcess[1])
-    end(1)
+### BLAST needs plain fasta files
+# All queries are blasted together, the name of each query is prefixed by the index of its sample
+QueryFile = "%s/Queries.fa" %TmpDirName
+with FastaIO.FastaWriter(QueryFile, Width=0) as Writer:
+    for (Sample, SampleQueryFile) in enumerate(QueryFiles):
+        for (Header, Sequence) in FastaIO.iter_fasta(SampleQueryFile, Threads=Threads):
+            Writer.write("%s_%s" %(Sample, Header), Sequence)
+TargetFile = CompressedIO.decompress_to_plain(TargetFile, TmpDirName, Threads=Threads)
+
+### Only a representative of the duplicated (and contained) queries is searched
+logger.info("Collapse the duplicated queries")
+Collapser = QueryCollapse.QueryCollapser(Containment=args.collapse_contained)
+BlastQueryFile = "%s/Queries.representatives.fa" %TmpDirName
+with FastaIO.FastaWriter(BlastQueryFile, Width=0) as Writer:
+    for (Header, Sequence) in Collapser.collapse(FastaIO.iter_fasta(QueryFile)):
+        Writer.write(Header, Sequence)
+Collapser.log_stats()
 
-## Get ref_transcriptome sequence names
+### Parse input fasta files
+## Get ref_transcriptome sequence names and parse the ref_transcriptome2family
 logger.info("Get ref_transcriptome names")
-BashProcess = subprocess.Popen(["grep", "-e", "^>",
-                                 args.ref_transcriptome],
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-OutBashProcess = BashProcess.communicate()
-if not  OutBashProcess[1]:
-    TargetNames = OutBashProcess[0].strip().replace(">", "").split("\n")
-else:
-    logger.error(OutBashProcess[1])
-    end(1)
-
-### Parse the ref_transcriptome2family
-Target2FamilyTable = pandas.read_csv(Target2FamilyFilename,
-                                      sep=None, engine='python',
-                                      header=None,
-                                      names=["Target", "Family"])
-
-# Check if there are no missing data
-MissingTargets = [target for target in TargetNames if not target in Target2FamilyTable.Target.values]
+(TargetNames, Target2FamilyTable, MissingTargets) = DispatchService.reference_targets(args.ref_transcriptome, Target2FamilyFilename, TargetSpecies)
 if MissingTargets:
     logger.warning("These targets are not present in the target2family link file, they will be added:\n\t- %s", "\n\t- ".join(MissingTargets))
-    MissingData = pandas.DataFrame({"Target" : MissingTargets,
-                                     "Family": MissingTargets})
-    Target2FamilyTable = pandas.concat([Target2FamilyTable, MissingData], ignore_index=True)
 
 
 if len(Target2FamilyTable['Target']) != len(Target2FamilyTable['Target'].unique()):
     logger.error("There are not unique target names")
     end(1)
 Target2FamilyDic = Target2FamilyTable.set_index('Target').T.to_dict('list')
+Target2Family = dict(zip(Target2FamilyTable.Target, Target2FamilyTable.Family))
+
+### Route the queries with the minimizers they share with the targets
+# PrefilterAssigned: {query: (family, target, reverse)} of the queries assigned without blast
+PrefilterAssigned = {}
+if args.prefilter or args.prefilter_index:
+    logger.info("Route the queries with a minimizer index of the ref transcriptome")
+    start_prefilter_time = time.time()
+    # The index is named after the given ref transcriptome, not after its plain temporary copy
+    Index = DispatchService.minimizer_index(args.prefilter_index or "%s/Minimizers" %TmpDirName, args.ref_transcriptome,
+                                            K=args.prefilter_k, W=args.prefilter_w, Threads=Threads)
+    Prefilter = Minimizer.Prefilter(Index, Target2Family, Density=args.prefilter_density)
+    RepresentativeFile = BlastQueryFile
+    BlastQueryFile = "%s/Queries.ambiguous.fa" %TmpDirName
+    with FastaIO.FastaWriter(BlastQueryFile, Width=0) as Writer:
+        for (Header, Sequence) in FastaIO.iter_fasta(RepresentativeFile):
+            (Route, Family, Target, Reverse) = Prefilter.route(Sequence)
+            if Route == Minimizer.Ambiguous:
+                Writer.write(Header, Sequence)
+            elif Route == Minimizer.Assigned:
+                for Query in Collapser.expand(FastaIO.fasta_id(Header)):
+                    PrefilterAssigned[Query] = (Family, Target, Reverse)
+    Prefilter.log_stats()
+    logger.debug("prefilter --- %s seconds ---", time.time() - start_prefilter_time)
 
 
 
@@ -257,15 +316,13 @@ logger.info("Check that there is a target database, otherwise build it")
 
 Databases = []
 
-if not args.database:
-    Databases.append("%s/Target_DB" %TmpDirName)
-else:
+if args.database:
     Databases.extend(args.database.split(","))
 
-Not_correct_database = False
+Not_correct_database = not Databases
 for DatabaseName in Databases:
-    CheckDatabase_BlastdbcmdProcess = BlastPlus.Blastdbcmd(DatabaseName, "", "")
-    if not CheckDatabase_BlastdbcmdProcess.is_database():
+    # The database files are checked, blastdbcmd is not launched
+    if not BlastPlus.is_database(DatabaseName):
         logger.info("Database %s does not exist", DatabaseName)
         Not_correct_database = True
 
@@ -274,28 +331,33 @@ if Not_correct_database:
     if not os.path.isfile(TargetFile):
        logger.error("The fasta file (-t) does not exist.")
        end(1)
-    
-    if len(Databases) > 1:
-        DatabaseName = "%s/Target_DB" %TmpDirName
-        Databases = [DatabaseName]
-        logger.info("Databases given in input are incorrect, a new database will be built in %s from %s", DatabaseName, TargetFile)
 
-    if os.path.isdir(os.path.dirname(DatabaseName)):
-        logger.info("Database directory exists")
+    if len(Databases) == 1 and not args.blast_db_registry:
+        DatabaseName = Databases[0]
+        if os.path.isdir(os.path.dirname(DatabaseName)) or not os.path.dirname(DatabaseName):
+            logger.info("Database directory exists")
+        else:
+            logger.info("Database directory does not exist, we create it")
+            os.makedirs(os.path.dirname(DatabaseName))
+        # database building
+        logger.info(DatabaseName + " database building")
+        MakeblastdbProcess = BlastPlus.Makeblastdb(TargetFile, DatabaseName)
+        (out, err) = MakeblastdbProcess.launch()
+        if err:
+            end(1)
+        BlastPlus.write_manifest(DatabaseName, Source=os.path.abspath(TargetFile))
     else:
-        logger.info("Database directory does not exist, we create it")
-        os.makedirs(os.path.dirname(DatabaseName))
-    # database building
-    logger.info(DatabaseName + " database building")
-    MakeblastdbProcess = BlastPlus.Makeblastdb(TargetFile, DatabaseName)
-    (out, err) = MakeblastdbProcess.launch()
-    if err:
-        end(1)
+        if Databases:
+            logger.info("Databases given in input are incorrect, the database of %s will be taken from the registry", TargetFile)
+        Registry = BlastPlus.DatabaseRegistry(args.blast_db_registry or "%s/Target_DB" %TmpDirName)
+        DatabaseName = Registry.database(TargetFile, Source=args.ref_transcriptome)
+        if not DatabaseName:
+            end(1)
+        Databases = [DatabaseName]
 
 
 for DatabaseName in Databases:
-    CheckDatabase_BlastdbcmdProcess = BlastPlus.Blastdbcmd(DatabaseName, "", "")
-    if not CheckDatabase_BlastdbcmdProcess.is_database():
+    if not BlastPlus.is_database(DatabaseName):
         logger.error("Problem in the database building")
         logger.info("Database %s does not exist", DatabaseName)
         end(1)
@@ -341,122 +403,82 @@ for DatabaseName in Databases:
 ### Blast the query fasta on the target database
 logger.info("Blast the query fasta on the target database")
 start_blast_time = time.time()
-BlastOutputFile = "%s/Queries_Targets.blast" % (TmpDirName)
-BlastnProcess = BlastPlus.Blast("blastn", QueryFile, db_list=Databases)
+BlastnProcess = BlastPlus.Blast("blastn", BlastQueryFile, db_list=Databases)
 BlastnProcess.Evalue = Evalue
 BlastnProcess.Task = "dc-megablast"
+# The queries resolved by a faster task are not blasted by the next ones
+BlastTiers = [Task for Task in args.blast_tiers.split(",") if Task] or [BlastnProcess.Task]
 BlastnProcess.max_target_seqs = 500
 BlastnProcess.max_hsps_per_subject = 1
 BlastnProcess.Threads = Threads
-BlastnProcess.OutFormat = "6"
+# dc-megablast scales poorly with -num_threads, the query is split between single threaded runs
+BlastnProcess.Shards = Threads
+if args.blast_cache:
+    BlastnProcess.Cache = BlastCache.BlastCache(args.blast_cache, MaxSize=args.blast_cache_size << 20)
 
-# Write blast ouptut in BlastOutputFile if the file does not exist
 if not os.stat(QueryFile).st_size:
     logger.info("No sequence in the query")
     end(0)
 
-(out, err) = BlastnProcess.launch(BlastOutputFile)
-if err:
-    end(1)
-
-if not os.stat(BlastOutputFile).st_size:
-    logger.info("Blast found no hit")
-    end(0)
-
-logger.debug("blast --- %s seconds ---", str(time.time() - start_blast_time))
-
 ### Parse blast results
 # Fields: query id, subject id, % identity, alignment length, mismatches, gap opens, q. start, q. end, s. start, s. end, evalue, bit score
 FieldNames = ["qid", "tid", "id", "alilen", "mis", "gap", "qstart", "qend", "tstart", "tend", "evalue", "score"]
-BlastTable = pandas.read_csv(BlastOutputFile, sep=None, engine='python', header=None, names=FieldNames)
-
-# Get Family for each Target:
-BlastTableWithFamilies = pandas.merge(BlastTable, Target2FamilyTable, how='left', left_on=['tid'], right_on=['Target'])
+Score = FieldNames.index("score")
 
-# First: Find the best hit for each Query sequences and create a Hit dictonary
+# First: Find the best hits of each Query sequence, keep the queries whose best hits are in a single family
+# The hits of each query are parsed while blast runs, only the best hits of the retained queries are kept
 logger.info("First Step")
-HitDic = {}
-NoHitList = []
-
-for Query in QueryNames:
-    Query = Query.split()[0]
-    TmpTable = BlastTableWithFamilies[BlastTableWithFamilies.qid == Query]
-    if not len(TmpTable.index):
-        NoHitList.append(Query)
-    else:
-        TmpBestScore = max(TmpTable.score)
-
-        BestTargetTable = TmpTable[TmpTable.score == TmpBestScore]
-        BestTargetTable.is_copy = False
-
-        BestTarget = BestTargetTable.tid.values
-        BestTargetTable["reverse_calc"] = (BestTargetTable["qend"] - BestTargetTable["qstart"]) * (BestTargetTable["tend"] - BestTargetTable["tstart"])
-
-        BestTargetTable.loc[BestTargetTable['reverse_calc'] >= 0, "reverse"] = False
-        BestTargetTable.loc[BestTargetTable['reverse_calc'] < 0, 'reverse'] = True
-
-        TmpFamily = BestTargetTable["Family"].unique()
-
-        if len(TmpFamily) > 1:
-            logger.info("More than one family can be attributed to %s:\n\t- %s\nIt will be discarded.", Query, "\n\t- ".join(TmpFamily))
+BlastHits = False
+BestHitRows = []
+if os.stat(BlastQueryFile).st_size:
+    for (Query, Rows) in BlastnProcess.iter_tiered_hits(BlastTiers, BlastPlus.family_resolver(Target2Family, args.tier_identity)):
+        BlastHits = True
+        BestScore = max(Row[Score] for Row in Rows)
+        Targets = set()
+        Families = []
+        QueryBestHits = []
+        for Row in Rows:
+            if Row[Score] == BestScore and not Row[1] in Targets:
+                Targets.add(Row[1])
+                QueryBestHits.append(Row)
+                if not Target2Family.get(Row[1]) in Families:
+                    Families.append(Target2Family.get(Row[1]))
+        if len(Families) > 1:
+            logger.info("More than one family can be attributed to %s:\n\t- %s\nIt will be discarded.", Query.split("_", 1)[1], "\n\t- ".join(str(Family) for Family in Families))
         else:
-            Family = TmpFamily[0]
-            for Target in BestTarget:
-
-                HitDic.setdefault(Family, {})
-                HitDic[Family].setdefault(Target, {"Query":[], "Score":[], "Reverse":[], "Retained":[]})
+            BestHitRows.extend(QueryBestHits)
+            # The queries represented by this query get its hits
+            for Member in Collapser.Members.get(Query, []):
+                BestHitRows.extend((Member,) + tuple(Row[1:]) for Row in QueryBestHits)
+    if BlastnProcess.Cache is not None:
+        BlastnProcess.Cache.log_stats()
+        BlastnProcess.Cache.close()
+    if BlastnProcess.Err:
+        end(1)
+    if not BlastHits:
+        logger.info("Blast found no hit")
+else:
+    logger.info("All the queries have been routed by the prefilter")
 
-                HitDic[Family][Target]["Query"].append(Query)
-                HitDic[Family][Target]["Score"].append(TmpBestScore)
-                HitDic[Family][Target]["Reverse"].append(BestTargetTable.reverse[BestTargetTable.tid == Target].values[0])
+if not BlastHits and not PrefilterAssigned:
+    end(0)
 
+logger.debug("blast --- %s seconds ---", str(time.time() - start_blast_time))
 
-#if NoHitList:
-#    logger.debug("Queries wihout blast hit:\n\t- %s", "\n\t- ".join(NoHitList))
+# Get Family and Sample for each hit:
+Hits = pandas.DataFrame(BestHitRows, columns=FieldNames)
+Hits["Family"] = Hits.tid.map(Target2Family)
+Hits["sample"] = Hits.qid.map(lambda qid: int(qid.split("_", 1)[0])).astype(int)
 
-# Second: For each family, for each target with an hit we kept hits with a score >=0.9 of the best hit
+# Second: For each sample and each target with an hit we kept hits with a score >=0.9 of the best hit
 logger.info("Second Step")
 Threshold = 0.9
-ConfirmedHitDic = {}
-for Family in HitDic.keys():
-    ConfirmedHitDic.setdefault(Family, {"Retained":[], "To_be_reverse":[]})
-    for Target in HitDic[Family]:
-        ConfirmedHitDic[Family].setdefault(Target, {"Retained":[]})
-        BestScore = max(HitDic[Family][Target]["Score"])
-        L = len(HitDic[Family][Target]["Score"])
-        for i in range(L):
-            if HitDic[Family][Target]["Score"][i] >= (Threshold * BestScore):
-                ConfirmedHitDic[Family][Target]["Retained"].append(HitDic[Family][Target]["Query"][i])
-                if HitDic[Family][Target]["Reverse"][i]:
-                    ConfirmedHitDic[Family]["To_be_reverse"].append(HitDic[Family][Target]["Query"][i])
+TargetBestScores = Hits.groupby(["sample", "tid"], observed=True).score.transform("max")
+RetainedHits = Hits[Hits.score >= Threshold * TargetBestScores]
+RetainedHits = RetainedHits.assign(reverse=(RetainedHits.qend - RetainedHits.qstart) * (RetainedHits.tend - RetainedHits.tstart) < 0)
 
 ### Write output file
 # usefull functions:
-def read_fasta(fasta_string):
-    if fasta_string:
-        Fasta = fasta_string.strip().split("\n")
-    else:
-        Fasta = []
-    name = ""
-    sequence_list = []
-    fasta_dict = {}
-
-    for line in Fasta + [">"]:
-        if re.match(">", line):
-            # This is a new sequence write the previous sequence if it exists
-            if sequence_list:
-                fasta_dict.setdefault(name, "")
-                sequence = "".join(sequence_list)
-                sequence_list = []
-                fasta_dict[name] = sequence
-            name = line.replace(">lcl|", "").strip().split()[0] # remove the ">lcl|"
-            name = name.replace(">","")
-        elif name != "":
-            sequence_list.append(line)
-        else:
-            pass
-    return fasta_dict
-
 def rev_complement(Sequence_str):
     intab = "ABCDGHMNRSTUVWXYabcdghmnrstuvwxy"
     outtab = "TVGHCDKNYSAABWXRtvghcdknysaabwxr"
@@ -467,18 +489,13 @@ def rev_complement(Sequence_str):
     Complement = Reverse.translate(trantab)
     return Complement
 
-def write_fasta(fasta_dict, outfile):
-    String = []
-    Output = open(outfile, "w")
-    for (n, s) in fasta_dict.items():
-        formated_sequence = ">" + n + "\n" + '\n'.join(s[i:i+60] for i in range(0, len(s), 60)) + "\n"
-        String.append(formated_sequence)
-    Output.write("".join(String))
-    Output.close()
+def write_fasta(fasta_records, outfile):
+    FastaIO.write_fasta(outfile, fasta_records, Width=args.fasta_width)
 
 
-def rename_fasta(fasta_dict, Family):
-    for o_k in fasta_dict.keys():
+def rename_fasta(fasta_records, Family):
+    renamed_records = []
+    for (o_k, sequence) in fasta_records:
         SeqName = "%s%s%s" %(SeqId_dic["SeqPrefix"],
                                  string.zfill(SeqId_dic["SeqNb"],
                                               SeqId_dic["NbFigures"]
@@ -486,87 +503,85 @@ def rename_fasta(fasta_dict, Family):
                                  "_%s" %(Family))
         SeqId_dic["SeqNb"] += 1
 
-        if o_k in ConfirmedHitDic[Family]["To_be_reverse"]:
-            fasta_dict[SeqName] = rev_complement(fasta_dict.pop(o_k))
+        if o_k in ToBeReversed:
+            renamed_records.append((SeqName, rev_complement(sequence)))
             logger.info(SeqName + ": Reversed sequence")
         else:
-            fasta_dict[SeqName] = fasta_dict.pop(o_k)
+            renamed_records.append((SeqName, sequence))
 
-        Target = TmpDic[o_k]
+        Target = Query2Target[o_k]
         if args.tab_out_one_file:
             # Write in the output table query target family
             OutputTableString.append("%s\t%s\t%s\n" %(SeqName, Target, Family))
         if args.sp2seq_tab_out_by_family:
             TabByFamilyString.append("%s:%s\n" %(SpeciesQuery, SeqName))
+    return renamed_records
 
-## Build a query database
-logger.info("Build a query database")
-QueryDatabaseName = "%s/Query_DB" %TmpDirName
-if not os.path.isfile(QueryFile):
-    logger.error("The query fasta file (-q) does not exist.")
-    end(1)
-# database building
-logger.info(QueryDatabaseName + " database building")
-MakeblastdbProcess = BlastPlus.Makeblastdb(QueryFile, QueryDatabaseName)
-ExitCode = MakeblastdbProcess.launch()
-
-CheckDatabase_BlastdbcmdProcess = BlastPlus.Blastdbcmd(QueryDatabaseName, "", "")
-if not CheckDatabase_BlastdbcmdProcess.is_database():
-    logger.error("Problem in the database building")
-    logger.info("Database %s does not exist", QueryDatabaseName)
-    end(1)
-else:
-    logger.info("Database %s exists", QueryDatabaseName)
-
-## Third step: For each family, write a fasta which contained all retained family
+## Third step: For each sample and each family, write a fasta which contained all retained family
 logger.info("Write output files")
-OutputTableString = []
-SeqId_dic = {"SeqPrefix" : "TR%s0" %(SpeciesID),
-             "SeqNb" : 1, "NbFigures" : 10}
-
-for Family in ConfirmedHitDic.keys():
-    logger.debug("for %s", Family)
-    TmpRetainedNames = []
-    TmpDic = {}
-    for Target in HitDic[Family]:
-        TmpRetainedNames.extend(ConfirmedHitDic[Family][Target]["Retained"])
-        for Query in ConfirmedHitDic[Family][Target]["Retained"]:
-            TmpDic[Query] = Target
-    ## Write outputs
-    #Get retained sequences names
-    start_blastdbcmd_time = time.time()
-    TmpFilename = "%s/%s_sequences_names.txt" %(TmpDirName, Family)
-    TmpFile = open(TmpFilename, "w")
-    TmpFile.write("\n".join(TmpRetainedNames))
-    TmpFile.close()
-    #Get retained sequences
-    FamilyOutputName = "%s.%s.fa" %(OutPrefixName, Family)
-    TabFamilyOutputName = "%s.%s.sp2seq.txt" %(OutPrefixName, Family)
-    TabByFamilyString = []
-
-    BlastdbcmdProcess = BlastPlus.Blastdbcmd(QueryDatabaseName, TmpFilename, "")
-    (FastaString, err) = BlastdbcmdProcess.launch()
-    if err:
-        end(1)
-    logger.debug("blastdbcmd --- %s seconds ---", time.time() - start_blastdbcmd_time)
-
-    #Read fasta
-    family_fasta_dict = read_fasta(FastaString)
-    #Rename sequences:
-    rename_fasta(family_fasta_dict, Family)
+RetainedQueries = RetainedHits.drop_duplicates("qid")
+Query2Family = dict(zip(RetainedQueries.qid, RetainedQueries.Family))
+Query2Target = dict(zip(RetainedQueries.qid, RetainedQueries.tid))
+ToBeReversed = set(RetainedHits.qid[RetainedHits.reverse])
+for (Query, (Family, Target, Reverse)) in PrefilterAssigned.items():
+    Query2Family[Query] = Family
+    Query2Target[Query] = Target
+    if Reverse:
+        ToBeReversed.add(Query)
+
+# The retained sequences of all samples and families are read in a single pass over the queries
+start_extraction_time = time.time()
+SampleFamilySequences = [{} for Sample in QueryFiles]
+for (Header, Sequence) in FastaIO.iter_fasta(QueryFile):
+    Query = FastaIO.fasta_id(Header)
+    if Sequence and Query in Query2Family:
+        Sample = int(Query.split("_", 1)[0])
+        SampleFamilySequences[Sample].setdefault(Query2Family.pop(Query), []).append((Query, Sequence))
+logger.debug("extraction --- %s seconds ---", time.time() - start_extraction_time)
+
+for (Sample, FamilySequences) in enumerate(SampleFamilySequences):
+    SpeciesQuery = SpeciesQueries[Sample]
+    SpeciesID = SpeciesIDs[Sample]
+    OutPrefixName = OutPrefixNames[Sample]
+    logger.info("Write output files of %s (%s)", SpeciesID, SpeciesQuery)
+
+    OutputTableString = []
+    SeqId_dic = {"SeqPrefix" : "TR%s0" %(SpeciesID),
+                 "SeqNb" : 1, "NbFigures" : 10}
+
+    if args.bundle:
+        Bundle = FamilyBundle.BundleWriter("%s.bundle" %OutPrefixName)
+
+    for Family in sorted(FamilySequences):
+        logger.debug("for %s", Family)
+        FamilyOutputName = CompressedIO.compressed_name("%s.%s.fa" %(OutPrefixName, Family), args.compress)
+        TabFamilyOutputName = CompressedIO.compressed_name("%s.%s.sp2seq.txt" %(OutPrefixName, Family), args.compress)
+        TabByFamilyString = []
+
+        #Rename sequences:
+        family_fasta_records = rename_fasta(FamilySequences[Family], Family)
+
+        if args.bundle:
+            Bundle.write("%s.fa" %Family, FastaIO.fasta_string(family_fasta_records, Width=args.fasta_width))
+            if args.sp2seq_tab_out_by_family:
+                Bundle.write("%s.sp2seq.txt" %Family, "".join(TabByFamilyString))
+            continue
+
+        write_fasta(family_fasta_records, FamilyOutputName)
 
-    write_fasta(family_fasta_dict, FamilyOutputName)
-
-    if args.sp2seq_tab_out_by_family:
-        TabFamilyOutput = open(TabFamilyOutputName, "w")
-        TabFamilyOutput.write("".join(TabByFamilyString))
-        TabFamilyOutput.close()
-
-if args.tab_out_one_file:
-    OutputTableFilename = "%s_table.tsv" %(OutPrefixName)
-    OutputTableFile = open(OutputTableFilename, "w")
-    OutputTableFile.write("".join(OutputTableString))
-    OutputTableFile.close()
+        if args.sp2seq_tab_out_by_family:
+            TabFamilyOutput = CompressedIO.open_file(TabFamilyOutputName, "w")
+            TabFamilyOutput.write("".join(TabByFamilyString))
+            TabFamilyOutput.close()
+
+    if args.bundle:
+        Bundle.close()
+
+    if args.tab_out_one_file:
+        OutputTableFilename = CompressedIO.compressed_name("%s_table.tsv" %(OutPrefixName), args.compress)
+        OutputTableFile = CompressedIO.open_file(OutputTableFilename, "w")
+        OutputTableFile.write("".join(OutputTableString))
+        OutputTableFile.close()
 
 logger.info("--- %s seconds ---", str(time.time() - start_time))
 
@@ -34,7 +34,6 @@
 # knowledge of the CeCILL license and that you accept its terms.
 
 import os
-import re
 import sys
 import time
 import tempfile
@@ -44,7 +43,10 @@ import argparse
 import subprocess
 
 import Aligner
+import LinkStore
 import PhyloPrograms
+import Runner
+from Alignment import Alignment
 
 from ete2 import Tree
 
@@ -110,6 +112,8 @@ if args.log:
 
 ### Set up the logger
 LogFile = args.log
+# The resources used by the external tools are recorded next to the log
+Runner.set_accounting(LogFile)
 # create logger
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
@@ -156,6 +160,12 @@ def end(ReturnCode):
     logger.debug("--- %s seconds ---", str(time.time() - start_time))
     sys.exit(ReturnCode)
 
+def check_error(err):
+    """Stop if an external program failed, err is its message"""
+    if err:
+        logger.error(err)
+        end(1)
+
 ### Set up the output directory
 if args.output_prefix:
     OutDirName = os.path.dirname(args.output_prefix)
@@ -210,29 +220,6 @@ def cp(In, Out):
 
 
 
-def count_aligned_pos(seq, ref):
-    (ali_p,id_p) = (0,0)
-    if len(seq) == len(ref):
-        l=0
-        ali_nb=0
-        id_nb=0
-        for i in range(len(ref)):
-            if ref[i] != "-":
-                l +=1
-                if seq[i] != "-":
-                    ali_nb+=1
-                    if seq[i] == ref[i]:
-                        id_nb+=1
-        if l == 0:
-            pass
-        else:
-            ali_p = ali_nb/float(l) *100
-            if ali_nb > 0:
-                id_p = id_nb/float(ali_nb) *100
-
-    return (ali_p,id_p)
-
-
 def get_closest_seq(tree, seq_test, list_otherseq):
     m = 100000000
     closest_name = ""
@@ -246,82 +233,6 @@ def get_closest_seq(tree, seq_test, list_otherseq):
             #logger.debug("closest sequences: %s (%s)", closest_name, d)
     return (closest_name, d)
 
-class Fasta(object):
-    def __init__(self):
-        self.d = {}
-
-    def __str__(self):
-        string = []
-        for s in self.d.values():
-            string.extend([str(s)])
-        return("".join(string))
-
-    def append(self,new_sequence):
-        assert isinstance(new_sequence, Sequence), "Sequence must belong to the Sequence class"
-        self.d[new_sequence.Name] = new_sequence
-
-    def get(self, name, default=""):
-        if name in self.d.keys():
-            return self.d[name].Sequence
-        else:
-            return default
-
-    def read_fasta(self, FastaFilename = "" , String = ""):
-        if String:
-            Fasta = String.strip().split("\n")
-        elif os.path.isfile(FastaFilename):
-            with open(FastaFilename,"r") as File:
-                Fasta = File.read().strip().split("\n")
-        else:
-            Fasta = []
-
-        name = ""
-        sequence_list = []
-
-        for line in Fasta + [">"]:
-            if re.match(">",line):
-                # This is a new sequence write the previous sequence if it exists
-                if sequence_list:
-                    new_sequence = Sequence()
-                    new_sequence.Name = name
-                    new_sequence.Sequence = "".join(sequence_list)
-                    self.append(new_sequence)
-                    sequence_list = []
-
-                name = line.split()[0][1:] # remove the >
-
-            elif name != "":
-                sequence_list.append(line)
-            else:
-                pass
-
-    def filter_fasta(self, SelectedNames):
-        FilteredFasta = Fasta()
-        for s in self.d.values():
-            if s.Name in SelectedNames:
-                FilteredFasta.append(s)
-        return FilteredFasta
-
-    def dealign_fasta(self):
-        DealignedFasta = Fasta()
-        for s in  self.d.values():
-            s.Sequence = s.Sequence.replace("-", "")
-            DealignedFasta.append(s)
-        return DealignedFasta
-
-    def write_fasta(self, OutFastaFile):
-        # Write all sequences in the file
-        write_in_file(str(self), OutFastaFile)
-
-
-class Sequence(object):
-    def __init__(self,):
-        self.Name = ""
-        self.Sequence = ""
-    def __str__(self):
-        return(">" + self.Name + "\n" + '\n'.join(self.Sequence[i:i+60] for i in range(0, len(self.Sequence), 60)) + "\n")
-
-
 if args.filter_threshold > 0:
     logger.info("All sequences with a percentage of alignement with its sister sequence under %s will be discarded.", args.filter_threshold)
     sequenceTodiscard = []
@@ -329,8 +240,7 @@ if args.filter_threshold > 0:
     AliLenSummary = []
 
     #Read fasta
-    prefilter_fasta = Fasta()
-    prefilter_fasta.read_fasta(FastaFilename = StartingAli)
+    prefilter_ali = Alignment.from_fasta(FastaFilename = StartingAli)
 
     #Read tree
     tree = Tree(StartingTree)
@@ -339,15 +249,12 @@ if args.filter_threshold > 0:
     list_refineseq = []
     list_otherseq = []
     seq2sp_dict = {}
-    with open(StartingSp2Seq,"r") as sp2seqFile:
-        lines = sp2seqFile.read().strip().split("\n")
-        for line in lines:
-            (sp, seq) = line .split(":")
-            seq2sp_dict[seq] = sp
-            if sp in SpToRefine:
-                list_refineseq.append(seq)
-            else:
-                list_otherseq.append(seq)
+    for (sp, seq) in LinkStore.iter_sp2seq(StartingSp2Seq):
+        seq2sp_dict[seq] = sp
+        if sp in SpToRefine:
+            list_refineseq.append(seq)
+        else:
+            list_otherseq.append(seq)
     
     sequenceTokeep.extend(list_otherseq)
 
@@ -356,11 +263,8 @@ if args.filter_threshold > 0:
         (closest_name, d) = get_closest_seq(tree, seqR_name, list_otherseq)
         logger.debug("final closest sequences: %s (%s)", closest_name, d)
 
-        seqR_sequence = prefilter_fasta.get(seqR_name)
-        closest_sequence = prefilter_fasta.get(closest_name)
-
         #Count number of aligned position
-        (ali_p, id_p) = count_aligned_pos(seqR_sequence, closest_sequence)
+        (ali_p, id_p) = prefilter_ali.coverage_identity(seqR_name, closest_name)
 
         if ali_p > args.filter_threshold and id_p >= 50 :
             sequenceTokeep.append(seqR_name)
@@ -371,9 +275,8 @@ if args.filter_threshold > 0:
             if closest_name:
                 list_otherseq.remove(closest_name)
             (closest_name, d) = get_closest_seq(tree, seqR_name, list_otherseq)
-            closest_sequence = prefilter_fasta.get(closest_name)
             logger.info("Test again with the second closest sequence (%s)", closest_name)
-            (ali_p, id_p) = count_aligned_pos(seqR_sequence, closest_sequence)
+            (ali_p, id_p) = prefilter_ali.coverage_identity(seqR_name, closest_name)
             if ali_p > args.filter_threshold and id_p >= 50 :
                 sequenceTokeep.append(seqR_name)
                 AliLenSummary.append("\t".join([seqR_name, closest_name, str(ali_p), str(id_p), str(args.filter_threshold), "K2"]))
@@ -389,11 +292,10 @@ if args.filter_threshold > 0:
         SummaryFile.write("\n".join(AliLenSummary)+"\n")
     
     if len(sequenceTodiscard) > 0:
-        filteredfasta = prefilter_fasta.filter_fasta(sequenceTokeep)
+        filteredfasta = prefilter_ali.subset(sequenceTokeep)
 
-        discardedfasta = prefilter_fasta.filter_fasta(sequenceTodiscard)
-        discardedfasta = discardedfasta.dealign_fasta()
-        discardedfasta.write_fasta(FinalDiscarded)
+        discardedfasta = prefilter_ali.subset(sequenceTodiscard)
+        discardedfasta.write_fasta(FinalDiscarded, dealign=True)
         
         lines = []
         for (seq, sp) in seq2sp_dict.items():
@@ -417,7 +319,8 @@ if args.filter_threshold > 0:
 
             if os.path.isfile(TmpAli):
                 logger.info("Realign the filtered alignment")
-                _ = MafftProcess.launch()
+                (out, err) = MafftProcess.launch()
+                check_error(err)
                 StartingAlignment = MafftProcess.OutputFile
             else:
                 logger.error("%s is not a file.", TmpAli)
@@ -432,7 +335,8 @@ if args.filter_threshold > 0:
         FinalFasttreeProcess.OutputTree = FinalTree
 
         if os.path.isfile(FinalAli):
-            FinalFasttreeProcess.get_output()
+            (out, err) = FinalFasttreeProcess.get_output()
+            check_error(err)
         else:
             logger.error("%s is not a file. There was an issue with the previous step.", FinalAli)
             end(1)
@@ -452,7 +356,8 @@ if args.filter_threshold > 0:
             t.write(format=0, outfile=FinalTree)
 
         if not os.path.isfile(FinalTree):
-            FinalFasttreeProcess.get_output()
+            (out, err) = FinalFasttreeProcess.get_output()
+            check_error(err)
             logger.error("%s is not a file. There was an issue with the previous step.", FinalTree)
             end(1)
 
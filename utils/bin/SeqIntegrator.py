@@ -45,6 +45,10 @@ import subprocess
 
 import PhyloPrograms
 import Aligner
+import FamilyBundle
+import FastaIO
+import IncrementalMerge
+import Runner
 
 from ete2 import Tree
 
@@ -62,9 +66,9 @@ requiredOptions = parser.add_argument_group('Required arguments')
 requiredOptions.add_argument('-ali', '--alignment', type=str,
                              help='Alignment file name.', required=True)
 requiredOptions.add_argument('-fa', '--fasta', type=str,
-                             help='Fasta file names delimited by a coma')
+                             help='Fasta file names delimited by a coma. A member of a bundle is given as <bundle>::<member>.')
 requiredOptions.add_argument('-sp2seq', type=str,
-                             help='Link file name. A tabular file, each line correspond to a sequence name and its species. File names delimited by comas.', required=True)
+                             help='Link file name. A tabular file, each line correspond to a sequence name and its species. File names delimited by comas, <bundle>::<member> for a member of a bundle.', required=True)
 requiredOptions.add_argument('-out', '--output_prefix', type=str, default="./output",
                    help="Output prefix (Default ./output)")
 ##############
@@ -80,6 +84,8 @@ Options.add_argument('--realign_ali', action='store_true', default=False,
                     help="Realign the ali even if no sequences to add. (default: False)")
 Options.add_argument('--resolve_polytomy', action='store_true', default=False,
                     help="resolve polytomy. (default: False)")
+Options.add_argument('--incremental_merge', action='store_true', default=bool(os.environ.get("CAARS_INCREMENTAL_MERGE", "")),
+                    help="At each merge iteration, only add the merged sequences to the alignment of the unchanged sequences instead of realigning all sequences, and start the tree search from the tree of the previous iteration. The final alignment is realigned once. (default: $CAARS_INCREMENTAL_MERGE, or False)")
 Options.add_argument('-tmp', type=str,
                     help="Directory to stock all intermediary files for the job. (default: a directory in /tmp which will be removed at the end)",
                     default="")
@@ -112,6 +118,8 @@ if args.log:
 
 ### Set up the logger
 LogFile = args.log
+# The resources used by the external tools are recorded next to the log
+Runner.set_accounting(LogFile)
 # create logger
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
@@ -171,6 +179,12 @@ def end(ReturnCode):
             shutil.rmtree(TmpDirName)
     sys.exit(ReturnCode)
 
+def check_error(err):
+    """Stop if an external program failed, err is its message"""
+    if err:
+        logger.error(err)
+        end(1)
+
 ### Set up the output directory
 if args.output_prefix:
     OutDirName = os.path.dirname(args.output_prefix)
@@ -189,33 +203,31 @@ if not os.path.isfile(StartingAlignment):
     logger.error(StartingAlignment+" is not a file.")
     end(1)
 
+# Input files can be members of a bundle (<bundle>::<member>)
 StartingFastaFiles = []
 for f in FastaFiles:
-    if os.path.isfile(f) and os.path.getsize(f) > 0:
+    if FamilyBundle.member_size(f) > 0:
         StartingFastaFiles.append(f)
 
 StartingSp2SeqFiles = []
 for f in Sp2SeqFiles:
-    if os.path.isfile(f) and os.path.getsize(f) > 0:
+    if FamilyBundle.member_size(f) > 0:
         logger.debug(f)
         StartingSp2SeqFiles.append(f)
 
 ### A function to cat input files
 def cat(Files, OutputFile):
     (out, err, Output) = ("", "", "")
-    command = ["cat"]
     logger.debug(Files)
 
-    if type(Files) == type([]) and len(Files) == 1:
+    if type(Files) == type([]) and len(Files) == 1 and FamilyBundle.split_member_path(Files[0])[1] is None:
         Output = Files[0]
     else:
-        command.extend(Files)
-        logger.debug(" ".join(command))
-        p = subprocess.Popen(command,
-                           stdout=open(OutputFile, 'w'),
-                           stderr=subprocess.PIPE)
-        (out, err) = p.communicate()
-        if err:
+        try:
+            with open(OutputFile, "wb") as Handle:
+                FamilyBundle.concatenate(Files, Handle)
+        except (IOError, ValueError) as e:
+            err = str(e)
             logger.error(err)
         Output = OutputFile
     return (out, err, Output)
@@ -257,7 +269,8 @@ if args.realign_ali:
 
     if os.path.isfile(StartingAlignment):
         logger.info("Realign the input alignment")
-        _ = InitialMafftProcess.launch()
+        (out, err) = InitialMafftProcess.launch()
+        check_error(err)
         StartingAlignment = InitialMafftProcess.OutputFile
     else:
         logger.error("%s is not a file.", StartingAlignment)
@@ -289,6 +302,7 @@ if StartingFastaFiles and Sp2SeqFiles:
     MafftProcessAdd.OutputFile = "%s/StartMafft.fa" %TmpDirName
     if os.path.isfile(StartingAlignment) and os.path.isfile(StartingFasta):
         (out, err) = MafftProcessAdd.launch()
+        check_error(err)
     else:
         logger.error("%s or %s is not a file", StartingAlignment, StartingFasta)
         end(1)
@@ -303,6 +317,7 @@ if StartingFastaFiles and Sp2SeqFiles:
     MafftProcess.OutputFile = "%s/StartMafftRealign.0.fa" %TmpDirName
     if os.path.isfile(MafftProcessAdd.OutputFile):
         (out, err) = MafftProcess.launch()
+        check_error(err)
     else:
         logger.error("%s is not a file", MafftProcessAdd.OutputFile)
         end(1)
@@ -320,6 +335,9 @@ if StartingFastaFiles and Sp2SeqFiles:
         NbSeq_previous_iter = 0
         NbSeq_current_iter = count_lines(sp2seq)
         i = 0
+        # Incremental merge: starting tree of the next iteration and number of incremental realignments
+        IntreeFilename = ""
+        NbIncremental = 0
         while (NbSeq_current_iter > 1 and NbSeq_current_iter != NbSeq_previous_iter):
             logger.debug("%s iterations, %s NbSeq_current_iter, %s NbSeq_previous_iter", i, NbSeq_current_iter, NbSeq_previous_iter)
             i += 1
@@ -331,8 +349,10 @@ if StartingFastaFiles and Sp2SeqFiles:
             FasttreeProcess.Gtr = True
             FasttreeProcess.Gamma = True
             FasttreeProcess.OutputTree = "%s/StartTree.tree" %TmpDirName
+            FasttreeProcess.InputTree = IntreeFilename
             if os.path.isfile(ali):
-                FasttreeProcess.get_output()
+                (out, err) = FasttreeProcess.get_output()
+                check_error(err)
             else:
                 logger.error("%s is not a file. There was an issue with the previous step.", ali)
                 end(1)
@@ -371,31 +391,78 @@ if StartingFastaFiles and Sp2SeqFiles:
             if os.path.isfile(ali) and \
                os.path.isfile(StartTreeFilename) and \
                os.path.isfile(PhylomergeProcess.TaxonToSequence):
-                PhylomergeProcess.launch()
+                (out, err) = PhylomergeProcess.launch()
+                check_error(err)
             else:
                 logger.error("%s or %s or %s is not a file. There was an issue with the previous step.",
                 ali, StartTreeFilename, PhylomergeProcess.TaxonToSequence)
                 end(1)
 
-            ### Realign the merged alignment
-            logger.info("Realign the merged alignment (%s)", i)
-            MafftProcess = Aligner.Mafft(PhylomergeProcess.OutputSequenceFile)
-            MafftProcess.AdjustdirectionOption = False
-            #MafftProcess.Maxiterate = 2 # too long
-            MafftProcess.AutoOption = True
-            MafftProcess.QuietOption = True
-            MafftProcess.OutputFile = "%s/StartMafftRealign.%s.fa" %(TmpDirName,i)
-            if os.path.isfile(PhylomergeProcess.OutputSequenceFile):
-                (out, err) = MafftProcess.launch()
-            else:
-                logger.error("%s is not a file", MafftProcessAdd.OutputFile)
+            if not os.path.isfile(PhylomergeProcess.OutputSequenceFile):
+                logger.error("%s is not a file", PhylomergeProcess.OutputSequenceFile)
                 end(1)
 
-            ali = MafftProcess.OutputFile
+            IncrementalAli = ""
+            IntreeFilename = ""
+            if args.incremental_merge:
+                ### Add the merged sequences to the alignment of the unchanged sequences
+                PreviousRecords = IncrementalMerge.read_alignment(ali)
+                (Untouched, Merged, Removed) = IncrementalMerge.split_merged(PreviousRecords,
+                                                    IncrementalMerge.read_alignment(PhylomergeProcess.OutputSequenceFile))
+                logger.info("%s unchanged sequences, %s merged sequences to realign (%s)", len(Untouched), len(Merged), i)
+                ProfileFilename = "%s/Unchanged.%s.fa" %(TmpDirName, i)
+                if IncrementalMerge.write_profile(PreviousRecords, Untouched, ProfileFilename) >= 2:
+                    IncrementalAli = "%s/StartMafftRealign.%s.fa" %(TmpDirName, i)
+                    if Merged:
+                        MergedFilename = "%s/Merged.%s.fa" %(TmpDirName, i)
+                        FastaIO.write_fasta(MergedFilename, Merged, Width=0)
+                        MafftProcess = Aligner.Mafft(ProfileFilename)
+                        MafftProcess.AddOption = MergedFilename
+                        MafftProcess.QuietOption = True
+                        MafftProcess.OutputFile = IncrementalAli
+                        (out, err) = MafftProcess.launch()
+                        check_error(err)
+                    else:
+                        (out, err) = mv(ProfileFilename, IncrementalAli)
+                    NbIncremental += 1
+
+                    ### The tree of this iteration is the starting tree of the next one
+                    Members = IncrementalMerge.merge_members(PreviousRecords, Removed, Merged,
+                                                             IncrementalMerge.read_sp2seq(Int1Sp2Seq))
+                    if IncrementalMerge.starting_tree(StartTreeFilename, Untouched + [Name for (Name, _) in Merged],
+                                                      Members, "%s/Intree.%s.tree" %(TmpDirName, i)):
+                        IntreeFilename = "%s/Intree.%s.tree" %(TmpDirName, i)
+
+            if IncrementalAli:
+                ali = IncrementalAli
+            else:
+                ### Realign the merged alignment
+                logger.info("Realign the merged alignment (%s)", i)
+                MafftProcess = Aligner.Mafft(PhylomergeProcess.OutputSequenceFile)
+                MafftProcess.AdjustdirectionOption = False
+                #MafftProcess.Maxiterate = 2 # too long
+                MafftProcess.AutoOption = True
+                MafftProcess.QuietOption = True
+                MafftProcess.OutputFile = "%s/StartMafftRealign.%s.fa" %(TmpDirName,i)
+                (out, err) = MafftProcess.launch()
+                check_error(err)
+                ali = MafftProcess.OutputFile
+
             sp2seq = Int1Sp2Seq
             NbSeq_current_iter = count_lines(sp2seq)
 
         logger.warning("%s merge process iterations", i)
+        if NbIncremental:
+            ### Realign the final merged alignment once
+            logger.info("Realign the final merged alignment (%s incremental iterations)", NbIncremental)
+            MafftProcess = Aligner.Mafft(ali)
+            MafftProcess.AdjustdirectionOption = False
+            MafftProcess.AutoOption = True
+            MafftProcess.QuietOption = True
+            MafftProcess.OutputFile = "%s/StartMafftRealign.final.fa" %TmpDirName
+            (out, err) = MafftProcess.launch()
+            check_error(err)
+            ali = MafftProcess.OutputFile
         LastAli = "%s.fa" %OutPrefixName
         FinalSp2Seq = "%s.sp2seq.txt" %OutPrefixName
         (out, err) = mv(ali, LastAli)
@@ -421,7 +488,8 @@ FinalFasttreeProcess.Gamma = True
 FinalFasttreeProcess.OutputTree = FinalTreeFilename
 
 if os.path.isfile(LastAli):
-    FinalFasttreeProcess.get_output()
+    (out, err) = FinalFasttreeProcess.get_output()
+    check_error(err)
 else:
     logger.error("%s is not a file. There was an issue with the previous step.", LastAli)
     end(1)
@@ -441,7 +509,8 @@ if args.resolve_polytomy:
     t.write(format=0, outfile=FinalTreeFilename)
 
 if not os.path.isfile(FinalTreeFilename):
-    FinalFasttreeProcess.get_output()
+    (out, err) = FinalFasttreeProcess.get_output()
+    check_error(err)
     logger.error("%s is not a file. There was an issue with the previous step.", FinalTreeFilename)
     end(1)
 
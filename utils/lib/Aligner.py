@@ -32,13 +32,15 @@
 
 
 import os
-import subprocess
 import logging
 
+import Runner
+
 
 class Exonerate(object):
     """Define an object to launch Exonerate"""
     def __init__(self, TargetFile, QueryFile):
+        self.logger = logging.getLogger("main.lib.exonerate")
         self.TargetFile = TargetFile
         self.QueryFile = QueryFile
         self.Model = ""
@@ -48,9 +50,10 @@ class Exonerate(object):
         self.Bestn = 0
         self.Identity = 0
         self.Exhaustive = False
+        self.Timeout = None
 
-    def get_output(self):
-        #Out = "Command line: []\nHostname:\n-- completed exonerate analysis"
+    def launch_async(self):
+        """Launch Exonerate in background and return the Runner.Future of its (out, err)"""
         command = ["exonerate", "-t", self.TargetFile,
                    "-q", self.QueryFile,
                    "--showalignment", self.ShowAlignment,
@@ -66,13 +69,13 @@ class Exonerate(object):
             command.extend(["--ryo", str(self.Ryo)])
         if self.Exhaustive:
             command.extend(["--exhaustive", "T"])
+        return Runner.get_runner().submit(command, ErrorOnStderr=False, Timeout=self.Timeout, Logger=self.logger)
 
-        try:
-            Out = subprocess.check_output(command,
-                                         stderr=open("/dev/null", "w"))
-        except:
-            os.system("echo Unexpected error when we launch Exonerate:\n")
-            print " ".join(command)
+    def get_output(self):
+        #Out = "Command line: []\nHostname:\n-- completed exonerate analysis"
+        (Out, err) = self.launch_async().result()
+        if err or not "Hostname" in Out:
+            return ""
 
         # Remove Exonerate default lines
         #(First, second (which contains Hostname) and last):
@@ -98,8 +101,11 @@ class Mafft(object):
         self.AutoOption = False
         self.Maxiterate = 0
         self.QuietOption = False
+        self.Timeout = None
 
-    def launch(self, output=""):
+    def launch_async(self, output=""):
+        """Launch Mafft in background and return the Runner.Future of its (out, err).
+        Mafft can write warnings on stderr, err is only set if it fails"""
         command = ["mafft"]
 
         if self.AdjustdirectionOption:
@@ -120,13 +126,7 @@ class Mafft(object):
             command.extend(["--out", self.OutputFile])
 
         command.append(self.InputFile)
-        self.logger.debug(" ".join(command))
+        return Runner.get_runner().submit(command, ErrorOnStderr=False, Timeout=self.Timeout, Logger=self.logger)
 
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        (out, err) = p.communicate()
-        if err:
-            self.logger.error(err)
-
-        return (out, err)
+    def launch(self, output=""):
+        return self.launch_async(output).result()
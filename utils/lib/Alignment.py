@@ -0,0 +1,153 @@
+# File: Alignment.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+
+import numpy
+
+import FastaIO
+
+GAP = ord("-")
+
+
+class AlignedSequence(object):
+    """Name of a sequence and its row in the alignment matrix"""
+    __slots__ = ("Name", "Row")
+
+    def __init__(self, Name, Row):
+        self.Name = Name
+        self.Row = Row
+
+
+class Alignment(object):
+    """A multiple sequence alignment stored as a uint8 matrix (one row by sequence)"""
+    def __init__(self, Names=(), Matrix=None):
+        self.Sequences = [AlignedSequence(Name, Row) for (Row, Name) in enumerate(Names)]
+        self._Rows = dict((s.Name, s) for s in self.Sequences)
+        if Matrix is None:
+            Matrix = numpy.zeros((len(self.Sequences), 0), dtype=numpy.uint8)
+        if Matrix.shape[0] != len(self.Sequences):
+            raise ValueError("The number of names and of rows are different")
+        self.Matrix = Matrix
+
+    @classmethod
+    def from_records(cls, Records):
+        """Build an alignment from (name, aligned sequence) pairs"""
+        Names = []
+        Sequences = []
+        for (Name, Sequence) in Records:
+            Names.append(Name)
+            Sequences.append(Sequence)
+        Lengths = set(len(s) for s in Sequences)
+        if len(Lengths) > 1:
+            raise ValueError("Aligned sequences have different lengths")
+        Width = Lengths.pop() if Lengths else 0
+        Matrix = numpy.frombuffer(b"".join(Sequences), dtype=numpy.uint8)
+        return cls(Names, Matrix.reshape((len(Names), Width)))
+
+    @classmethod
+    def from_fasta(cls, FastaFilename="", String=""):
+        """Read an aligned fasta file (or string), sequences are named by their identifier"""
+        if String:
+            Records = FastaIO.iter_fasta_string(String)
+        else:
+            Records = FastaIO.iter_fasta(FastaFilename)
+        return cls.from_records((FastaIO.fasta_id(Header), Sequence)
+                                for (Header, Sequence) in Records if Sequence)
+
+    def __len__(self):
+        return len(self.Sequences)
+
+    def __contains__(self, Name):
+        return Name in self._Rows
+
+    @property
+    def width(self):
+        return self.Matrix.shape[1]
+
+    def names(self):
+        return [s.Name for s in self.Sequences]
+
+    def row(self, Name):
+        """Return the row of Name as a view on the matrix"""
+        return self.Matrix[self._Rows[Name].Row]
+
+    def get(self, Name, default=""):
+        if Name in self._Rows:
+            return self.row(Name).tostring()
+        return default
+
+    def items(self, dealign=False):
+        """Yield (name, sequence) for each sequence, without gaps if dealign is True"""
+        for s in self.Sequences:
+            Sequence = self.Matrix[s.Row]
+            if dealign:
+                Sequence = Sequence[Sequence != GAP]
+            yield (s.Name, Sequence.tostring())
+
+    def subset(self, Names):
+        """Return a new alignment with the sequences of Names, in the alignment order"""
+        Names = set(Names)
+        Selected = [s for s in self.Sequences if s.Name in Names]
+        return Alignment([s.Name for s in Selected],
+                         self.Matrix[[s.Row for s in Selected]])
+
+    def gap_mask(self):
+        """Return a boolean matrix, True where there is a gap"""
+        return self.Matrix == GAP
+
+    def column_gap_fractions(self):
+        """Return the fraction of gaps of each column"""
+        if not len(self.Sequences):
+            return numpy.zeros(self.width)
+        return self.gap_mask().mean(axis=0)
+
+    def coverage_identity(self, Name, RefName):
+        """Return the percentage of positions of RefName aligned with Name
+        and the percentage of identity on these aligned positions"""
+        (ali_p, id_p) = (0, 0)
+        if Name not in self._Rows or RefName not in self._Rows:
+            return (ali_p, id_p)
+        Sequence = self.row(Name)
+        Ref = self.row(RefName)
+        RefPositions = Ref != GAP
+        Length = numpy.count_nonzero(RefPositions)
+        if Length:
+            Aligned = RefPositions & (Sequence != GAP)
+            AliNb = numpy.count_nonzero(Aligned)
+            ali_p = AliNb / float(Length) * 100
+            if AliNb > 0:
+                id_p = numpy.count_nonzero(Aligned & (Sequence == Ref)) / float(AliNb) * 100
+        return (ali_p, id_p)
+
+    def write_fasta(self, OutFastaFile, dealign=False, Width=60):
+        FastaIO.write_fasta(OutFastaFile, self.items(dealign=dealign), Width=Width)
@@ -0,0 +1,125 @@
+# File: BlastCache.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+
+import os
+import time
+import glob
+import hashlib
+import logging
+import sqlite3
+
+logger = logging.getLogger('main.lib.BlastCache')
+
+
+def database_fingerprint(Databases):
+    """Return a fingerprint of blast databases, from the name, size and modification time of their files"""
+    Fingerprint = hashlib.md5()
+    for Database in sorted(Databases):
+        Fingerprint.update(os.path.abspath(Database) + "\n")
+        for Filename in sorted(glob.glob(Database + ".*")):
+            Stat = os.stat(Filename)
+            Fingerprint.update("%s\t%s\t%s\n" %(os.path.basename(Filename), Stat.st_size, int(Stat.st_mtime)))
+    return Fingerprint.hexdigest()
+
+
+class BlastCache(object):
+    """Define an on-disk cache of the blast hits of each query sequence.
+
+    Entries are keyed by the content of the sequence and by a search
+    fingerprint (databases and blast parameters). They hold the tabular
+    hit lines without their query id. When the cache grows over MaxSize
+    bytes, the least recently used entries are evicted."""
+    def __init__(self, CacheDir, MaxSize=1 << 30):
+        if not os.path.isdir(CacheDir):
+            os.makedirs(CacheDir)
+        self.CacheDir = CacheDir
+        self.MaxSize = MaxSize
+        self.Hits = 0
+        self.Misses = 0
+        self.Evicted = 0
+        # Several jobs can share a cache, each waits for the others' writes
+        self.Connection = sqlite3.connect(os.path.join(CacheDir, "blast_hits.sqlite"), timeout=600)
+        self.Connection.text_factory = str
+        self.Connection.execute("CREATE TABLE IF NOT EXISTS hits"
+                                " (key TEXT PRIMARY KEY, rows BLOB, size INTEGER, used REAL)")
+        self.Connection.execute("CREATE INDEX IF NOT EXISTS hits_used ON hits (used)")
+        self.Connection.commit()
+
+    def key(self, Sequence, Fingerprint):
+        return hashlib.sha1(Fingerprint + "\n" + Sequence.upper()).hexdigest()
+
+    def get_many(self, Keys):
+        """Return {key: rows} for the cached keys and mark them as used"""
+        Found = {}
+        Keys = list(set(Keys))
+        for i in range(0, len(Keys), 500):
+            Batch = Keys[i:i + 500]
+            Cursor = self.Connection.execute("SELECT key, rows FROM hits WHERE key IN (%s)" %",".join("?" * len(Batch)), Batch)
+            Found.update((Key, str(Rows)) for (Key, Rows) in Cursor)
+        Now = time.time()
+        self.Connection.executemany("UPDATE hits SET used = ? WHERE key = ?", [(Now, Key) for Key in Found])
+        self.Connection.commit()
+        return Found
+
+    def put_many(self, Entries):
+        """Store {key: rows} and evict the least recently used entries if needed"""
+        Now = time.time()
+        self.Connection.executemany("INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?)",
+                                    [(Key, sqlite3.Binary(Rows), len(Rows) + len(Key), Now) for (Key, Rows) in Entries.items()])
+        self.Connection.commit()
+        self.evict()
+
+    def size(self):
+        return self.Connection.execute("SELECT COALESCE(SUM(size), 0) FROM hits").fetchone()[0]
+
+    def evict(self):
+        Excess = self.size() - self.MaxSize
+        if Excess <= 0:
+            return
+        Keys = []
+        for (Key, Size) in self.Connection.execute("SELECT key, size FROM hits ORDER BY used"):
+            Keys.append((Key,))
+            Excess -= Size
+            if Excess <= 0:
+                break
+        self.Connection.executemany("DELETE FROM hits WHERE key = ?", Keys)
+        self.Connection.commit()
+        self.Evicted += len(Keys)
+
+    def log_stats(self):
+        logger.info("Blast cache %s: %s hits, %s misses, %s evicted, %.1f MB",
+                    self.CacheDir, self.Hits, self.Misses, self.Evicted, self.size() / 1e6)
+
+    def close(self):
+        self.Connection.close()
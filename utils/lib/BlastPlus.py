@@ -32,9 +32,19 @@
 
 
 import os
+import time
+import glob
+import fcntl
+import shutil
+import hashlib
 import logging
+import tempfile
 import subprocess
 
+import FastaIO
+import Runner
+import BlastCache
+
 
 class Makeblastdb(object):
     """Define an object to create a local database"""
@@ -46,22 +56,19 @@ class Makeblastdb(object):
         self.LogFile = ""
         self.Dbtype = "nucl"
         self.IndexedDatabase = True
+        self.Timeout = None
 
-    def launch(self):
+    def launch_async(self):
+        """Launch makeblastdb in background and return the Runner.Future of its (out, err)"""
         command = ["makeblastdb", "-in", self.InputFile,
                    "-out", os.path.abspath(self.OutputFiles),
                    "-dbtype", self.Dbtype]
         if self.IndexedDatabase:
             command.append("-parse_seqids")
+        return Runner.get_runner().submit(command, Timeout=self.Timeout, Logger=self.logger)
 
-        self.logger.debug(" ".join(command))
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        (out, err) = p.communicate()
-        if err:
-            self.logger.error(err)
-        return (out, err)
+    def launch(self):
+        return self.launch_async().result()
 
 class Blast(object):
     """Define a object to lauch a blast on a local database"""
@@ -84,39 +91,293 @@ class Blast(object):
         self.perc_identity = 0
         self.Task = ""
         self.Strand = ""
+        # An optional file of the target ids to search, the database must be built with -parse_seqids
+        self.SeqIdList = ""
+        # Number of query chunks blasted concurrently, sharing the self.Threads budget
+        self.Shards = 1
+        # An optional BlastCache.BlastCache of the hits of each query sequence
+        self.Cache = None
+        # Time limit of each blast command, in seconds
+        self.Timeout = None
+
+    def _command(self, QueryFile, OutputFile, Threads):
+        command = [self.Program, "-db", self.Database,
+                  "-query", QueryFile,
+                  "-evalue", str(self.Evalue),
+                  "-outfmt", str(self.OutFormat),
+                  "-max_target_seqs", str(self.max_target_seqs),
+                  "-num_threads", str(Threads)]
+
+        # Without output file, blast writes on its stdout
+        if OutputFile:
+            command.extend(["-out", OutputFile])
+
+        if self.perc_identity:
+            command.extend(
+            ["-perc_identity", str(self.perc_identity)]
+            )
+        if self.max_hsps_per_subject:
+            command.extend(
+            ["-max_hsps", str(self.max_hsps_per_subject)]
+            )
+        if self.Task:
+            command.extend(["-task", self.Task])
+
+        if self.Strand in ["both", "plus", "minus"]:
+            command.extend(["-strand", self.Strand])
+
+        if self.SeqIdList:
+            command.extend(["-seqidlist", self.SeqIdList])
+        return command
+
+    def _split_query(self, QueryFile, TmpDirName):
+        """Split the query in at most self.Shards files of consecutive records with balanced residue counts"""
+        Lengths = [len(Sequence) for (_, Sequence) in FastaIO.iter_fasta(QueryFile)]
+        NbShards = min(self.Shards, max(1, self.Threads), len(Lengths))
+        Total = sum(Lengths)
+        ShardFiles = []
+        Writer = None
+        Residues = 0
+        for (Header, Sequence) in FastaIO.iter_fasta(QueryFile):
+            if Writer is None or (len(ShardFiles) < NbShards and Residues * NbShards >= Total * len(ShardFiles)):
+                if Writer is not None:
+                    Writer.close()
+                ShardFiles.append("%s/query.%s.fa" %(TmpDirName, len(ShardFiles)))
+                Writer = FastaIO.FastaWriter(ShardFiles[-1], Width=0)
+            Writer.write(Header, Sequence)
+            Residues += len(Sequence)
+        if Writer is not None:
+            Writer.close()
+        return ShardFiles
+
+    def _launch_sharded(self, QueryFile, OutputFile):
+        TmpDirName = tempfile.mkdtemp(prefix="blast_shards_", dir=os.path.dirname(os.path.abspath(OutputFile)))
+        try:
+            ShardFiles = self._split_query(QueryFile, TmpDirName)
+            # The thread budget is shared by the shards
+            Threads = max(1, self.Threads // max(1, len(ShardFiles)))
+            Futures = [Runner.get_runner().submit(self._command(ShardFile, ShardFile + ".out", Threads),
+                                                  Threads=Threads, Timeout=self.Timeout, Logger=self.logger)
+                       for ShardFile in ShardFiles]
+            Results = Runner.wait_all(Futures)
+            Outs = [out for (out, _) in Results]
+            err = "".join(err for (_, err) in Results)
+            if not err:
+                # Outputs are merged in the order of the query
+                with open(OutputFile, "wb") as Output:
+                    for ShardFile in ShardFiles:
+                        with open(ShardFile + ".out", "rb") as ShardOutput:
+                            shutil.copyfileobj(ShardOutput, Output)
+            return ("".join(Outs), err)
+        finally:
+            shutil.rmtree(TmpDirName, ignore_errors=True)
+
+    def _run(self, QueryFile, OutputFile):
+        if self.Shards > 1:
+            return self._launch_sharded(QueryFile, OutputFile)
+
+        command = self._command(QueryFile, OutputFile, self.Threads)
+        return Runner.get_runner().run(command, Threads=self.Threads, Timeout=self.Timeout, Logger=self.logger)
+
+    def fingerprint(self):
+        """Return a fingerprint of the databases and of the parameters changing the hits"""
+        Fields = [BlastCache.database_fingerprint(self.Database.split(" ")),
+                  self.Program, self.Task, str(self.Evalue), str(self.max_target_seqs),
+                  str(self.max_hsps_per_subject), str(self.perc_identity), self.Strand,
+                  str(self.OutFormat)]
+        if self.SeqIdList:
+            with open(self.SeqIdList, "rb") as SeqIdList:
+                Fields.append(hashlib.md5(SeqIdList.read()).hexdigest())
+        return "\t".join(Fields)
+
+    def _cacheable(self):
+        """Return True if the hits can be cached: a tabular format whose only query id field is the first one"""
+        Format = str(self.OutFormat).split()
+        return Format[0] == "6" and not any(Field in QueryIdFields for Field in Format[2:])
+
+    def _launch_cached(self, OutputFile):
+        """Only blast the query sequences without cached hits, then write the hits of all queries in order"""
+        Fingerprint = self.fingerprint()
+        Queries = [(FastaIO.fasta_id(Header), self.Cache.key(Sequence, Fingerprint))
+                   for (Header, Sequence) in FastaIO.iter_fasta(self.QueryFile)]
+        Cached = self.Cache.get_many([Key for (_, Key) in Queries])
+
+        TmpDirName = tempfile.mkdtemp(prefix="blast_cache_", dir=os.path.dirname(os.path.abspath(OutputFile)))
+        New = {}
+        try:
+            MissingQueryFile = "%s/query.fa" %TmpDirName
+            MissingOutputFile = "%s/query.out" %TmpDirName
+            # Identical sequences are blasted once. They are named by their
+            # position, blast may not report a header as its fasta_id (e.g. ref|NM_001|)
+            MissingKeys = []
+            with FastaIO.FastaWriter(MissingQueryFile, Width=0) as Writer:
+                for (i, (Header, Sequence)) in enumerate(FastaIO.iter_fasta(self.QueryFile)):
+                    Key = Queries[i][1]
+                    if not Key in Cached and not Key in New:
+                        New[Key] = []
+                        Writer.write(b"Query%d" %len(MissingKeys), Sequence)
+                        MissingKeys.append(Key)
+
+            (out, err) = ("", "")
+            if New:
+                (out, err) = self._run(MissingQueryFile, MissingOutputFile)
+                if err:
+                    return (out, err)
+                with open(MissingOutputFile, "rb") as MissingOutput:
+                    for Line in MissingOutput:
+                        (Name, Row) = Line.split("\t", 1)
+                        New[MissingKeys[int(Name[len("Query"):])]].append(Row)
+                New = dict((Key, "".join(Rows)) for (Key, Rows) in New.items())
+                self.Cache.put_many(New)
+
+            NbHits = sum(1 for (_, Key) in Queries if Key in Cached)
+            self.Cache.Hits += NbHits
+            self.Cache.Misses += len(Queries) - NbHits
+            with open(OutputFile, "wb") as Output:
+                for (Name, Key) in Queries:
+                    Rows = Cached.get(Key)
+                    if Rows is None:
+                        Rows = New[Key]
+                    for Row in Rows.splitlines(True):
+                        Output.write(Name + "\t" + Row)
+            return (out, err)
+        finally:
+            shutil.rmtree(TmpDirName, ignore_errors=True)
+
+    def _iter_blocks(self, Lines, Converters):
+        """Yield (query id, hits) for each block of consecutive tabular lines of a query"""
+        Query = None
+        Rows = []
+        for Line in Lines:
+            Fields = Line.rstrip("\n").split("\t")
+            if Fields[0] != Query:
+                if Rows:
+                    yield (Query, Rows)
+                Query = Fields[0]
+                Rows = []
+            Rows.append(tuple(Convert(Field) for (Convert, Field) in zip(Converters, Fields)))
+        if Rows:
+            yield (Query, Rows)
+
+    def iter_hits(self, Fields=None):
+        """Launch the blast and yield (query id, hits) for each query as soon as all its hits are parsed.
+
+        The output format is tabular_outfmt(Fields) (default: TabularFields), each hit is a tuple of
+        its typed fields. Blast writes the hits of each query consecutively,
+        so only the hits of one query are kept in memory. The first shard is
+        read from the stdout of blast while the others are written in files.
+        Errors are logged and kept in self.Err."""
+        Fields = Fields or TabularFields
+        self.OutFormat = tabular_outfmt(Fields)
+        self.Err = ""
+        Converters = [{"int32": int, "int64": int, "float64": float}.get(TabularDtypes.get(Field), str) for Field in Fields]
+        if not self.Program in ["blastn", "blastx", "tblastn", "tblastx"]:
+            (_, self.Err) = self.launch("")
+            return
+        TmpDirName = tempfile.mkdtemp(prefix="blast_stream_", dir=os.path.dirname(os.path.abspath(self.QueryFile)))
+        Processes = []
+        try:
+            if self.Cache is not None:
+                OutputFile = "%s/query.out" %TmpDirName
+                (_, self.Err) = self.launch(OutputFile)
+                if not self.Err:
+                    with open(OutputFile, "rb") as Output:
+                        for Block in self._iter_blocks(Output, Converters):
+                            yield Block
+                return
+
+            if self.Shards > 1:
+                ShardFiles = self._split_query(self.QueryFile, TmpDirName)
+            else:
+                ShardFiles = [self.QueryFile]
+            Threads = max(1, self.Threads // max(1, len(ShardFiles)))
+            for (i, ShardFile) in enumerate(ShardFiles):
+                OutputFile = "%s/query.%s.out" %(TmpDirName, i) if i else ""
+                command = self._command(ShardFile, OutputFile, Threads)
+                self.logger.debug(" ".join(command))
+                # stderr goes to a file, a full pipe would block blast
+                ErrFile = tempfile.TemporaryFile(dir=TmpDirName)
+                Processes.append((Runner.Popen(command,
+                                               stdout=subprocess.PIPE,
+                                               stderr=ErrFile), ErrFile, OutputFile, command))
+            Errs = []
+            for (p, ErrFile, OutputFile, command) in Processes:
+                if not OutputFile:
+                    for Block in self._iter_blocks(iter(p.stdout.readline, ""), Converters):
+                        yield Block
+                p.communicate()
+                Runner.record(command, p, Threads)
+                ErrFile.seek(0)
+                err = ErrFile.read()
+                ErrFile.close()
+                if err:
+                    Errs.append(err)
+                elif OutputFile and not Errs:
+                    with open(OutputFile, "rb") as Output:
+                        for Block in self._iter_blocks(Output, Converters):
+                            yield Block
+            self.Err = "".join(Errs)
+            if self.Err:
+                self.logger.error(self.Err)
+        finally:
+            for (p, _, _, _) in Processes:
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+            shutil.rmtree(TmpDirName, ignore_errors=True)
+
+    def iter_tiered_hits(self, Tasks, Resolved=None, Fields=None):
+        """Blast the queries with each task of Tasks in turn (e.g. megablast then
+        dc-megablast) and yield (query id, hits) like iter_hits.
+
+        The queries whose hits are resolved, Resolved(query id, hits) is True,
+        are yielded and not blasted by the next tasks, only the queries
+        without hit or with unresolved hits are. All the hits of the last
+        task are yielded. The time of each tier is logged."""
+        Resolved = Resolved or (lambda Query, Rows: True)
+        (QueryFile, Task) = (self.QueryFile, self.Task)
+        TmpDirName = tempfile.mkdtemp(prefix="blast_tiers_", dir=os.path.dirname(os.path.abspath(QueryFile)))
+        try:
+            for (Tier, TierTask) in enumerate(Tasks):
+                start_tier_time = time.time()
+                self.Task = TierTask
+                Last = Tier == len(Tasks) - 1
+                Done = set()
+                for (Query, Rows) in self.iter_hits(Fields):
+                    if Last or Resolved(Query, Rows):
+                        Done.add(Query)
+                        yield (Query, Rows)
+                if self.Err:
+                    return
+                if Last:
+                    self.logger.info("Tier %s (%s): %s queries with hits in %.1f seconds",
+                                     Tier + 1, TierTask, len(Done), time.time() - start_tier_time)
+                    return
+                NextQueryFile = "%s/query.%s.fa" %(TmpDirName, Tier + 1)
+                Left = 0
+                with FastaIO.FastaWriter(NextQueryFile, Width=0) as Writer:
+                    for (Header, Sequence) in FastaIO.iter_fasta(self.QueryFile):
+                        if not FastaIO.fasta_id(Header) in Done:
+                            Writer.write(Header, Sequence)
+                            Left += 1
+                self.logger.info("Tier %s (%s): %s queries resolved, %s left, in %.1f seconds",
+                                 Tier + 1, TierTask, len(Done), Left, time.time() - start_tier_time)
+                if not Left:
+                    return
+                self.QueryFile = NextQueryFile
+        finally:
+            (self.QueryFile, self.Task) = (QueryFile, Task)
+            shutil.rmtree(TmpDirName, ignore_errors=True)
+
+    def launch_async(self, OutputFile):
+        """Launch the blast in background and return the Runner.Future of its (out, err)"""
+        return Runner.get_runner().call(self.launch, OutputFile)
 
     def launch(self, OutputFile):
         if self.Program in ["blastn", "blastx", "tblastn", "tblastx"]:
-            command = [self.Program, "-db", self.Database,
-                      "-query", self.QueryFile,
-                      "-evalue", str(self.Evalue),
-                      "-outfmt", str(self.OutFormat),
-                      "-out", OutputFile,
-                      "-max_target_seqs", str(self.max_target_seqs),
-                      "-num_threads", str(self.Threads)]
-
-            if self.perc_identity:
-                command.extend(
-                ["-perc_identity", str(self.perc_identity)]
-                )
-            if self.max_hsps_per_subject:
-                command.extend(
-                ["-max_hsps", str(self.max_hsps_per_subject)]
-                )
-            if self.Task:
-                command.extend(["-task", self.Task])
-
-            if self.Strand in ["both", "plus", "minus"]:
-                command.extend(["-strand", self.Strand])
-
-            self.logger.debug(" ".join(command))
-            p = subprocess.Popen(command,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            (out, err) = p.communicate()
-            if err:
-                self.logger.error(err)
-            return (out, err)
+            if self.Cache is not None and self._cacheable():
+                return self._launch_cached(OutputFile)
+            return self._run(self.QueryFile, OutputFile)
 
         else:
             self.logger.error(
@@ -133,22 +394,20 @@ class Blastdbcmd(object):
         self.Database = Database
         self.OutputFile = OutputFile
         self.Dbtype = "nucl"
+        self.Timeout = None
 
-    def launch(self):
+    def launch_async(self):
+        """Launch blastdbcmd in background and return the Runner.Future of its (out, err)"""
         command = ["blastdbcmd", "-db", self.Database,
                    "-entry_batch", self.InputFile,
                    "-dbtype", self.Dbtype]
 
         if self.OutputFile:
             command.extend(["-out", self.OutputFile])
-        self.logger.debug(" ".join(command))
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        (out, err) = p.communicate()
-        if err:
-            self.logger.error(err)
-        return (out, err)
+        return Runner.get_runner().submit(command, Timeout=self.Timeout, Logger=self.logger)
+
+    def launch(self):
+        return self.launch_async().result()
 
     def is_database(self):
         Out = False
@@ -165,3 +424,199 @@ class Blastdbcmd(object):
             Out = True
         return Out
 
+
+# Extension of the file listing the files of a database and their sizes
+ManifestExtension = ".manifest"
+
+def database_files(Database):
+    """Return the sorted files of a blast database, without its manifest"""
+    return sorted(Filename for Filename in glob.glob(Database + ".*")
+                  if not Filename.endswith(ManifestExtension))
+
+def write_manifest(Database, Source=""):
+    """Write the manifest of a blast database: its source and the size of each of its files"""
+    Lines = ["#source\t%s" %Source]
+    Lines.extend("%s\t%s" %(os.path.basename(Filename), os.path.getsize(Filename)) for Filename in database_files(Database))
+    with open(Database + ManifestExtension, "w") as Manifest:
+        Manifest.write("\n".join(Lines) + "\n")
+
+def is_database(Database, Dbtype="nucl"):
+    """Return True if the files of a blast database exist, without launching blastdbcmd.
+
+    A database with a manifest is valid if its files have the sizes of the
+    manifest. Otherwise, its alias file or its index, header and sequence
+    files (of a single volume or of the first one) have to exist."""
+    if os.path.isfile(Database + ManifestExtension):
+        with open(Database + ManifestExtension) as Manifest:
+            Sizes = [Line.rstrip("\n").split("\t") for Line in Manifest if not Line.startswith("#")]
+        DatabaseDir = os.path.dirname(Database)
+        for (Filename, Size) in Sizes:
+            Filename = os.path.join(DatabaseDir, Filename)
+            if not os.path.isfile(Filename) or os.path.getsize(Filename) != int(Size):
+                return False
+        return bool(Sizes)
+    Letter = "n" if Dbtype == "nucl" else "p"
+    if os.path.isfile("%s.%sal" %(Database, Letter)):
+        return True
+    for Volume in [Database, Database + ".00"]:
+        if all(os.path.isfile("%s.%s%s" %(Volume, Letter, Extension)) for Extension in ["in", "hr", "sq"]):
+            return True
+    return False
+
+def fasta_fingerprint(FastaFile):
+    """Return the sha1 of the content of a fasta file"""
+    Fingerprint = hashlib.sha1()
+    with open(FastaFile, "rb") as Fasta:
+        for Chunk in iter(lambda: Fasta.read(1 << 20), b""):
+            Fingerprint.update(Chunk)
+    return Fingerprint.hexdigest()
+
+
+class DatabaseRegistry(object):
+    """Define a directory of blast databases built from fasta files, shared between jobs.
+
+    Each database is stored in a subdirectory named after the content of its
+    fasta file, so a fasta file is formatted only once whatever its name. A
+    database is built under a lock and published by renaming its directory
+    once its manifest is written."""
+    def __init__(self, RegistryDir):
+        self.logger = logging.getLogger('main.lib.BlastPlus.DatabaseRegistry')
+        if not os.path.isdir(RegistryDir):
+            os.makedirs(RegistryDir)
+        self.RegistryDir = RegistryDir
+        self.Dbtype = "nucl"
+        self.IndexedDatabase = True
+
+    def fingerprint(self, FastaFile, Source=None):
+        """Return the fingerprint of a fasta file, memoized per path, size and mtime of its source.
+
+        Source is the file the fasta file was made from (a compressed fasta
+        file for example), FastaFile itself by default. The content is hashed
+        only when the memo of the source is missing or out of date."""
+        Source = os.path.abspath(Source or FastaFile)
+        Stat = os.stat(Source)
+        Signature = "%s\t%d\t%r" %(Source, Stat.st_size, Stat.st_mtime)
+        MemoDir = os.path.join(self.RegistryDir, "fingerprints")
+        MemoFile = os.path.join(MemoDir, hashlib.sha1(Source).hexdigest())
+        if os.path.isfile(MemoFile):
+            with open(MemoFile, "r") as Memo:
+                (MemoSignature, _, Fingerprint) = Memo.read().strip().rpartition("\t")
+            if MemoSignature == Signature and Fingerprint:
+                return Fingerprint
+        Fingerprint = fasta_fingerprint(FastaFile)
+        if not os.path.isdir(MemoDir):
+            try:
+                os.makedirs(MemoDir)
+            except OSError:
+                # Created by another job in the meantime
+                pass
+        (TmpMemo, TmpMemoName) = tempfile.mkstemp(dir=MemoDir)
+        with os.fdopen(TmpMemo, "w") as Memo:
+            Memo.write("%s\t%s\n" %(Signature, Fingerprint))
+        os.rename(TmpMemoName, MemoFile)
+        return Fingerprint
+
+    def key(self, FastaFile, Source=None):
+        return "%s.%s%s" %(self.fingerprint(FastaFile, Source), self.Dbtype, ".seqids" if self.IndexedDatabase else "")
+
+    def database(self, FastaFile, Source=None):
+        """Return the prefix of the database of a fasta file, build it if it is not in the registry yet.
+        Source is the file the fasta file was made from, used to memoize its fingerprint.
+        Return an empty string if the database building failed"""
+        Key = self.key(FastaFile, Source)
+        Database = os.path.join(self.RegistryDir, Key, "db")
+        if is_database(Database, self.Dbtype):
+            self.logger.info("Database of %s found in the registry: %s", FastaFile, Database)
+            return Database
+        with open(os.path.join(self.RegistryDir, Key + ".lock"), "w") as Lock:
+            fcntl.flock(Lock, fcntl.LOCK_EX)
+            # Another job may have built it while we were waiting for the lock
+            if is_database(Database, self.Dbtype):
+                self.logger.info("Database of %s built by another job: %s", FastaFile, Database)
+                return Database
+            TmpDatabaseDir = tempfile.mkdtemp(prefix=Key + ".", dir=self.RegistryDir)
+            self.logger.info("Build the database of %s in the registry: %s", FastaFile, Database)
+            MakeblastdbProcess = Makeblastdb(FastaFile, os.path.join(TmpDatabaseDir, "db"))
+            MakeblastdbProcess.Dbtype = self.Dbtype
+            MakeblastdbProcess.IndexedDatabase = self.IndexedDatabase
+            (_, err) = MakeblastdbProcess.launch()
+            if err:
+                shutil.rmtree(TmpDatabaseDir)
+                return ""
+            write_manifest(os.path.join(TmpDatabaseDir, "db"), Source=os.path.abspath(FastaFile))
+            if os.path.isdir(os.path.dirname(Database)):
+                # An invalid database is replaced
+                shutil.rmtree(os.path.dirname(Database))
+            os.rename(TmpDatabaseDir, os.path.dirname(Database))
+        return Database
+
+
+# Fields depending on the query name, the cached hits are written with the name of their query
+QueryIdFields = ["qseqid", "qgi", "qacc", "qaccver"]
+
+# Fields of the default tabular output (-outfmt 6) and their types
+TabularFields = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen",
+                 "qstart", "qend", "sstart", "send", "evalue", "bitscore"]
+TabularDtypes = {"qseqid": "category", "sseqid": "category",
+                 "pident": "float64", "evalue": "float64", "bitscore": "float64",
+                 "length": "int32", "mismatch": "int32", "gapopen": "int32",
+                 "qstart": "int64", "qend": "int64", "sstart": "int64", "send": "int64"}
+
+
+def family_resolver(Target2Family, MinIdentity=0):
+    """Return a Resolved function for Blast.iter_tiered_hits: the hits (TabularFields) of a query
+    are resolved if its best hits are all in one family, with at least MinIdentity % of identity"""
+    Subject = TabularFields.index("sseqid")
+    Identity = TabularFields.index("pident")
+    Score = TabularFields.index("bitscore")
+    def resolved(Query, Rows):
+        BestScore = max(Row[Score] for Row in Rows)
+        BestHits = [Row for Row in Rows if Row[Score] == BestScore]
+        return len(set(Target2Family.get(Row[Subject]) for Row in BestHits)) == 1 and \
+               max(Row[Identity] for Row in BestHits) >= MinIdentity
+    return resolved
+
+
+def tabular_outfmt(Fields=TabularFields, OutFormat=6):
+    """Return the -outfmt value of a tabular output with an explicit list of fields"""
+    return "%s %s" %(OutFormat, " ".join(Fields))
+
+
+def _tabular_dtypes(Fields, Names, Categories):
+    Dtypes = {}
+    for (Field, Name) in zip(Fields, Names or Fields):
+        Dtype = TabularDtypes.get(Field, "object")
+        if Dtype == "category" and not Categories:
+            Dtype = "object"
+        Dtypes[Name] = Dtype
+    return Dtypes
+
+
+def _read_tabular(OutputFile, Fields, Names, Categories, **kwargs):
+    import pandas
+    Dtypes = _tabular_dtypes(Fields, Names, Categories)
+    Columns = list(Names or Fields)
+    if not os.path.getsize(OutputFile):
+        return pandas.DataFrame(dict((Column, pandas.Series([], dtype=Dtypes[Column])) for Column in Columns),
+                                columns=Columns)
+    return pandas.read_csv(OutputFile, sep="\t", header=None, engine="c", names=Columns,
+                           dtype=Dtypes, na_filter=False, **kwargs)
+
+
+def read_tabular(OutputFile, Fields=TabularFields, Names=None, Categories=True):
+    """Read a tabular blast output written with tabular_outfmt(Fields).
+
+    Columns are typed on reading (sequence ids as categories unless
+    Categories is False) and renamed to Names if given."""
+    return _read_tabular(OutputFile, Fields, Names, Categories)
+
+
+def iter_tabular(OutputFile, ChunkSize=1000000, Fields=TabularFields, Names=None, Categories=False):
+    """Yield a tabular blast output by tables of at most ChunkSize lines.
+
+    The ids of different chunks do not share categories, so they are read
+    as strings by default."""
+    if not os.path.getsize(OutputFile):
+        return
+    for Chunk in _read_tabular(OutputFile, Fields, Names, Categories, chunksize=ChunkSize):
+        yield Chunk
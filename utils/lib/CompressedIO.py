@@ -0,0 +1,236 @@
+# File: CompressedIO.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+
+import io
+import os
+import glob
+import gzip
+import logging
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('main.lib.CompressedIO')
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+Extensions = {"gzip": ".gz", "bgzip": ".gz", "zstd": ".zst"}
+
+# Inputs bigger than this are decompressed by an external multi-threaded
+# program (bgzip, pigz or zstd) when more than one thread is available
+ThreadedSize = 1 << 26
+BufferSize = 1 << 20
+
+
+def detect_compression(Filename):
+    """Return "gzip", "bgzip", "zstd" or "" according to the magic number of Filename"""
+    with open(Filename, "rb") as Handle:
+        Head = Handle.read(18)
+    if Head[:4] == ZSTD_MAGIC:
+        return "zstd"
+    if Head[:2] == GZIP_MAGIC:
+        # bgzip writes a "BC" extra subfield in each gzip member header
+        if len(Head) >= 14 and ord(Head[3:4]) & 4 and Head[12:14] == b"BC":
+            return "bgzip"
+        return "gzip"
+    return ""
+
+
+def compression_of_name(Filename):
+    """Return the compression implied by the extension of Filename"""
+    if Filename.endswith(".gz"):
+        return "gzip"
+    if Filename.endswith(".zst"):
+        return "zstd"
+    return ""
+
+
+def compressed_name(Filename, Compression):
+    """Add the extension of Compression to Filename if it is missing"""
+    Extension = Extensions.get(Compression, "")
+    if Extension and not Filename.endswith(Extension):
+        return Filename + Extension
+    return Filename
+
+
+def strip_compression_extension(Filename):
+    for Extension in set(Extensions.values()):
+        if Filename.endswith(Extension):
+            return Filename[:-len(Extension)]
+    return Filename
+
+
+def glob_files(Pattern):
+    """Return the files matching Pattern, with or without a compression extension"""
+    Files = glob.glob(Pattern)
+    for Extension in sorted(set(Extensions.values())):
+        Files.extend(glob.glob(Pattern + Extension))
+    return Files
+
+
+def pop_compress_option(Argv):
+    """Remove a --compress=gzip|zstd option from an argument list and return its value"""
+    Compression = ""
+    for Arg in list(Argv):
+        if Arg.startswith("--compress="):
+            Compression = Arg.split("=", 1)[1]
+            Argv.remove(Arg)
+    if Compression and Compression not in Extensions:
+        raise ValueError("Unknown compression: %s" %Compression)
+    return Compression
+
+
+class _ProcessFile(object):
+    """File-like object on the stdin or stdout of a (de)compression program"""
+    def __init__(self, Command, Filename, mode):
+        logger.debug(" ".join(Command))
+        self.Command = Command
+        if "r" in mode:
+            self._Target = open(Filename, "rb")
+            self.Process = subprocess.Popen(Command, stdin=self._Target,
+                                            stdout=subprocess.PIPE, bufsize=BufferSize)
+            self._Pipe = self.Process.stdout
+        else:
+            self._Target = open(Filename, mode.replace("t", "").replace("b", "") + "b")
+            self.Process = subprocess.Popen(Command, stdin=subprocess.PIPE,
+                                            stdout=self._Target, bufsize=BufferSize)
+            self._Pipe = self.Process.stdin
+
+    def __getattr__(self, Name):
+        return getattr(self._Pipe, Name)
+
+    def __iter__(self):
+        return iter(self._Pipe)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._Pipe.close()
+        ReturnCode = self.Process.wait()
+        self._Target.close()
+        if ReturnCode:
+            raise IOError("%s exited with code %s" %(self.Command[0], ReturnCode))
+
+
+def _decompression_command(Compression, Threads):
+    if Compression == "zstd" and find_executable("zstd"):
+        return ["zstd", "-d", "-c", "-q", "-T%s" %Threads]
+    if Compression == "bgzip" and find_executable("bgzip"):
+        return ["bgzip", "-d", "-c", "-@", str(Threads)]
+    if Compression in ["gzip", "bgzip"] and find_executable("pigz"):
+        return ["pigz", "-d", "-c", "-p", str(Threads)]
+    return []
+
+
+def _compression_command(Compression, Threads):
+    if Compression == "zstd" and find_executable("zstd"):
+        return ["zstd", "-c", "-q", "-T%s" %Threads]
+    if Compression in ["gzip", "bgzip"] and find_executable("pigz"):
+        return ["pigz", "-c", "-p", str(Threads)]
+    return []
+
+
+def open_file(Filename, mode="rb", Threads=1, Compression=None):
+    """Open a plain, gzip, bgzip or zstd file.
+
+    When reading, the compression is detected from the content of the file.
+    When writing, it is given by Compression or else by the extension of
+    Filename. Large files use a multi-threaded external program if one is
+    available and Threads > 1."""
+    Reading = "r" in mode
+    if Compression is None:
+        if Reading:
+            Compression = detect_compression(Filename)
+        else:
+            Compression = compression_of_name(Filename)
+    Binary = "b" in mode
+
+    if not Compression:
+        return io.open(Filename, mode.replace("t", ""), buffering=BufferSize) if Binary else open(Filename, mode)
+
+    if Threads > 1 and (not Reading or os.path.getsize(Filename) > ThreadedSize):
+        if Reading:
+            Command = _decompression_command(Compression, Threads)
+        else:
+            Command = _compression_command(Compression, Threads)
+        if Command:
+            return _ProcessFile(Command, Filename, mode)
+
+    if Compression == "zstd":
+        if zstandard is not None:
+            if Reading:
+                Stream = zstandard.ZstdDecompressor().stream_reader(open(Filename, "rb"))
+                return io.BufferedReader(Stream, buffer_size=BufferSize)
+            Stream = zstandard.ZstdCompressor(threads=Threads if Threads > 1 else 0).stream_writer(open(Filename, mode.replace("t", "").replace("b", "") + "b"))
+            return io.BufferedWriter(Stream, buffer_size=BufferSize)
+        if Reading:
+            Command = _decompression_command(Compression, Threads)
+        else:
+            Command = _compression_command(Compression, Threads)
+        if not Command:
+            raise IOError("%s is zstd compressed but neither the zstandard module nor the zstd program is available" %Filename)
+        return _ProcessFile(Command, Filename, mode)
+
+    GzipFile = gzip.GzipFile(Filename, mode.replace("t", "").replace("b", "") + "b")
+    if Reading:
+        return io.BufferedReader(GzipFile, buffer_size=BufferSize)
+    return io.BufferedWriter(GzipFile, buffer_size=BufferSize)
+
+
+def decompress_to_plain(Filename, TmpDirName, Threads=1):
+    """Return Filename if it is not compressed, else the name of a plain copy
+    written in TmpDirName (for programs like blastn which need plain files)"""
+    if not detect_compression(Filename):
+        return Filename
+    (Fd, PlainFilename) = tempfile.mkstemp(dir=TmpDirName,
+                                           prefix=strip_compression_extension(os.path.basename(Filename)) + ".")
+    logger.info("Decompress %s in %s", Filename, PlainFilename)
+    with open_file(Filename, "rb", Threads=Threads) as In:
+        with io.open(Fd, "wb") as Out:
+            while True:
+                Block = In.read(BufferSize)
+                if not Block:
+                    break
+                Out.write(Block)
+    return PlainFilename
@@ -0,0 +1,329 @@
+# File: DispatchService.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Serve SeqDispatcher and CheckFamily jobs from a long-lived local process.
+
+A server (DispatchServer.py) listens on a Unix socket and runs each job in
+a forked child, like a normal run. The reference data (target names,
+target to family table, minimizer index) preloaded by the server before
+it accepts jobs are in the caches below, already warm in the children.
+The other jobs load their reference data themselves in their child.
+
+Protocol: a client sends one JSON line
+    {"script": "SeqDispatcher.py", "argv": [...], "cwd": "...", "env": {...}}
+and receives one JSON line
+    {"returncode": 0, "stdout": "...", "stderr": "..."}
+"""
+
+import os
+import sys
+import json
+import errno
+import socket
+import runpy
+import signal
+import logging
+import argparse
+import tempfile
+import traceback
+
+import CompressedIO
+import FastaIO
+import LinkStore
+
+logger = logging.getLogger('main.lib.DispatchService')
+
+# Scripts which can be run by the server
+Scripts = ["SeqDispatcher.py", "CheckFamily.py"]
+
+### Caches of the reference data
+# {key: value} filled by the server before accepting jobs (see warm), empty
+# in a normal run. The entries added by a job only live in its child.
+_Cache = {}
+
+
+def _file_key(Filename):
+    """Return a key which changes when a file is modified"""
+    Stat = os.stat(Filename)
+    return (os.path.abspath(Filename), Stat.st_size, Stat.st_mtime)
+
+
+def reference_targets(TargetFile, Target2FamilyFilename, TargetSpecies=()):
+    """Return (TargetNames, Target2FamilyTable, MissingTargets) of a ref transcriptome:
+    its target names, a (Target, Family) table of these targets and the targets
+    missing in the link file (added to the table as their own family)"""
+    Key = ("targets", _file_key(TargetFile), _file_key(Target2FamilyFilename), tuple(TargetSpecies))
+    if Key in _Cache:
+        return _Cache[Key]
+
+    import pandas
+    Store = None
+    if LinkStore.is_link_store(Target2FamilyFilename):
+        Store = LinkStore.LinkStore(Target2FamilyFilename)
+    if Store is not None and TargetSpecies:
+        # ParseInput indexed the names of each ref transcriptome in the store
+        TargetNames = Store.names_of_species(TargetSpecies)
+    else:
+        TargetNames = list(FastaIO.iter_headers(TargetFile))
+
+    if Store is not None:
+        # Only the targets of the ref_transcriptome are looked up in the store
+        Target2FamilyTable = pandas.DataFrame([(Target, Store.family_of(Target)) for Target in TargetNames if Target in Store],
+                                              columns=["Target", "Family"])
+        Store.close()
+    else:
+        Target2FamilyTable = pandas.read_csv(CompressedIO.open_file(Target2FamilyFilename, "r"),
+                                              sep=None, engine='python',
+                                              header=None,
+                                              names=["Target", "Family"])
+
+    KnownTargets = set(Target2FamilyTable.Target.values)
+    MissingTargets = [Target for Target in TargetNames if not Target in KnownTargets]
+    if MissingTargets:
+        MissingData = pandas.DataFrame({"Target" : MissingTargets,
+                                         "Family": MissingTargets})
+        Target2FamilyTable = pandas.concat([Target2FamilyTable, MissingData], ignore_index=True)
+
+    _Cache[Key] = (TargetNames, Target2FamilyTable, MissingTargets)
+    return _Cache[Key]
+
+
+def minimizer_index(IndexDir, FastaFile, K=15, W=10, Threads=1):
+    """Return the minimizer index of a fasta file (see Minimizer.get_index)"""
+    import Minimizer
+    Key = ("minimizers", os.path.abspath(Minimizer.index_filename(IndexDir, FastaFile, K, W)))
+    if not Key in _Cache:
+        _Cache[Key] = Minimizer.get_index(IndexDir, FastaFile, K=K, W=W, Threads=Threads)
+    return _Cache[Key]
+
+
+def warm(Request):
+    """Load the reference data of a job in the caches, from its arguments.
+    Return False if its ref transcriptome or link file is not found"""
+    Parser = argparse.ArgumentParser(add_help=False)
+    Parser.add_argument('-t', '--ref_transcriptome', type=str, default="")
+    Parser.add_argument('-t2f', '--ref_transcriptome2family', type=str, default="")
+    Parser.add_argument('-tsp', '--ref_transcriptome_species', type=str, default="")
+    # Else they would be read as -t options
+    Parser.add_argument('-tmp', type=str)
+    Parser.add_argument('-threads', type=str)
+    Parser.add_argument('--prefilter-index', type=str,
+                        default=Request["env"].get("CAARS_PREFILTER_INDEX", ""))
+    Parser.add_argument('--prefilter-k', type=int, default=15)
+    Parser.add_argument('--prefilter-w', type=int, default=10)
+    (args, _) = Parser.parse_known_args(Request["argv"])
+
+    Path = lambda Filename: os.path.join(Request["cwd"], Filename)
+    TargetFile = Path(args.ref_transcriptome)
+    Target2FamilyFilename = Path(args.ref_transcriptome2family)
+    if not (os.path.isfile(TargetFile) and os.path.isfile(Target2FamilyFilename)):
+        return False
+    TargetSpecies = [Species for Species in args.ref_transcriptome_species.split(",") if Species]
+    reference_targets(TargetFile, Target2FamilyFilename, TargetSpecies)
+    if Request["script"] == "SeqDispatcher.py" and args.prefilter_index:
+        minimizer_index(Path(args.prefilter_index), TargetFile, K=args.prefilter_k, W=args.prefilter_w)
+    return True
+
+
+### Protocol
+def write_message(Connection, Message):
+    Connection.sendall(json.dumps(Message) + "\n")
+
+
+def read_message(Connection):
+    """Return the next message of a connection, None if it is closed"""
+    Line = Connection.makefile("rb").readline()
+    if not Line:
+        return None
+    return json.loads(Line)
+
+
+def send_request(SocketName, Script, Argv):
+    """Run a script in the server listening on SocketName and return its response,
+    None if no server listens on SocketName.
+
+    An IOError is raised if the connection is lost before the response: the
+    job may have failed or written part of its outputs, it must not be run
+    again."""
+    Connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        Connection.connect(SocketName)
+    except socket.error:
+        Connection.close()
+        return None
+    try:
+        write_message(Connection, {"script": Script,
+                                   "argv": Argv,
+                                   "cwd": os.getcwd(),
+                                   "env": dict(os.environ)})
+        Response = read_message(Connection)
+    except socket.error as e:
+        raise IOError("The connection to the dispatch server on %s was lost: %s" %(SocketName, e))
+    finally:
+        Connection.close()
+    if Response is None:
+        raise IOError("The connection to the dispatch server on %s was closed before the end of the job" %SocketName)
+    return Response
+
+
+class DispatchServer(object):
+    """Define a server of SeqDispatcher and CheckFamily jobs on a Unix socket.
+
+    Each job is run in a forked child, at most MaxJobs jobs run at the same
+    time. The reference data are preloaded with warm() before serve_forever()."""
+    def __init__(self, SocketName, ScriptDir, MaxJobs=1):
+        self.SocketName = SocketName
+        self.ScriptDir = ScriptDir
+        self.MaxJobs = MaxJobs
+        self.Children = set()
+        self.Socket = None
+
+    def bind(self):
+        if os.path.exists(self.SocketName):
+            Probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                Probe.connect(self.SocketName)
+                raise ValueError("A server already listens on %s" %self.SocketName)
+            except socket.error:
+                # Socket left by a server which has been stopped
+                os.remove(self.SocketName)
+            finally:
+                Probe.close()
+        self.Socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.Socket.bind(self.SocketName)
+        os.chmod(self.SocketName, 0600)
+        self.Socket.listen(16)
+        # Wake up regularly to reap the finished jobs
+        self.Socket.settimeout(1)
+        logger.info("Listen on %s", self.SocketName)
+
+    def reap(self, Block=False):
+        while self.Children:
+            try:
+                (Pid, Status) = os.waitpid(-1, 0 if Block else os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not Pid:
+                return
+            self.Children.discard(Pid)
+            logger.debug("Job %s ended with status %s", Pid, Status)
+            if Block:
+                return
+
+    def serve_forever(self):
+        try:
+            while True:
+                self.reap()
+                try:
+                    (Connection, _) = self.Socket.accept()
+                except socket.timeout:
+                    continue
+                Connection.settimeout(None)
+                try:
+                    self.handle(Connection)
+                finally:
+                    Connection.close()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.Socket is not None:
+            self.Socket.close()
+            self.Socket = None
+            os.remove(self.SocketName)
+
+    def handle(self, Connection):
+        Request = read_message(Connection)
+        if Request is None:
+            return
+        if not Request.get("script") in Scripts:
+            logger.error("Unknown script: %s", Request.get("script"))
+            write_message(Connection, {"returncode": 1, "stdout": "",
+                                       "stderr": "Unknown script: %s\n" %Request.get("script")})
+            return
+        logger.info("Run %s %s in %s", Request["script"], " ".join(Request["argv"]), Request["cwd"])
+        while len(self.Children) >= self.MaxJobs:
+            self.reap(Block=True)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        Pid = os.fork()
+        if Pid:
+            self.Children.add(Pid)
+            return
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.Socket.close()
+            Returncode = self.run(Connection, Request)
+        except BaseException:
+            Returncode = 1
+        finally:
+            os._exit(Returncode)
+
+    def run(self, Connection, Request):
+        """Run the script of a request in this (child) process and send its response"""
+        os.chdir(Request["cwd"])
+        os.environ.clear()
+        os.environ.update(Request["env"])
+        # The handlers of the server would log the job a second time
+        for Handler in logging.getLogger("main").handlers[:]:
+            logging.getLogger("main").removeHandler(Handler)
+        Out = tempfile.TemporaryFile()
+        Err = tempfile.TemporaryFile()
+        os.dup2(Out.fileno(), 1)
+        os.dup2(Err.fileno(), 2)
+        ScriptFile = os.path.join(self.ScriptDir, Request["script"])
+        sys.argv = [ScriptFile] + Request["argv"]
+        Returncode = 0
+        try:
+            runpy.run_path(ScriptFile, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None:
+                Returncode = 0
+            elif isinstance(e.code, int):
+                Returncode = e.code
+            else:
+                sys.stderr.write("%s\n" %e.code)
+                Returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            Returncode = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        Out.seek(0)
+        Err.seek(0)
+        write_message(Connection, {"returncode": Returncode,
+                                   "stdout": Out.read().decode("utf-8", "replace"),
+                                   "stderr": Err.read().decode("utf-8", "replace")})
+        return Returncode
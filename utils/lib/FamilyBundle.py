@@ -0,0 +1,238 @@
+# File: FamilyBundle.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import os
+import io
+import mmap
+import shutil
+import struct
+import logging
+
+import numpy
+
+import CompressedIO
+
+logger = logging.getLogger('main.lib.FamilyBundle')
+
+# Bundle file layout (little endian):
+#   magic (8 bytes), version (uint32), padding (uint32),
+#   the data of the members, appended one after the other,
+#   then the index: member names (separated by "\n") padded to 8 bytes,
+#   member offsets (uint64, nb) and member sizes (uint64, nb), sorted by name,
+#   and the footer: number of members, index offset and size of the names
+#   (uint64 each), magic (8 bytes).
+# Appending members rewrites the index after the new data.
+Magic = b"CAARSBDL"
+Version = 1
+HeaderStruct = struct.Struct("<8sII")
+FooterStruct = struct.Struct("<QQQ8s")
+
+# A member of a bundle is named <bundle file>::<member name>
+MemberSeparator = "::"
+
+
+def _padding(Size):
+    return b"\0" * (-Size % 8)
+
+
+def member_path(Filename, Member):
+    return Filename + MemberSeparator + Member
+
+
+def split_member_path(Path):
+    """Return (bundle file, member name) of a member path, (Path, None) for a plain file"""
+    if MemberSeparator in Path:
+        return tuple(Path.split(MemberSeparator, 1))
+    return (Path, None)
+
+
+def is_bundle(Filename):
+    """Return True if Filename is a bundle written by BundleWriter"""
+    if not os.path.isfile(Filename) or os.path.getsize(Filename) < HeaderStruct.size + FooterStruct.size:
+        return False
+    with open(Filename, "rb") as Handle:
+        if Handle.read(len(Magic)) != Magic:
+            return False
+        Handle.seek(-len(Magic), os.SEEK_END)
+        return Handle.read(len(Magic)) == Magic
+
+
+def _read_index(Handle, Filename):
+    """Return ({member: (offset, size)}, index offset) of an opened bundle"""
+    Handle.seek(-FooterStruct.size, os.SEEK_END)
+    (Nb, IndexOffset, NamesSize, magic) = FooterStruct.unpack(Handle.read(FooterStruct.size))
+    if magic != Magic:
+        raise ValueError("%s is not a bundle" %Filename)
+    Handle.seek(IndexOffset)
+    Names = Handle.read(NamesSize).split(b"\n") if Nb else []
+    Handle.read(-NamesSize % 8)
+    Arrays = numpy.frombuffer(Handle.read(16 * Nb), dtype="<u8")
+    return (dict(zip(Names, zip(Arrays[:Nb].tolist(), Arrays[Nb:].tolist()))), IndexOffset)
+
+
+class BundleWriter(object):
+    """Define a writer of the members of a bundle: many small files (e.g. the
+    sequences of each family) stored in a single file with an index.
+
+    With Append, the members are added to those of an existing bundle, a
+    member written again replaces the previous one."""
+    def __init__(self, Filename, Append=False):
+        self.Filename = Filename
+        self.Members = {}
+        if Append and is_bundle(Filename):
+            self.Handle = open(Filename, "r+b")
+            (self.Members, IndexOffset) = _read_index(self.Handle, Filename)
+            self.Handle.seek(IndexOffset)
+            self.Handle.truncate()
+        else:
+            self.Handle = open(Filename, "wb")
+            self.Handle.write(HeaderStruct.pack(Magic, Version, 0))
+
+    def write(self, Name, Data):
+        """Write the data of a member"""
+        if b"\n" in Name or MemberSeparator in Name:
+            raise ValueError("Invalid member name: %s" %Name)
+        self.Members[Name] = (self.Handle.tell(), len(Data))
+        self.Handle.write(Data)
+
+    def write_file(self, Name, Filename):
+        """Write the content of a file as a member"""
+        Offset = self.Handle.tell()
+        with open(Filename, "rb") as Input:
+            shutil.copyfileobj(Input, self.Handle)
+        self.Members[Name] = (Offset, self.Handle.tell() - Offset)
+
+    def close(self):
+        if self.Handle is None:
+            return
+        Names = sorted(self.Members)
+        NamesBlob = b"\n".join(Names)
+        IndexOffset = self.Handle.tell()
+        self.Handle.write(NamesBlob + _padding(len(NamesBlob)))
+        self.Handle.write(numpy.array([self.Members[Name][0] for Name in Names] +
+                                      [self.Members[Name][1] for Name in Names], dtype="<u8").tostring())
+        self.Handle.write(FooterStruct.pack(len(Names), IndexOffset, len(NamesBlob), Magic))
+        self.Handle.close()
+        self.Handle = None
+        logger.debug("%s members written in %s", len(Names), self.Filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, Type, Value, Traceback):
+        self.close()
+
+
+class FamilyBundle(object):
+    """Read only, memory-mapped access to the members of a bundle"""
+    def __init__(self, Filename):
+        self.Filename = Filename
+        with open(Filename, "rb") as Handle:
+            (self.Members, _) = _read_index(Handle, Filename)
+            self._Map = mmap.mmap(Handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.Members)
+
+    def __contains__(self, Name):
+        return Name in self.Members
+
+    def names(self):
+        return sorted(self.Members)
+
+    def size(self, Name):
+        return self.Members[Name][1]
+
+    def get(self, Name, default=None):
+        """Return the data of a member"""
+        if not Name in self.Members:
+            return default
+        (Offset, Size) = self.Members[Name]
+        return self._Map[Offset:Offset + Size]
+
+    def close(self):
+        self._Map.close()
+
+
+def member_size(Path):
+    """Return the size of a file or of a bundle member, -1 if it does not exist"""
+    (Filename, Member) = split_member_path(Path)
+    if not os.path.isfile(Filename):
+        return -1
+    if Member is None:
+        return os.path.getsize(Filename)
+    Bundle = FamilyBundle(Filename)
+    try:
+        return Bundle.size(Member) if Member in Bundle else -1
+    finally:
+        Bundle.close()
+
+
+def open_member(Path, Threads=1):
+    """Open a file (compressed or not) or a bundle member for reading"""
+    (Filename, Member) = split_member_path(Path)
+    if Member is None:
+        return CompressedIO.open_file(Filename, "rb", Threads=Threads)
+    Bundle = FamilyBundle(Filename)
+    try:
+        Data = Bundle.get(Member)
+    finally:
+        Bundle.close()
+    if Data is None:
+        raise IOError("No member %s in %s" %(Member, Filename))
+    return io.BytesIO(Data)
+
+
+def concatenate(Paths, Output):
+    """Write the content of files and bundle members in an opened file, the missing ones are skipped"""
+    # Each bundle is opened once
+    Bundles = {}
+    try:
+        for Path in Paths:
+            (Filename, Member) = split_member_path(Path)
+            if not os.path.isfile(Filename):
+                logger.debug("%s does not exist", Path)
+            elif Member is None:
+                with CompressedIO.open_file(Filename, "rb") as Input:
+                    shutil.copyfileobj(Input, Output)
+            else:
+                if not Filename in Bundles:
+                    Bundles[Filename] = FamilyBundle(Filename)
+                Data = Bundles[Filename].get(Member)
+                if Data is None:
+                    logger.debug("%s does not exist", Path)
+                else:
+                    Output.write(Data)
+    finally:
+        for Bundle in Bundles.values():
+            Bundle.close()
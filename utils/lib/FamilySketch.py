@@ -0,0 +1,148 @@
+# File: FamilySketch.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import os
+import hashlib
+import logging
+
+import numpy
+
+import FastaIO
+import Minimizer
+
+logger = logging.getLogger('main.lib.FamilySketch')
+
+Version = 1
+
+
+def kmer_hashes(Sequences, K=21, Scale=20):
+    """Return the sorted unique hashes of the canonical k-mers of sequences kept by
+    a FracMinHash sketch: the hashes below 1/Scale of the hash space"""
+    Threshold = numpy.uint64((2 ** 64 - 1) // Scale)
+    # Each k-mer is the minimizer of its own window
+    Hashes = [Minimizer.minimizers(Sequence, K=K, W=1)[0] for Sequence in Sequences]
+    Hashes = numpy.unique(numpy.concatenate(Hashes or [numpy.zeros(0, dtype=numpy.uint64)]))
+    return Hashes[Hashes <= Threshold]
+
+
+def sketch_filename(SketchDir, FastaFile, Target2FamilyFilename, K=21, Scale=20):
+    """Return the sketch file of the families of a ref transcriptome in SketchDir,
+    from the path, size and modification time of its fasta and link files"""
+    Fingerprint = hashlib.md5()
+    for Filename in [FastaFile, Target2FamilyFilename]:
+        Stat = os.stat(Filename)
+        Fingerprint.update("%s\t%s\t%s\n" %(os.path.abspath(Filename), Stat.st_size, int(Stat.st_mtime)))
+    Fingerprint.update("%s\t%s\t%s\n" %(K, Scale, Version))
+    return os.path.join(SketchDir, "%s.sketches.npz" %Fingerprint.hexdigest())
+
+
+def build_sketches(SketchFile, FastaFile, Target2Family, K=21, Scale=20, Threads=1):
+    """Write the sketch of each family of the targets of a fasta file in SketchFile"""
+    FamilyNames = []
+    FamilyIndexes = {}
+    Hashes = []
+    Families = []
+    for (Header, Sequence) in FastaIO.iter_fasta(FastaFile, Threads=Threads):
+        Target = FastaIO.fasta_id(Header)
+        Family = str(Target2Family.get(Target, Target))
+        if not Family in FamilyIndexes:
+            FamilyIndexes[Family] = len(FamilyNames)
+            FamilyNames.append(Family)
+        TargetHashes = kmer_hashes([Sequence], K=K, Scale=Scale)
+        Hashes.append(TargetHashes)
+        Families.append(numpy.full(len(TargetHashes), FamilyIndexes[Family], dtype=numpy.int32))
+    Hashes = numpy.concatenate(Hashes or [numpy.zeros(0, dtype=numpy.uint64)])
+    Families = numpy.concatenate(Families or [numpy.zeros(0, dtype=numpy.int32)])
+    # Each hash is kept once by family, sorted by hash
+    Order = numpy.lexsort((Families, Hashes))
+    (Hashes, Families) = (Hashes[Order], Families[Order])
+    Unique = numpy.ones(len(Hashes), dtype=bool)
+    Unique[1:] = (Hashes[1:] != Hashes[:-1]) | (Families[1:] != Families[:-1])
+    (Hashes, Families) = (Hashes[Unique], Families[Unique])
+    # numpy.savez adds the .npz extension to names without it
+    TmpSketchFile = "%s.%s.tmp.npz" %(SketchFile[:-len(".npz")], os.getpid())
+    numpy.savez(TmpSketchFile,
+                Hashes=Hashes,
+                Families=Families,
+                FamilyNames=numpy.frombuffer("\n".join(FamilyNames), dtype=numpy.uint8),
+                Parameters=numpy.array([K, Scale, Version]))
+    # Several jobs can build the same sketches, the last renaming wins
+    os.rename(TmpSketchFile, SketchFile)
+    logger.info("Sketches of %s families (%s hashes) written in %s", len(FamilyNames), len(Hashes), SketchFile)
+
+
+class FamilySketches(object):
+    """Define the FracMinHash sketches of the families of a ref transcriptome, sorted by hash"""
+    def __init__(self, SketchFile):
+        Data = numpy.load(SketchFile)
+        self.Hashes = Data["Hashes"]
+        self.Families = Data["Families"]
+        self.FamilyNames = Data["FamilyNames"].tostring().split("\n")
+        (self.K, self.Scale, _) = [int(Value) for Value in Data["Parameters"]]
+        Data.close()
+        self.FamilyIndexes = dict((Family, i) for (i, Family) in enumerate(self.FamilyNames))
+
+    def containment(self, Hashes):
+        """Return, for each family, the fraction of Hashes found in its sketch"""
+        Left = numpy.searchsorted(self.Hashes, Hashes, side="left")
+        Counts = numpy.searchsorted(self.Hashes, Hashes, side="right") - Left
+        Entries = numpy.repeat(Left - numpy.cumsum(Counts) + Counts, Counts) + numpy.arange(Counts.sum())
+        Shared = numpy.bincount(self.Families[Entries], minlength=len(self.FamilyNames))
+        return Shared / float(max(1, len(Hashes)))
+
+    def closest(self, Sequences, Count, Expected=None):
+        """Return the Count families whose sketches contain most of the k-mers of the
+        sequences, and Expected if it is not one of them, with the rank of Expected
+        (1 for the closest family, 0 if it shares no k-mer with the sequences)"""
+        Scores = self.containment(kmer_hashes(Sequences, K=self.K, Scale=self.Scale))
+        Order = numpy.argsort(-Scores, kind="mergesort")
+        Families = [self.FamilyNames[i] for i in Order[:Count] if Scores[i] > 0]
+        Rank = 0
+        if Expected in self.FamilyIndexes and Scores[self.FamilyIndexes[Expected]] > 0:
+            Rank = 1 + int((Scores > Scores[self.FamilyIndexes[Expected]]).sum())
+        if Expected is not None and not Expected in Families:
+            Families.append(Expected)
+        return (Families, Rank)
+
+
+def get_sketches(SketchDir, FastaFile, Target2FamilyFilename, Target2Family, K=21, Scale=20, Threads=1):
+    """Return the family sketches of a ref transcriptome in SketchDir, build them if they do not exist yet"""
+    if not os.path.isdir(SketchDir):
+        os.makedirs(SketchDir)
+    SketchFile = sketch_filename(SketchDir, FastaFile, Target2FamilyFilename, K, Scale)
+    if os.path.isfile(SketchFile):
+        logger.info("Family sketches %s exist", SketchFile)
+    else:
+        logger.info("Build the family sketches %s of %s", SketchFile, FastaFile)
+        build_sketches(SketchFile, FastaFile, Target2Family, K, Scale, Threads=Threads)
+    return FamilySketches(SketchFile)
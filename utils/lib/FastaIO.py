@@ -0,0 +1,195 @@
+# File: FastaIO.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+
+import io
+
+import CompressedIO
+
+# Size of the blocks read from disk. A record is never split between two
+# yielded chunks, so the memory used is bounded by BlockSize plus the
+# length of the longest record.
+BlockSize = 1 << 20
+
+
+def fasta_id(Header):
+    """Return the sequence identifier (first word) of a fasta header"""
+    if not Header:
+        return Header
+    return Header.split(None, 1)[0]
+
+
+def _open(Source, Threads=1):
+    """Return (handle, close) for a file name (compressed or not) or an already opened file"""
+    if hasattr(Source, "read"):
+        return (Source, False)
+    return (CompressedIO.open_file(Source, "rb", Threads=Threads), True)
+
+
+def _iter_chunks(Handle):
+    """Yield chunks of the file which end at a record boundary"""
+    Pending = []
+    while True:
+        Block = Handle.read(BlockSize)
+        if not Block:
+            break
+        Cut = Block.rfind(b"\n>")
+        if Cut >= 0:
+            Cut += 1
+        elif Block[:1] == b">" and Pending and Pending[-1][-1:] == b"\n":
+            Cut = 0
+        else:
+            Pending.append(Block)
+            continue
+        Pending.append(Block[:Cut])
+        yield b"".join(Pending)
+        Pending = [Block[Cut:]]
+    if Pending:
+        yield b"".join(Pending)
+
+
+def iter_fasta(Source, strict=False, Threads=1):
+    """Yield (header, sequence) for each record of a fasta file.
+
+    The header is the line without the '>' and sequence lines are joined
+    without any white space. Data found before the first header is ignored,
+    or raises a ValueError if strict is True."""
+    (Handle, Close) = _open(Source, Threads=Threads)
+    try:
+        for Chunk in _iter_chunks(Handle):
+            Records = Chunk.split(b"\n>")
+            # Only the first chunk may not start with a header
+            if Records[0][:1] == b">":
+                Records[0] = Records[0][1:]
+            else:
+                Junk = Records.pop(0)
+                if strict and Junk.strip():
+                    raise ValueError("Sequence data before the first fasta header")
+            for Record in Records:
+                (Header, _, Sequence) = Record.partition(b"\n")
+                yield (Header.rstrip(), b"".join(Sequence.split()))
+    finally:
+        if Close:
+            Handle.close()
+
+
+def iter_fasta_string(String, strict=False):
+    """Yield (header, sequence) for each record of a fasta string"""
+    return iter_fasta(io.BytesIO(String), strict=strict)
+
+
+def iter_headers(Source, Threads=1):
+    """Yield the header of each record of a fasta file"""
+    (Handle, Close) = _open(Source, Threads=Threads)
+    try:
+        for Line in Handle:
+            if Line[:1] == b">":
+                yield Line[1:].rstrip()
+    finally:
+        if Close:
+            Handle.close()
+
+
+def load_fasta(Source, Key=None, strict=False, Threads=1):
+    """Return a dictionary {name: sequence} of all records of a fasta file.
+
+    Key is an optional function applied on each header to build the name
+    (e.g. fasta_id)."""
+    Records = iter_fasta(Source, strict=strict, Threads=Threads)
+    if Key is None:
+        return dict(Records)
+    return dict((Key(Header), Sequence) for (Header, Sequence) in Records)
+
+
+class FastaWriter(object):
+    """Stream fasta records to a buffered file.
+
+    Sequences are wrapped every Width characters through memoryview slices,
+    without building the wrapped text. With Width=0 each sequence is written
+    on a single line, which is enough for files only read by our tools.
+    The file is compressed according to Compression or to its extension."""
+    def __init__(self, Filename, Width=60, Append=False, Compression=None, Threads=1):
+        self.Filename = Filename
+        self.Width = Width
+        if Append:
+            Mode = "ab"
+        else:
+            Mode = "wb"
+        self.Handle = CompressedIO.open_file(Filename, Mode, Threads=Threads, Compression=Compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, Name, Sequence):
+        Handle = self.Handle
+        Handle.write(b">" + Name + b"\n")
+        Width = self.Width
+        Length = len(Sequence)
+        if not Width or Length <= Width:
+            Handle.write(Sequence)
+            Handle.write(b"\n")
+            return
+        View = memoryview(Sequence)
+        for i in range(0, Length, Width):
+            Handle.write(View[i:i + Width])
+            Handle.write(b"\n")
+
+    def write_records(self, Records):
+        """Write (name, sequence) pairs"""
+        for (Name, Sequence) in Records:
+            self.write(Name, Sequence)
+
+    def close(self):
+        self.Handle.close()
+
+
+def fasta_string(Records, Width=60):
+    """Return the fasta text of (name, sequence) pairs"""
+    Lines = []
+    for (Name, Sequence) in Records:
+        Lines.append(b">" + Name)
+        if not Width or len(Sequence) <= Width:
+            Lines.append(Sequence)
+        else:
+            Lines.extend(Sequence[i:i + Width] for i in range(0, len(Sequence), Width))
+    Lines.append(b"")
+    return b"\n".join(Lines) if len(Lines) > 1 else b""
+
+
+def write_fasta(Filename, Records, Width=60, Append=False, Compression=None):
+    """Write (name, sequence) pairs in a fasta file"""
+    with FastaWriter(Filename, Width=Width, Append=Append, Compression=Compression) as Writer:
+        Writer.write_records(Records)
@@ -0,0 +1,155 @@
+# File: IncrementalMerge.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import logging
+
+from ete2 import Tree
+
+import FastaIO
+
+logger = logging.getLogger('main.lib.IncrementalMerge')
+
+# Sequences of a merged sequence are found by their shared k-mers
+MemberK = 11
+MemberMinShared = 0.5
+
+
+def ungapped(Sequence):
+    return Sequence.replace("-", "").upper()
+
+
+def read_alignment(Filename):
+    """Return the (name, sequence) records of an alignment, in order"""
+    return [(FastaIO.fasta_id(Header), Sequence) for (Header, Sequence) in FastaIO.iter_fasta(Filename)]
+
+
+def read_sp2seq(Filename):
+    """Return {sequence: species} from a sp2seq file (species:sequence)"""
+    Seq2Sp = {}
+    with open(Filename, "r") as File:
+        for Line in File:
+            if ":" in Line:
+                (Sp, Seq) = Line.strip().split(":", 1)
+                Seq2Sp[Seq] = Sp
+    return Seq2Sp
+
+
+def split_merged(PreviousRecords, MergedRecords):
+    """Return (untouched names, merged records, removed names).
+
+    The untouched sequences are those of the previous alignment left as is by
+    the merge, the merged records are the new or modified sequences, and the
+    removed names the previous sequences which are not in the merged
+    alignment anymore."""
+    Previous = dict((Name, ungapped(Sequence)) for (Name, Sequence) in PreviousRecords)
+    Untouched = []
+    Merged = []
+    Names = set()
+    for (Name, Sequence) in MergedRecords:
+        Names.add(Name)
+        if Previous.get(Name) == ungapped(Sequence):
+            Untouched.append(Name)
+        else:
+            Merged.append((Name, ungapped(Sequence)))
+    Removed = [Name for (Name, _) in PreviousRecords if not Name in Names]
+    return (Untouched, Merged, Removed)
+
+
+def write_profile(Records, Names, Filename):
+    """Write the aligned records of Names without the columns only made of gaps"""
+    Names = set(Names)
+    Rows = [(Name, Sequence) for (Name, Sequence) in Records if Name in Names]
+    if Rows:
+        Length = len(Rows[0][1])
+        Kept = [i for i in range(Length) if any(Sequence[i] != "-" for (_, Sequence) in Rows)]
+        if len(Kept) < Length:
+            Rows = [(Name, "".join(Sequence[i] for i in Kept)) for (Name, Sequence) in Rows]
+    FastaIO.write_fasta(Filename, Rows, Width=0)
+    return len(Rows)
+
+
+def _kmers(Sequence, K=MemberK):
+    return set(Sequence[i:i + K] for i in range(len(Sequence) - K + 1))
+
+
+def merge_members(PreviousRecords, Removed, Merged, Seq2Sp):
+    """Return {merged name: [previous sequence names]}.
+
+    Each removed sequence is assigned to the merged sequence of its species
+    sharing the most k-mers with it. A merged sequence which kept the name of
+    one of its sequences also gets this sequence."""
+    Previous = dict(PreviousRecords)
+    MergedKmers = [(Name, Seq2Sp.get(Name), _kmers(Sequence)) for (Name, Sequence) in Merged]
+    Members = dict((Name, [Name] if Name in Previous else []) for (Name, _) in Merged)
+    for Name in Removed:
+        Kmers = _kmers(ungapped(Previous[Name]))
+        if not Kmers:
+            continue
+        Best = (MemberMinShared, None)
+        for (MergedName, Sp, MKmers) in MergedKmers:
+            if Sp == Seq2Sp.get(Name):
+                Shared = len(Kmers & MKmers) / float(len(Kmers))
+                if Shared >= Best[0]:
+                    Best = (Shared, MergedName)
+        if Best[1] is not None:
+            Members[Best[1]].append(Name)
+    return Members
+
+
+def starting_tree(TreeFilename, Names, Members, OutputTree):
+    """Write the tree of the previous iteration as a starting tree for the merged alignment.
+
+    Each merged sequence replaces the leaf of one of its sequences, the other
+    leaves which are not in Names are pruned. The sequences placed nowhere
+    are attached to the root."""
+    t = Tree(TreeFilename)
+    Leaves = dict((Leaf.name, Leaf) for Leaf in t.get_leaves())
+    for (Name, MemberNames) in Members.items():
+        if Name in Leaves:
+            continue
+        for Member in MemberNames:
+            if Member in Leaves and not Member in Names:
+                Leaf = Leaves.pop(Member)
+                Leaf.name = Name
+                Leaves[Name] = Leaf
+                break
+    Kept = [Name for Name in Names if Name in Leaves]
+    Missing = [Name for Name in Names if not Name in Leaves]
+    if len(Kept) < 3:
+        return False
+    t.prune(Kept, preserve_branch_length=True)
+    for Name in Missing:
+        t.add_child(name=Name, dist=0.1)
+    logger.debug("Starting tree: %s leaves kept, %s attached to the root", len(Kept), len(Missing))
+    t.write(format=0, outfile=OutputTree)
+    return True
@@ -0,0 +1,216 @@
+# File: LinkStore.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+
+import os
+import mmap
+import logging
+import struct
+import hashlib
+
+import numpy
+
+import CompressedIO
+
+logger = logging.getLogger('main.lib.LinkStore')
+
+# Store file layout (little endian):
+#   magic (8 bytes), version (uint32), padding (uint32), number of
+#   sequences, size of the species table, size of the family table and
+#   size of the name blob (uint64 each),
+#   species table and family table (names separated by "\n"), name blob,
+#   each padded to 8 bytes, then the arrays:
+#   name offsets in the blob (uint64, nb + 1), species codes (int32, nb),
+#   family codes (int32, nb), padded to 8 bytes, sorted name hashes
+#   (uint64, nb) and the rows of these hashes (uint64, nb).
+# A code of -1 means that the species (or family) is unknown.
+Magic = b"CAARSLNK"
+Version = 1
+HeaderStruct = struct.Struct("<8sIIQQQQ")
+
+
+def name_hash(Name):
+    """Return a 64 bits hash of a sequence name"""
+    return struct.unpack("<Q", hashlib.md5(Name).digest()[:8])[0]
+
+
+def _padding(Size):
+    return b"\0" * (-Size % 8)
+
+
+def write_link_store(Filename, Rows):
+    """Write (sequence, species, family) rows in a link store and return the number of rows.
+
+    Species and family names are stored once and referenced by integer codes."""
+    Names = []
+    SpeciesCodes = []
+    FamilyCodes = []
+    SpeciesTable = {}
+    FamilyTable = {}
+    for (Name, Species, Family) in Rows:
+        Names.append(Name)
+        SpeciesCodes.append(SpeciesTable.setdefault(Species, len(SpeciesTable)) if Species else -1)
+        FamilyCodes.append(FamilyTable.setdefault(Family, len(FamilyTable)) if Family else -1)
+
+    SpeciesBlob = b"\n".join(sorted(SpeciesTable, key=SpeciesTable.get))
+    FamilyBlob = b"\n".join(sorted(FamilyTable, key=FamilyTable.get))
+    NameBlob = b"".join(Names)
+    Offsets = numpy.zeros(len(Names) + 1, dtype="<u8")
+    numpy.cumsum([len(n) for n in Names], out=Offsets[1:])
+    Hashes = numpy.array([name_hash(n) for n in Names], dtype="<u8")
+    Order = numpy.argsort(Hashes, kind="mergesort")
+
+    with open(Filename, "wb") as Out:
+        Out.write(HeaderStruct.pack(Magic, Version, 0, len(Names),
+                                    len(SpeciesBlob), len(FamilyBlob), len(NameBlob)))
+        for Blob in (SpeciesBlob, FamilyBlob, NameBlob):
+            Out.write(Blob + _padding(len(Blob)))
+        Codes = numpy.array(SpeciesCodes + FamilyCodes, dtype="<i4").tostring()
+        Out.write(Offsets.tostring() + Codes + _padding(len(Codes)))
+        Out.write(Hashes[Order].tostring() + Order.astype("<u8").tostring())
+    logger.debug("%s links (%s species, %s families) stored in %s",
+                 len(Names), len(SpeciesTable), len(FamilyTable), Filename)
+    return len(Names)
+
+
+def is_link_store(Filename):
+    """Return True if Filename is a link store written by write_link_store"""
+    if not os.path.isfile(Filename):
+        return False
+    with open(Filename, "rb") as Handle:
+        return Handle.read(len(Magic)) == Magic
+
+
+class LinkStore(object):
+    """Read only, memory-mapped access to a link store"""
+    def __init__(self, Filename):
+        self.Filename = Filename
+        with open(Filename, "rb") as Handle:
+            self._Map = mmap.mmap(Handle.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, Nb, SpeciesSize, FamilySize, NameSize) = HeaderStruct.unpack_from(self._Map)
+        if magic != Magic or version != Version:
+            raise ValueError("%s is not a link store" %Filename)
+        Start = HeaderStruct.size
+        Blobs = []
+        for Size in (SpeciesSize, FamilySize, NameSize):
+            Blobs.append((Start, Size))
+            Start += Size + (-Size % 8)
+        (Species, Families, self._Names) = Blobs
+        self.Species = self._Map[Species[0]:Species[0] + Species[1]].split(b"\n") if Species[1] else []
+        self.Families = self._Map[Families[0]:Families[0] + Families[1]].split(b"\n") if Families[1] else []
+
+        Arrays = []
+        for (dtype, Count) in (("<u8", Nb + 1), ("<i4", Nb), ("<i4", Nb), (None, 0), ("<u8", Nb), ("<u8", Nb)):
+            if dtype is None:
+                Start += -Start % 8
+                continue
+            Arrays.append(numpy.frombuffer(self._Map, dtype=dtype, count=Count, offset=Start))
+            Start += Arrays[-1].nbytes
+        (self._Offsets, self.SpeciesCodes, self.FamilyCodes, self._Hashes, self._Rows) = Arrays
+
+    def __len__(self):
+        return len(self._Hashes)
+
+    def name(self, Row):
+        Start = self._Names[0]
+        return self._Map[Start + int(self._Offsets[Row]):Start + int(self._Offsets[Row + 1])]
+
+    def row(self, Name):
+        """Return the row of Name or -1"""
+        Hash = numpy.uint64(name_hash(Name))
+        i = int(numpy.searchsorted(self._Hashes, Hash, side="left"))
+        while i < len(self._Hashes) and self._Hashes[i] == Hash:
+            Row = int(self._Rows[i])
+            if self.name(Row) == Name:
+                return Row
+            i += 1
+        return -1
+
+    def __contains__(self, Name):
+        return self.row(Name) >= 0
+
+    def _decode(self, Table, Code, default):
+        if Code < 0:
+            return default
+        return Table[Code]
+
+    def species_of(self, Name, default=None):
+        Row = self.row(Name)
+        if Row < 0:
+            return default
+        return self._decode(self.Species, int(self.SpeciesCodes[Row]), default)
+
+    def family_of(self, Name, default=None):
+        Row = self.row(Name)
+        if Row < 0:
+            return default
+        return self._decode(self.Families, int(self.FamilyCodes[Row]), default)
+
+    def names_of_species(self, SpeciesList):
+        """Return the names of the sequences of these species, in the written order"""
+        Codes = [i for (i, Species) in enumerate(self.Species) if Species in SpeciesList]
+        return [self.name(Row) for Row in numpy.flatnonzero(numpy.in1d(self.SpeciesCodes, Codes)).tolist()]
+
+    def iter_rows(self):
+        """Yield (sequence, species, family) for each row, in the written order"""
+        for Row in range(len(self)):
+            yield (self.name(Row),
+                   self._decode(self.Species, int(self.SpeciesCodes[Row]), ""),
+                   self._decode(self.Families, int(self.FamilyCodes[Row]), ""))
+
+    def close(self):
+        # The numpy views must be released before the map can be closed
+        self._Offsets = self.SpeciesCodes = self.FamilyCodes = self._Hashes = self._Rows = None
+        self._Map.close()
+
+
+def iter_sp2seq(Filename):
+    """Yield (species, sequence) from a "Species:Sequence" link file or a link store.
+
+    Species names are interned, so that they are shared by all the links."""
+    if is_link_store(Filename):
+        Store = LinkStore(Filename)
+        try:
+            for (Name, Species, _) in Store.iter_rows():
+                yield (Species, Name)
+        finally:
+            Store.close()
+        return
+    with CompressedIO.open_file(Filename, "r") as Handle:
+        for Line in Handle:
+            Line = Line.rstrip("\n")
+            if not ":" in Line:
+                logger.debug("Line (%s) has a problem", Line)
+                continue
+            (Species, Name) = Line.split(":", 1)
+            yield (intern(Species), Name)
@@ -0,0 +1,233 @@
+# File: Minimizer.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import os
+import hashlib
+import logging
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+import FastaIO
+
+logger = logging.getLogger('main.lib.Minimizer')
+
+Version = 1
+
+# 2 bits code of the nucleotides, any other character (N, gaps) breaks the k-mers
+BaseCodes = numpy.full(256, 4, dtype=numpy.uint8)
+for (Code, Bases) in enumerate(["Aa", "Cc", "Gg", "TtUu"]):
+    for Base in Bases:
+        BaseCodes[ord(Base)] = Code
+
+# Hash of the k-mers containing an invalid character, never kept as minimizer
+Sentinel = numpy.uint64(0xffffffffffffffff)
+
+# Routes of the query sequences
+Discarded = "discarded"
+Assigned = "assigned"
+Ambiguous = "ambiguous"
+
+
+def _mix(Values):
+    """Return the 64 bits finalizer of MurmurHash3 of uint64 values"""
+    Values = Values ^ (Values >> numpy.uint64(33))
+    Values *= numpy.uint64(0xff51afd7ed558ccd)
+    Values ^= Values >> numpy.uint64(33)
+    Values *= numpy.uint64(0xc4ceb9fe1a85ec53)
+    Values ^= Values >> numpy.uint64(33)
+    return Values
+
+
+def minimizers(Sequence, K=15, W=10):
+    """Return the canonical (W, K) minimizers of a nucleotide sequence.
+
+    Return the sorted unique hashes of the minimizers (uint64) and, for
+    each of them, whether the k-mer is read on the forward strand of the
+    sequence (bool)."""
+    Codes = BaseCodes[numpy.frombuffer(Sequence, dtype=numpy.uint8)]
+    NbKmers = len(Codes) - K + 1
+    if NbKmers < 1:
+        return (numpy.zeros(0, dtype=numpy.uint64), numpy.zeros(0, dtype=bool))
+    Forward = numpy.zeros(NbKmers, dtype=numpy.uint64)
+    Reverse = numpy.zeros(NbKmers, dtype=numpy.uint64)
+    Invalid = numpy.zeros(NbKmers, dtype=bool)
+    for j in range(K):
+        Window = Codes[j:j + NbKmers]
+        Invalid |= Window > 3
+        Bits = (Window & 3).astype(numpy.uint64)
+        Forward = (Forward << numpy.uint64(2)) | Bits
+        Reverse |= (numpy.uint64(3) - Bits) << numpy.uint64(2 * j)
+    IsForward = Forward <= Reverse
+    Hashes = _mix(numpy.minimum(Forward, Reverse))
+    Hashes[Invalid] = Sentinel
+
+    # The smallest hash of each window of W consecutive k-mers
+    NbWindows = max(NbKmers - W + 1, 1)
+    Width = min(W, NbKmers)
+    Windows = as_strided(Hashes, shape=(NbWindows, Width), strides=(Hashes.strides[0], Hashes.strides[0]))
+    Positions = numpy.unique(Windows.argmin(axis=1) + numpy.arange(NbWindows))
+    Positions = Positions[Hashes[Positions] != Sentinel]
+    (Hashes, First) = numpy.unique(Hashes[Positions], return_index=True)
+    return (Hashes, IsForward[Positions[First]])
+
+
+def index_filename(IndexDir, FastaFile, K=15, W=10):
+    """Return the index file of a fasta file in IndexDir, from the path, size and modification time of the fasta file"""
+    Stat = os.stat(FastaFile)
+    Fingerprint = hashlib.md5("%s\t%s\t%s\t%s\t%s\t%s\n" %(os.path.abspath(FastaFile), Stat.st_size, int(Stat.st_mtime), K, W, Version))
+    return os.path.join(IndexDir, "%s.minimizers.npz" %Fingerprint.hexdigest())
+
+
+def build_index(IndexFile, FastaFile, K=15, W=10, Threads=1):
+    """Write the minimizers of all the sequences of a fasta file in IndexFile"""
+    TargetNames = []
+    Hashes = []
+    Forward = []
+    Targets = []
+    for (Header, Sequence) in FastaIO.iter_fasta(FastaFile, Threads=Threads):
+        (SeqHashes, SeqForward) = minimizers(Sequence, K, W)
+        Targets.append(numpy.full(len(SeqHashes), len(TargetNames), dtype=numpy.int32))
+        TargetNames.append(FastaIO.fasta_id(Header))
+        Hashes.append(SeqHashes)
+        Forward.append(SeqForward)
+    Hashes = numpy.concatenate(Hashes or [numpy.zeros(0, dtype=numpy.uint64)])
+    Order = numpy.argsort(Hashes, kind="mergesort")
+    # numpy.savez adds the .npz extension to names without it
+    TmpIndexFile = "%s.%s.tmp.npz" %(IndexFile[:-len(".npz")], os.getpid())
+    numpy.savez(TmpIndexFile,
+                Hashes=Hashes[Order],
+                Targets=numpy.concatenate(Targets or [numpy.zeros(0, dtype=numpy.int32)])[Order],
+                Forward=numpy.concatenate(Forward or [numpy.zeros(0, dtype=bool)])[Order],
+                TargetNames=numpy.frombuffer("\n".join(TargetNames), dtype=numpy.uint8),
+                Parameters=numpy.array([K, W, Version]))
+    # Several jobs can build the same index, the last renaming wins
+    os.rename(TmpIndexFile, IndexFile)
+    logger.info("Minimizer index of %s targets and %s minimizers written in %s", len(TargetNames), len(Hashes), IndexFile)
+
+
+class MinimizerIndex(object):
+    """Define an index of the minimizers of target sequences, sorted by hash"""
+    def __init__(self, IndexFile):
+        Data = numpy.load(IndexFile)
+        self.Hashes = Data["Hashes"]
+        self.Targets = Data["Targets"]
+        self.Forward = Data["Forward"]
+        self.TargetNames = Data["TargetNames"].tostring().split("\n")
+        (self.K, self.W, _) = [int(Value) for Value in Data["Parameters"]]
+        Data.close()
+
+    def __len__(self):
+        return len(self.Hashes)
+
+    def lookup(self, Hashes):
+        """Return, for each entry of the index matching one of the hashes,
+        the position of the hash and the index position"""
+        Left = numpy.searchsorted(self.Hashes, Hashes, side="left")
+        Counts = numpy.searchsorted(self.Hashes, Hashes, side="right") - Left
+        Queries = numpy.repeat(numpy.arange(len(Hashes)), Counts)
+        Entries = numpy.repeat(Left - numpy.cumsum(Counts) + Counts, Counts) + numpy.arange(Counts.sum())
+        return (Queries, Entries)
+
+
+def get_index(IndexDir, FastaFile, K=15, W=10, Threads=1):
+    """Return the minimizer index of a fasta file in IndexDir, build it if it does not exist yet"""
+    if not os.path.isdir(IndexDir):
+        os.makedirs(IndexDir)
+    IndexFile = index_filename(IndexDir, FastaFile, K, W)
+    if os.path.isfile(IndexFile):
+        logger.info("Minimizer index %s exists", IndexFile)
+    else:
+        logger.info("Build the minimizer index %s of %s", IndexFile, FastaFile)
+        build_index(IndexFile, FastaFile, K, W, Threads=Threads)
+    return MinimizerIndex(IndexFile)
+
+
+class Prefilter(object):
+    """Define the routing of query sequences from the minimizers they share with the targets.
+
+    A query sharing no minimizer with any target is discarded. A query
+    whose shared minimizers are mostly (Density) from a single family,
+    with the other families and the other strand below Ambiguity times
+    its count, is assigned to this family. All other queries are
+    ambiguous and have to be blasted."""
+    def __init__(self, Index, Target2Family, Density=0.5, Ambiguity=0.1):
+        self.Index = Index
+        self.Density = Density
+        self.Ambiguity = Ambiguity
+        self.Families = sorted(set(Target2Family.get(Target, Target) for Target in Index.TargetNames))
+        FamilyCodes = dict((Family, Code) for (Code, Family) in enumerate(self.Families))
+        self.TargetFamilies = numpy.array([FamilyCodes[Target2Family.get(Target, Target)] for Target in Index.TargetNames],
+                                          dtype=numpy.int64)
+        self.Counts = {Discarded: 0, Assigned: 0, Ambiguous: 0}
+
+    def route(self, Sequence):
+        """Return (route, family, target, reverse), the last three are only set for an assigned query"""
+        Route = self._route(Sequence)
+        self.Counts[Route[0]] += 1
+        return Route
+
+    def _route(self, Sequence):
+        (Hashes, Forward) = minimizers(Sequence, self.Index.K, self.Index.W)
+        if not len(Hashes):
+            # Too short to have a minimizer, blast decides
+            return (Ambiguous, None, None, None)
+        (Queries, Entries) = self.Index.lookup(Hashes)
+        if not len(Entries):
+            return (Discarded, None, None, None)
+
+        # Number of query minimizers shared with each family
+        Families = self.TargetFamilies[self.Index.Targets[Entries]]
+        NbFamilies = len(self.Families)
+        (Families, FamilyCounts) = numpy.unique(numpy.unique(Queries * NbFamilies + Families) % NbFamilies, return_counts=True)
+        Order = numpy.argsort(FamilyCounts)[::-1]
+        Best = FamilyCounts[Order[0]]
+        Second = FamilyCounts[Order[1]] if len(Order) > 1 else 0
+        if Best < self.Density * len(Hashes) or Second > self.Ambiguity * Best:
+            return (Ambiguous, None, None, None)
+        Family = Families[Order[0]]
+
+        # The target of the family sharing the most minimizers gives the strand
+        InFamily = self.TargetFamilies[self.Index.Targets[Entries]] == Family
+        (Targets, TargetCounts) = numpy.unique(self.Index.Targets[Entries[InFamily]], return_counts=True)
+        Target = Targets[TargetCounts.argmax()]
+        InTarget = self.Index.Targets[Entries] == Target
+        SameStrand = Forward[Queries[InTarget]] == self.Index.Forward[Entries[InTarget]]
+        NbReverse = len(SameStrand) - SameStrand.sum()
+        if min(NbReverse, SameStrand.sum()) > self.Ambiguity * len(SameStrand):
+            return (Ambiguous, None, None, None)
+        return (Assigned, self.Families[Family], self.Index.TargetNames[Target], NbReverse > SameStrand.sum())
+
+    def log_stats(self):
+        logger.info("Prefilter: %s queries discarded, %s assigned, %s ambiguous to blast",
+                    self.Counts[Discarded], self.Counts[Assigned], self.Counts[Ambiguous])
@@ -31,9 +31,10 @@
 # knowledge of the CeCILL license and that you accept its terms.
 
 import os
-import subprocess
 import logging
 
+import Runner
+
 class Fasttree(object):
     """Define an object to launch Fasttree"""
     def __init__(self, InputAliFile):
@@ -41,14 +42,17 @@ class Fasttree(object):
         self.logger.info('creating an instance of Fasttree')
         self.InputAliFile = InputAliFile
         self.OutputTree = ""
+        self.InputTree = ""
         self.QuietOption = False
         self.Gtr = False
         self.Nt = False
         self.Gamma = False
+        self.Timeout = None
 
 
-    def get_output(self, output=""):
-        Out = ""
+    def launch_async(self, output=""):
+        """Launch Fasttree in background and return the Runner.Future of its (out, err).
+        Fasttree reports its progress on stderr, err is only set if it fails"""
         command = ["fasttree"]
 
         if self.Nt:
@@ -59,6 +63,10 @@ class Fasttree(object):
             command.append("-gamma")
         if self.QuietOption:
             command.append("-quiet")
+        if self.InputTree:
+            # Starting tree, it must contain all the sequences of the alignment
+            if os.path.isfile(self.InputTree):
+                command.extend(["-intree", self.InputTree])
 
         if output:
             command.extend(["-out", output])
@@ -66,17 +74,13 @@ class Fasttree(object):
             command.extend(["-out", self.OutputTree])
 
         command.append(self.InputAliFile)
-        self.logger.debug(" ".join(command))
-        try:
-            Out = subprocess.call(command,
-                                  stdout=open("/dev/null", "w"),
-                                  stderr=open("/dev/null", "w"))
-        except:
-            os.system(
-            "echo Unexpected error when we launch fasttree:\n"
-            )
-            print " ".join(command)
-        return Out
+        return Runner.get_runner().submit(command, ErrorOnStderr=False, Timeout=self.Timeout, Logger=self.logger)
+
+    def launch(self, output=""):
+        return self.launch_async(output).result()
+
+    def get_output(self, output=""):
+        return self.launch(output)
 
 class Phylomerge(object):
     """Define an object to launch Phylomerge"""
@@ -98,9 +102,12 @@ class Phylomerge(object):
         self.BootstrapThreshold = 0
         self.OutputSequenceFile = ""
         self.OutputTaxonToSequence = ""
+        self.Timeout = None
 
 
-    def launch(self, output=""):
+    def launch_async(self, output=""):
+        """Launch Phylomerge in background and return the Runner.Future of its (out, err).
+        err is only set if it fails"""
         command = ["phylomerge",
                    "input.sequence.file=%s" %self.InputAliFile,
                    "input.method=%s" %self.InputMethod,
@@ -160,12 +167,7 @@ class Phylomerge(object):
             "output.taxon.to.sequence=%s" %self.OutputTaxonToSequence
             )
 
-        self.logger.debug(" ".join(command))
+        return Runner.get_runner().submit(command, ErrorOnStderr=False, Timeout=self.Timeout, Logger=self.logger)
 
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        (out, err) = p.communicate()
-        if err:
-            self.logger.error(err)
-        return (out, err)
+    def launch(self, output=""):
+        return self.launch_async(output).result()
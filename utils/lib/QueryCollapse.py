@@ -0,0 +1,115 @@
+# File: QueryCollapse.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import re
+import hashlib
+import logging
+
+import FastaIO
+
+logger = logging.getLogger('main.lib.QueryCollapse')
+
+# Trinity names its sequences <gene>_i<isoform>, e.g. TRINITY_DN1000_c0_g1_i2
+TrinityIsoform = re.compile(r"^(.*_c\d+_g\d+)_i\d+$")
+
+
+def gene_group(Query):
+    """Return the Trinity gene of a sequence name, None if it is not a Trinity name"""
+    Match = TrinityIsoform.match(Query)
+    if Match is None:
+        return None
+    return Match.group(1)
+
+
+class QueryCollapser(object):
+    """Define the collapsing of query sequences before a similarity search.
+
+    Only one representative of the sequences with the same content is
+    searched. With Containment, a sequence contained in another isoform of
+    the same Trinity gene is represented by this isoform too. Members
+    gives the other sequences of each representative, the search results
+    of a representative are then copied to them."""
+    def __init__(self, Containment=False):
+        self.Containment = Containment
+        self.Members = {}
+        self.Counts = {"queries": 0, "duplicates": 0, "contained": 0}
+
+    def _add_member(self, Representative, Query):
+        self.Members.setdefault(Representative, []).append(Query)
+        # The members of a collapsed representative follow it
+        self.Members[Representative].extend(self.Members.pop(Query, []))
+
+    def collapse(self, Records):
+        """Yield the (header, sequence) of the representatives of a list of (header, sequence)"""
+        Representatives = {}
+        # {gene: [(query, uppercase sequence, header, sequence)]} of the isoforms, checked at the end
+        Genes = {}
+        for (Header, Sequence) in Records:
+            self.Counts["queries"] += 1
+            Query = FastaIO.fasta_id(Header)
+            Upper = Sequence.upper()
+            Key = hashlib.sha1(Upper).digest()
+            if Key in Representatives:
+                self.Counts["duplicates"] += 1
+                self._add_member(Representatives[Key], Query)
+                continue
+            Representatives[Key] = Query
+            Gene = self.Containment and gene_group(Query)
+            if Gene:
+                Genes.setdefault(Gene, []).append((Query, Upper, Header, Sequence))
+            else:
+                yield (Header, Sequence)
+
+        for Gene in sorted(Genes):
+            Kept = []
+            # Only a longer isoform can contain another one
+            for (Query, Upper, Header, Sequence) in sorted(Genes[Gene], key=lambda Isoform: -len(Isoform[1])):
+                Container = None
+                for (Representative, RepresentativeUpper) in Kept:
+                    if Upper in RepresentativeUpper:
+                        Container = Representative
+                        break
+                if Container is None:
+                    Kept.append((Query, Upper))
+                    yield (Header, Sequence)
+                else:
+                    self.Counts["contained"] += 1
+                    self._add_member(Container, Query)
+
+    def expand(self, Query):
+        """Return the queries represented by Query, itself included"""
+        return [Query] + self.Members.get(Query, [])
+
+    def log_stats(self):
+        logger.info("Collapse: %s queries, %s duplicates and %s contained isoforms are not searched",
+                    self.Counts["queries"], self.Counts["duplicates"], self.Counts["contained"])
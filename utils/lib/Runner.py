@@ -0,0 +1,343 @@
+# File: Runner.py
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import os
+import json
+import errno
+import time
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger('main.lib.Runner')
+
+# JSON lines file receiving the resources used by each command, see set_accounting()
+AccountingFile = ""
+
+
+class Popen(subprocess.Popen):
+    """Define a subprocess.Popen keeping the resource usage (os.wait4) of the child process"""
+    def __init__(self, Command, *args, **kwargs):
+        # Sizes of the input files, before the command writes its outputs
+        self.Inputs = _input_sizes(Command)
+        self.StartTime = time.time()
+        self.EndTime = None
+        self.Rusage = None
+        # Only one thread reaps the child: poll() from the timeout or cancel
+        # threads must not collect it while communicate() waits for it
+        self._ReapLock = threading.Lock()
+        subprocess.Popen.__init__(self, Command, *args, **kwargs)
+
+    def _reaped(self, Status, Rusage):
+        self.EndTime = time.time()
+        self.Rusage = Rusage
+        self._handle_exitstatus(Status)
+
+    def poll(self):
+        # If another thread is waiting for the child, it is still running or being reaped
+        if self.returncode is None and self._ReapLock.acquire(False):
+            try:
+                if self.returncode is None:
+                    try:
+                        (Pid, Status, Rusage) = os.wait4(self.pid, os.WNOHANG)
+                    except OSError:
+                        return self.returncode
+                    if Pid == self.pid:
+                        self._reaped(Status, Rusage)
+            finally:
+                self._ReapLock.release()
+        return self.returncode
+
+    def wait(self):
+        with self._ReapLock:
+            while self.returncode is None:
+                try:
+                    (Pid, Status, Rusage) = os.wait4(self.pid, 0)
+                except OSError as Error:
+                    if Error.errno == errno.EINTR:
+                        continue
+                    if Error.errno != errno.ECHILD:
+                        raise
+                    # As subprocess.Popen.wait: the child was reaped elsewhere
+                    # (e.g. SIGCHLD ignored), its status is lost
+                    if self.returncode is None:
+                        self.returncode = 0
+                    break
+                if Pid == self.pid:
+                    self._reaped(Status, Rusage)
+        return self.returncode
+
+
+def set_accounting(LogFile):
+    """Record the resources used by each command in a JSON lines file next to LogFile (<log prefix>.resources.jsonl)"""
+    global AccountingFile
+    if LogFile:
+        AccountingFile = "%s.resources.jsonl" %os.path.splitext(LogFile)[0]
+    else:
+        AccountingFile = ""
+    return AccountingFile
+
+
+def _input_sizes(Command):
+    """Return {file: size} of the arguments (or values of key=value arguments) which are files"""
+    Sizes = {}
+    for Argument in Command[1:]:
+        Filename = Argument.split("=", 1)[-1]
+        if os.path.isfile(Filename):
+            Sizes[Filename] = os.path.getsize(Filename)
+    return Sizes
+
+
+def record(Command, Process, Threads=1):
+    """Append the wall time, cpu times and maximal RSS of a reaped Popen to the accounting file"""
+    if not AccountingFile or Process.Rusage is None:
+        return
+    Record = {"tool": os.path.basename(Command[0]),
+              "command": Command,
+              "inputs": Process.Inputs,
+              "threads": Threads,
+              "start": round(Process.StartTime, 3),
+              "wall": round(Process.EndTime - Process.StartTime, 3),
+              "user": round(Process.Rusage.ru_utime, 3),
+              "sys": round(Process.Rusage.ru_stime, 3),
+              # kilobytes on Linux
+              "max_rss_kb": Process.Rusage.ru_maxrss,
+              "returncode": Process.returncode}
+    try:
+        Line = json.dumps(Record) + "\n"
+    except ValueError as Error:
+        # e.g. a file name which is not UTF-8
+        logger.warning("The resources of %s can not be recorded: %s", Record["tool"], Error)
+        return
+    try:
+        # A single write of a line in append mode, the jobs sharing a log directory do not mix their records
+        Descriptor = os.open(AccountingFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(Descriptor, Line)
+        finally:
+            os.close(Descriptor)
+    except (IOError, OSError) as Error:
+        logger.warning("The resources of %s can not be recorded in %s: %s", Record["tool"], AccountingFile, Error)
+
+
+class Future(object):
+    """Define the pending result of a job launched by a Runner.
+
+    The result of a command is (out, err) like the launch() methods of the
+    wrappers: err holds the error message, empty if the command succeeded."""
+    def __init__(self, Description):
+        self.Description = Description
+        self.Process = None
+        self.Started = False
+        self.Cancelled = False
+        self.TimedOut = False
+        self._Result = None
+        self._Exception = None
+        self._Done = threading.Event()
+        self._Lock = threading.Lock()
+        self._Callbacks = []
+
+    def cancel(self):
+        """Cancel the job if it is still waiting for threads, or kill its command if it is running.
+        Return False if the job is done or is a running function"""
+        with self._Lock:
+            if self._Done.is_set() or (self.Started and self.Process is None):
+                return False
+            self.Cancelled = True
+            if self.Process is not None and self.Process.poll() is None:
+                self.Process.kill()
+        return True
+
+    def cancelled(self):
+        return self.Cancelled
+
+    def done(self):
+        return self._Done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job and return its result, raise the exception of a failed function"""
+        if not self._Done.wait(timeout):
+            raise RuntimeError("%s is not done after %s seconds" %(self.Description, timeout))
+        if self._Exception is not None:
+            raise self._Exception
+        return self._Result
+
+    def exception(self, timeout=None):
+        if not self._Done.wait(timeout):
+            raise RuntimeError("%s is not done after %s seconds" %(self.Description, timeout))
+        return self._Exception
+
+    def add_done_callback(self, Function):
+        """Call Function(future) once the job is done"""
+        with self._Lock:
+            if not self._Done.is_set():
+                self._Callbacks.append(Function)
+                return
+        Function(self)
+
+    def _set(self, Result=None, Exception=None):
+        with self._Lock:
+            self._Result = Result
+            self._Exception = Exception
+            self._Done.set()
+            Callbacks = self._Callbacks
+            self._Callbacks = []
+        for Function in Callbacks:
+            Function(self)
+
+
+class Runner(object):
+    """Define a runner of external commands in background threads, within a budget of threads.
+
+    A command launched with n threads waits until n threads of the budget
+    (at most the whole budget) are free, so independent commands overlap
+    without overloading the node. Functions launching commands themselves
+    (call()) do not use the budget."""
+    def __init__(self, Threads=1):
+        self.Threads = max(1, Threads)
+        self.Free = self.Threads
+        self.Condition = threading.Condition()
+
+    def _acquire(self, Future, Threads):
+        with self.Condition:
+            while self.Free < Threads and not Future.Cancelled:
+                self.Condition.wait(0.1)
+            if Future.Cancelled:
+                return False
+            self.Free -= Threads
+            return True
+
+    def _release(self, Threads):
+        with self.Condition:
+            self.Free += Threads
+            self.Condition.notify_all()
+
+    def _run(self, Future, Command, Threads, Timeout, ErrorOnStderr, Stdout, Logger):
+        Threads = min(max(1, Threads), self.Threads)
+        if not self._acquire(Future, Threads):
+            Future._set(("", "%s cancelled" %Future.Description))
+            return
+        (out, err) = ("", "")
+        Timer = None
+        try:
+            with Future._Lock:
+                Future.Started = True
+                if not Future.Cancelled:
+                    Logger.debug(" ".join(Command))
+                    Future.Process = Popen(Command,
+                                           stdout=Stdout or subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+            if Future.Process is not None:
+                if Timeout:
+                    Timer = threading.Timer(Timeout, self._kill_on_timeout, [Future])
+                    Timer.start()
+                (out, err) = Future.Process.communicate()
+                record(Command, Future.Process, Threads)
+                out = out or ""
+                if not ErrorOnStderr:
+                    err = ""
+                if Future.TimedOut:
+                    err = ("%s killed after %s seconds\n%s" %(Future.Description, Timeout, err)).rstrip()
+                elif Future.Cancelled:
+                    err = ("%s cancelled\n%s" %(Future.Description, err)).rstrip()
+                elif Future.Process.returncode and not err:
+                    err = "%s exited with code %s" %(Future.Description, Future.Process.returncode)
+            else:
+                err = "%s cancelled" %Future.Description
+        except OSError as Error:
+            err = "%s could not be launched: %s" %(Future.Description, Error)
+        except Exception as Error:
+            # The Future is always set, else result() would wait forever
+            err = "%s failed: %s" %(Future.Description, Error)
+        finally:
+            if Timer is not None:
+                Timer.cancel()
+            self._release(Threads)
+        if err:
+            Logger.error(err)
+        Future._set((out, err))
+
+    def _kill_on_timeout(self, Future):
+        with Future._Lock:
+            if Future.Process.poll() is None:
+                Future.TimedOut = True
+                Future.Process.kill()
+
+    def submit(self, Command, Threads=1, Timeout=None, ErrorOnStderr=True, Stdout=None, Logger=logger):
+        """Launch a command in background and return its Future.
+
+        Command is killed after Timeout seconds. err is the stderr of the
+        command if ErrorOnStderr, else a message if it exited with an error.
+        Stdout is an optional file object receiving the output of the command."""
+        NewFuture = Future(Command[0])
+        Thread = threading.Thread(target=self._run, args=(NewFuture, Command, Threads, Timeout, ErrorOnStderr, Stdout, Logger))
+        Thread.daemon = True
+        Thread.start()
+        return NewFuture
+
+    def call(self, Function, *args, **kwargs):
+        """Call a function in background and return its Future"""
+        NewFuture = Future(getattr(Function, "__name__", "function"))
+        def target():
+            with NewFuture._Lock:
+                NewFuture.Started = True
+            try:
+                NewFuture._set(Function(*args, **kwargs))
+            except Exception as Error:
+                NewFuture._set(Exception=Error)
+        Thread = threading.Thread(target=target)
+        Thread.daemon = True
+        Thread.start()
+        return NewFuture
+
+    def run(self, Command, **kwargs):
+        """Launch a command and wait for its (out, err)"""
+        return self.submit(Command, **kwargs).result()
+
+
+def wait_all(Futures):
+    """Wait for all futures and return their results in order"""
+    return [Future.result() for Future in Futures]
+
+
+DefaultRunner = Runner()
+
+def set_threads(Threads):
+    """Set the thread budget of the runner shared by all wrappers"""
+    with DefaultRunner.Condition:
+        DefaultRunner.Free += max(1, Threads) - DefaultRunner.Threads
+        DefaultRunner.Threads = max(1, Threads)
+        DefaultRunner.Condition.notify_all()
+
+def get_runner():
+    return DefaultRunner
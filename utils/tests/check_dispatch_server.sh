@@ -0,0 +1,127 @@
+#!/bin/bash
+# File: check_dispatch_server.sh
+# Created by: agent
+# Created on: October 2026
+#
+#
+# Copyright 2026 agent
+# This software is a computer program whose purpose is to assembly
+# sequences from RNA-Seq data (paired-end or single-end) using one or
+# more reference homologous sequences.
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+# Check offline that a SeqDispatcher.py job run by DispatchServer.py through
+# DispatchClient.py writes the same outputs as a direct run, and that the
+# client runs the job itself when no server listens. blastn and makeblastdb
+# are replaced by stubs, so that only python, numpy and pandas are needed.
+#
+#     utils/tests/check_dispatch_server.sh
+#
+# PYTHON selects the python 2 interpreter (default: python2).
+
+set -e
+
+PYTHON=${PYTHON:-python2}
+UTILS=$(cd "$(dirname "$0")/.." && pwd)
+TMP=$(mktemp -d -t check_dispatch_server.XXXXXX)
+SERVER=
+
+cleanup() {
+    [ -n "$SERVER" ] && kill "$SERVER" 2>/dev/null && wait "$SERVER" 2>/dev/null
+    rm -rf "$TMP"
+}
+trap cleanup EXIT
+
+### Stubs of the blast programs
+mkdir "$TMP/stubbin"
+# blastn: a hit of each query on the target t<length % 10>
+cat > "$TMP/stubbin/blastn" <<'STUB'
+#!/bin/bash
+out=/dev/stdout
+while [ $# -gt 0 ]; do case "$1" in -out) out=$2;; -query) query=$2;; esac; shift; done
+awk 'function hit() {if (n != "") printf "%s\tt%d\t99\t%d\t0\t0\t1\t%d\t1\t%d\t1e-10\t%d\n", n, l % 10, l, l, l, 2 * l}
+     /^>/ {hit(); n = substr($1, 2); l = 0; next}
+     {l += length($0)}
+     END {hit()}' "$query" > "$out"
+STUB
+# makeblastdb: empty volume files
+cat > "$TMP/stubbin/makeblastdb" <<'STUB'
+#!/bin/bash
+while [ $# -gt 0 ]; do case "$1" in -out) out=$2;; esac; shift; done
+for e in nin nhr nsq; do echo x > "$out.$e"; done
+STUB
+chmod +x "$TMP/stubbin/blastn" "$TMP/stubbin/makeblastdb"
+
+export PATH="$TMP/stubbin:$UTILS/bin:$PATH"
+export PYTHONPATH="$UTILS/lib${PYTHONPATH:+:$PYTHONPATH}"
+unset CAARS_DISPATCHD
+
+### Reference transcriptome, families and queries of two samples
+cd "$TMP"
+awk 'BEGIN {for (i = 0; i < 10; i++) {print ">t" i; print "ACGTACGTACGT"; print "t" i "\tF" i % 4 > "t2f.tsv"}}' > t.fa
+for Sample in 0 1; do
+    awk -v s=$Sample 'BEGIN {srand(s + 1); for (i = 0; i < 30; i++) {print ">q" i; l = 20 + int(rand() * 40); q = ""; for (j = 0; j < l; j++) q = q substr("ACGT", 1 + int(rand() * 4), 1); print q}}' > q$Sample.fa
+done
+mkdir -p direct/S1 direct/S2 served/S1 served/S2 fallback/S1 fallback/S2
+
+Args="-q q0.fa,q1.fa -qs A,B -qid S1,S2 -t t.fa -t2f t2f.tsv --sp2seq_tab_out_by_family --tab_out_one_file --bundle -threads 2"
+
+### Direct run
+"$PYTHON" "$UTILS/bin/SeqDispatcher.py" $Args -out direct/S1/T.S1,direct/S2/T.S2 -tmp "$TMP/tmp_direct" -log direct.log
+
+if [ ! -s direct/S1/T.S1.bundle ]; then
+    echo "FAIL: the direct run wrote no family"; exit 1
+fi
+
+### Run by the server
+"$PYTHON" "$UTILS/bin/DispatchServer.py" -s "$TMP/d.sock" -j 2 -log server.log \
+    --preload "SeqDispatcher.py -t t.fa -t2f t2f.tsv" &
+SERVER=$!
+for i in $(seq 50); do [ -S "$TMP/d.sock" ] && break; sleep 0.2; done
+if [ ! -S "$TMP/d.sock" ]; then
+    echo "FAIL: the server does not listen on $TMP/d.sock"; cat server.log; exit 1
+fi
+CAARS_DISPATCHD="$TMP/d.sock" "$PYTHON" "$UTILS/bin/DispatchClient.py" SeqDispatcher.py $Args \
+    -out served/S1/T.S1,served/S2/T.S2 -tmp "$TMP/tmp_served" -log served.log
+if ! grep -q "Run SeqDispatcher.py" server.log; then
+    echo "FAIL: the job was not run by the server"; exit 1
+fi
+
+### Run by the client when no server listens
+kill "$SERVER"; wait "$SERVER" 2>/dev/null || true; SERVER=
+CAARS_DISPATCHD="$TMP/d.sock" "$PYTHON" "$UTILS/bin/DispatchClient.py" SeqDispatcher.py $Args \
+    -out fallback/S1/T.S1,fallback/S2/T.S2 -tmp "$TMP/tmp_fallback" -log fallback.log
+
+Status=0
+for Run in served fallback; do
+    if diff -r direct $Run > /dev/null; then
+        echo "OK: $Run outputs are identical to the direct run"
+    else
+        echo "FAIL: $Run outputs differ from the direct run"
+        diff -r direct $Run | head -20
+        Status=1
+    fi
+done
+exit $Status